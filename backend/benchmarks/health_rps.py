@@ -0,0 +1,54 @@
+"""health_rps.py
+Measures in-process requests per second on `/health`, i.e. the fixed per-request cost of the middleware stack.
+
+Requests go through httpx's ASGI transport (no sockets), from `--concurrency` concurrent clients for `--duration`
+seconds. Run from the 'backend' directory:
+
+    LOG_LEVEL=INFO python -m benchmarks.health_rps --duration 10
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("ENVIRONMENT", "production")
+
+
+async def run(duration: float, concurrency: int) -> int:
+    import httpx
+    from linkpulse.app import app
+
+    transport = httpx.ASGITransport(app=app)  # type: ignore
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        completed = 0
+        deadline = time.perf_counter() + duration
+
+        async def worker() -> None:
+            nonlocal completed
+            while time.perf_counter() < deadline:
+                response = await client.get("/health")
+                assert response.status_code == 200, response.text
+                completed += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return completed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    # Warm up imports & code paths
+    asyncio.run(run(1, args.concurrency))
+
+    completed = asyncio.run(run(args.duration, args.concurrency))
+    print(f"/health: {completed / args.duration:.0f} requests/second ({completed} in {args.duration:.0f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""ratelimit_memory.py
+Measures the memory cost of rate limiting many distinct keys (e.g. a scan from a large botnet), per strategy.
+
+Each key is hit once against "6/hour" (so none expire during the run), and the memory retained afterwards is measured with `tracemalloc` and
+extrapolated to one million keys. A capped strategy stops growing at its cap, so its total is reported as-is.
+Run from the 'backend' directory:
+
+    python -m benchmarks.ratelimit_memory --keys 200000
+"""
+
+import argparse
+import asyncio
+import gc
+import tracemalloc
+from typing import Any, Callable
+
+from limits import parse
+from limits.aio.storage import MemoryStorage
+from limits.aio.strategies import FixedWindowRateLimiter, MovingWindowRateLimiter
+
+
+def measure(name: str, create: Callable[[], Any], keys: int) -> None:
+    limit = parse("6/hour")
+
+    async def run() -> Any:
+        limiter = create()
+        for i in range(keys):
+            await limiter.hit(limit, f"203.0.{i >> 8 & 255}.{i & 255}.{i >> 16}")
+        return limiter
+
+    gc.collect()
+    tracemalloc.start()
+    limiter = asyncio.run(run())
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    per_key = retained / keys
+    print(
+        f"{name:<22} {retained / 2**20:7.1f} MiB retained"
+        f" {per_key:7.1f} B/key {per_key * 1_000_000 / 2**20:8.1f} MiB per million keys"
+    )
+    del limiter
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--keys", type=int, default=200_000)
+    parser.add_argument("--max-keys", type=int, default=100_000, help="The GCRA strategy's key cap")
+    args = parser.parse_args()
+
+    from linkpulse.ratelimit import GCRARateLimiter
+
+    measure("moving-window (memory)", lambda: MovingWindowRateLimiter(MemoryStorage()), args.keys)
+    measure("fixed-window (memory)", lambda: FixedWindowRateLimiter(MemoryStorage()), args.keys)
+    measure("gcra (uncapped)", lambda: GCRARateLimiter(maxsize=args.keys), args.keys)
+    measure(f"gcra (cap {args.max_keys})", lambda: GCRARateLimiter(maxsize=args.max_keys), args.keys)
+
+
+if __name__ == "__main__":
+    main()
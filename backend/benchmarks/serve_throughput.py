@@ -0,0 +1,154 @@
+"""serve_throughput.py
+Compares the throughput of `python -m linkpulse serve` between event loop & HTTP parser implementations
+(`SERVER_LOOP`, `SERVER_HTTP`), on `/health` and `/api/session`.
+
+Each configuration is served by a real server process on a local port, with `--workers` workers. Load comes from
+`--connections` keep-alive connections, driven by a minimal HTTP/1.1 client so the client isn't the bottleneck.
+Implementations that aren't installed (`uvloop`, `httptools`) are skipped. Requires `DATABASE_URL`; run from the
+'backend' directory:
+
+    python -m benchmarks.serve_throughput --duration 10
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+os.environ.setdefault("ENVIRONMENT", "production")
+
+# (SERVER_LOOP, SERVER_HTTP)
+CONFIGURATIONS = [("asyncio", "h11"), ("asyncio", "httptools"), ("uvloop", "h11"), ("uvloop", "httptools")]
+PATHS = ["/health", "/api/session"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, loop: str, http: str, workers: int) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "HOST": "127.0.0.1",
+        "PORT": str(port),
+        "WEB_CONCURRENCY": str(workers),
+        "WORKER_STAGGER": "0",
+        "SERVER_LOOP": loop,
+        "SERVER_HTTP": http,
+        "LOG_LEVEL": "WARNING",
+    }
+    server = subprocess.Popen([sys.executable, "-m", "linkpulse", "serve"], env=env)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                # Give the remaining workers a moment to come up too
+                time.sleep(1)
+                return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Server didn't start")
+
+
+async def load(
+    port: int, path: str, cookie: Optional[str], duration: float, connections: int
+) -> Tuple[int, int]:
+    """Make requests over keep-alive connections for `duration` seconds; returns (completed, failed)."""
+    request = f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+    if cookie is not None:
+        request += f"Cookie: session={cookie}\r\n"
+    payload = (request + "\r\n").encode()
+
+    completed = failed = 0
+    deadline = time.perf_counter() + duration
+
+    async def connection() -> None:
+        nonlocal completed, failed
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            while time.perf_counter() < deadline:
+                writer.write(payload)
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                await reader.readexactly(length)
+                if head.startswith(b"HTTP/1.1 200"):
+                    completed += 1
+                else:
+                    failed += 1
+        finally:
+            writer.close()
+
+    await asyncio.gather(*(connection() for _ in range(connections)))
+    return completed, failed
+
+
+def login(port: int, email: str) -> str:
+    response = httpx.post(f"http://127.0.0.1:{port}/api/login", json={"email": email, "password": "password"})
+    assert response.status_code == 200, response.text
+    return response.cookies["session"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    from linkpulse.hashing import hasher
+    from linkpulse.models import User
+    from linkpulse.tests.random import random_email
+
+    user = User.create(email=random_email(), password_hash=hasher.hash("password"))
+    results: Dict[Tuple[str, str], List[float]] = {}
+    try:
+        for loop, http in CONFIGURATIONS:
+            missing = [name for name in (loop, http) if importlib.util.find_spec(name) is None]
+            if len(missing) > 0:
+                print(f"Skipping {loop}/{http}: {', '.join(missing)} not installed")
+                continue
+
+            port = free_port()
+            server = start_server(port, loop, http, args.workers)
+            try:
+                cookie = login(port, user.email)
+                rates = []
+                for path in PATHS:
+                    session = cookie if path == "/api/session" else None
+                    # Warm up connections & code paths
+                    asyncio.run(load(port, path, session, 1, args.connections))
+                    completed, failed = asyncio.run(
+                        load(port, path, session, args.duration, args.connections)
+                    )
+                    assert failed == 0, f"{failed} requests to {path} failed"
+                    rates.append(completed / args.duration)
+                results[(loop, http)] = rates
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        user.delete_instance()
+
+    print(f"\n{'loop/http':<20}" + "".join(f"{path:>16}" for path in PATHS) + "  (requests/second)")
+    for (loop, http), rates in results.items():
+        print(f"{loop + '/' + http:<20}" + "".join(f"{rate:>16.0f}" for rate in rates))
+
+
+if __name__ == "__main__":
+    main()
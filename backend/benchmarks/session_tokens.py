@@ -0,0 +1,75 @@
+"""session_tokens.py
+Compares `/api/session` latency between opaque (database-backed) and signed session tokens.
+
+Requests are made in-process with the test client against the configured `DATABASE_URL`, with the session cache
+disabled so every opaque request has to look its session up. Run from the 'backend' directory:
+
+    python -m benchmarks.session_tokens --requests 2000
+"""
+
+import argparse
+import os
+import statistics
+import time
+from typing import List
+
+os.environ.setdefault("ENVIRONMENT", "development")
+os.environ.setdefault("SESSION_SIGNING_KEY", "benchmark")
+os.environ["SESSION_CACHE_SIZE"] = "0"
+
+
+def percentile(samples: List[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def run(client, requests: int) -> List[float]:
+    samples = []
+    for _ in range(requests):
+        start_time = time.perf_counter()
+        response = client.get("/api/session")
+        samples.append((time.perf_counter() - start_time) * 1000)
+        assert response.status_code == 200, response.text
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    args = parser.parse_args()
+
+    from fastapi.testclient import TestClient
+    from linkpulse.app import app
+    from linkpulse.hashing import hasher
+    from linkpulse.models import User
+    from linkpulse.routers import auth
+    from linkpulse.tests.random import random_email
+
+    user = User.create(email=random_email(), password_hash=hasher.hash("password"))
+    try:
+        with TestClient(app) as client:
+            for issue_signed in (False, True):
+                auth.issue_signed = issue_signed
+                client.cookies.clear()
+                response = client.post("/api/login", json={"email": user.email, "password": "password"})
+                assert response.status_code == 200, response.text
+
+                run(client, args.warmup)
+                samples = run(client, args.requests)
+                print(
+                    "{:<7} p50={:.3f}ms p99={:.3f}ms mean={:.3f}ms".format(
+                        "signed" if issue_signed else "opaque",
+                        percentile(samples, 0.50),
+                        percentile(samples, 0.99),
+                        statistics.mean(samples),
+                    )
+                )
+    finally:
+        user.delete_instance(recursive=True)
+
+
+if __name__ == "__main__":
+    main()
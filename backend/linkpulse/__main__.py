@@ -4,9 +4,10 @@ command-line interface (CLI) commands to serve the application, run migrations,
 or start a REPL (Read-Eval-Print Loop) session.
 
 Commands:
-- serve: Starts the application server using Uvicorn.
+- serve: Starts the application server (see `linkpulse.serve`).
 - migrate: Runs database migrations.
 - repl: Starts an interactive Python shell with pre-imported objects and models.
+- startup-profile: Reports the time spent importing the app (or another module), by package & module.
 """
 
 from linkpulse.logging import setup_logging
@@ -14,7 +15,6 @@ from linkpulse.logging import setup_logging
 # We want to setup logging as early as possible.
 setup_logging()
 
-import os
 import sys
 
 import structlog
@@ -29,29 +29,17 @@ def main(*args: str) -> None:
     :type args: str"""
 
     if args[0] == "serve":
-        from linkpulse.utilities import is_development
-        from uvicorn import run
-
-        logger.debug("Invoking uvicorn.run")
-
-        run(
-            "linkpulse.app:app",
-            reload=is_development,
-            host="0.0.0.0" if is_development else "::",
-            port=int(os.getenv("PORT", "8000")),
-            log_config={
-                "version": 1,
-                "disable_existing_loggers": False,
-                "loggers": {
-                    "uvicorn": {"propagate": True},
-                    "uvicorn.access": {"propagate": True},
-                },
-            },
-        )
+        from linkpulse.serve import serve
+
+        serve()
 
     elif args[0] == "migrate":
         from linkpulse.migrate import main
 
+        main(*args)
+    elif args[0] == "startup-profile":
+        from linkpulse.startup_profile import main
+
         main(*args)
     elif args[0] == "repl":
         import linkpulse
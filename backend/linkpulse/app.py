@@ -1,18 +1,45 @@
+import asyncio
 from contextlib import asynccontextmanager
-from typing import AsyncIterator
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable
 
 import structlog
-from apscheduler.schedulers.background import BackgroundScheduler  # type: ignore
-from apscheduler.triggers.interval import IntervalTrigger  # type: ignore
 from asgi_correlation_id import CorrelationIdMiddleware
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.responses import ORJSONResponse
 from fastapi_cache import FastAPICache
-from fastapi_cache.backends.inmemory import InMemoryBackend
+from linkpulse.cache import PostgresCacheTier, TieredCacheBackend, response_cache
+from linkpulse.database import (
+    InstrumentedPooledPostgresqlDatabase,
+    connection_scope,
+    db_executor,
+    release_connection,
+)
+from linkpulse.hashing import hashing_pool
+from linkpulse import logging as linkpulse_logging
 from linkpulse.logging import setup_logging
+from linkpulse.metrics import registry, timed_job
 from linkpulse.middleware import LoggingMiddleware
+from linkpulse.profiler import profiler
+from linkpulse.ratelimit import PostgresStorage, gcra
+from linkpulse.ratelimit import storage as rate_limit_storage
+from linkpulse.sessions import (
+    filter_rebuild_interval,
+    filter_sync_interval,
+    last_used_buffer,
+    live_tokens,
+    reap_expired_sessions,
+    reaper_interval,
+    session_cache,
+    session_listener,
+)
+from linkpulse.tokens import revocation_refresh_interval, revocations, signer
 from linkpulse.utilities import get_db, is_development
+from linkpulse.watchdog import watchdog, watchdog_enabled
+from playhouse.pool import PooledDatabase
+
+if TYPE_CHECKING:
+    from apscheduler.schedulers.background import BackgroundScheduler  # type: ignore
 
 load_dotenv(dotenv_path=".env")
 
@@ -21,31 +48,121 @@ from linkpulse import models  # type: ignore
 db = get_db()
 
 
-scheduler = BackgroundScheduler()
+def create_scheduler() -> "BackgroundScheduler":
+    """
+    Create the scheduler running the application's periodic jobs.
+    APScheduler is only imported once the app starts, so merely importing the app (e.g. the REPL) skips it.
+    """
+    from apscheduler.schedulers.background import BackgroundScheduler  # type: ignore
+    from apscheduler.triggers.interval import IntervalTrigger  # type: ignore
+
+    scheduler = BackgroundScheduler()
+
+    def schedule(func: Callable[[], Any], seconds: float, id: str, **kwargs: Any) -> None:
+        """
+        Add an interval job, timed for `/metrics`. Runs never overlap, and missed runs are coalesced into one.
+        """
+        scheduler.add_job(
+            timed_job(id, func),
+            IntervalTrigger(seconds=seconds),
+            id=id,
+            max_instances=1,
+            coalesce=True,
+            **kwargs,
+        )
+
+    schedule(last_used_buffer.flush, last_used_buffer.interval, "flush_last_used")
+    schedule(live_tokens.rebuild, filter_rebuild_interval, "rebuild_live_tokens")
+    schedule(live_tokens.sync, filter_sync_interval, "sync_live_tokens")
+    schedule(reap_expired_sessions, reaper_interval, "reap_expired_sessions")
+    if isinstance(rate_limit_storage, PostgresStorage):
+        schedule(rate_limit_storage.flush, rate_limit_storage.interval, "flush_rate_limits")
+        schedule(rate_limit_storage.prune, reaper_interval, "prune_rate_limits")
+    if isinstance(response_cache, TieredCacheBackend) and isinstance(
+        response_cache.shared, PostgresCacheTier
+    ):
+        schedule(response_cache.shared.prune, reaper_interval, "prune_response_cache")
+    if signer is not None:
+        # Picks up sessions revoked by other processes;
+        # signed tokens are otherwise never checked against the database
+        schedule(revocations.refresh, revocation_refresh_interval, "refresh_revocations")
+
+    return scheduler
+
+
+# Components keep their own counters; export them alongside the registry's metrics
+registry.register_stats("linkpulse_db_executor", db_executor.stats)
+if isinstance(db, InstrumentedPooledPostgresqlDatabase):
+    registry.register_stats("linkpulse_db_pool", db.pool_stats)
+registry.register_stats("linkpulse_hashing", hashing_pool.stats)
+registry.register_stats("linkpulse_response_cache", response_cache.stats)
+registry.register_stats("linkpulse_session_cache", session_cache.stats)
+if session_listener is not None:
+    registry.register_stats("linkpulse_session_invalidations", session_listener.stats)
+registry.register_stats("linkpulse_live_tokens", live_tokens.stats)
+registry.register_stats("linkpulse_revocations", revocations.stats)
+registry.register_stats("linkpulse_rate_limit_gcra", gcra.stats)
+registry.register_stats("linkpulse_profiler", profiler.stats)
+registry.register_stats("linkpulse_event_loop", watchdog.stats)
+if hasattr(rate_limit_storage, "stats"):
+    registry.register_stats("linkpulse_rate_limit_storage", rate_limit_storage.stats)
+# The handler is replaced whenever logging is set up again, so it's looked up on each collection
+registry.register_stats("linkpulse_log", lambda: getattr(linkpulse_logging.handler, "stats", dict)())
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI) -> AsyncIterator[None]:
-    # Connect to database, ensure specific tables exist
-    db.connect()
-    db.create_tables([models.User, models.Session])
+    # Ensure specific tables exist; connections are otherwise opened on demand
+    with connection_scope():
+        db.create_tables([models.User, models.Session, models.SessionRevocation])
+
+    FastAPICache.init(backend=response_cache, prefix="fastapi-cache", cache_status_header="X-Cache")
 
-    FastAPICache.init(backend=InMemoryBackend(), prefix="fastapi-cache", cache_status_header="X-Cache")
+    # Loaded before serving (tokens aren't filtered until then), then kept up to date by the scheduler
+    live_tokens.rebuild()
+    if signer is not None:
+        revocations.refresh()
 
+    scheduler = create_scheduler()
     scheduler.start()
+    if isinstance(response_cache, TieredCacheBackend):
+        response_cache.start(asyncio.get_running_loop())
+    if session_listener is not None:
+        session_listener.start(asyncio.get_running_loop())
+    if watchdog_enabled:
+        watchdog.start(asyncio.get_running_loop())
 
     yield
 
+    watchdog.stop()
+    if isinstance(response_cache, TieredCacheBackend):
+        response_cache.stop()
+    if session_listener is not None:
+        session_listener.stop()
     scheduler.shutdown()
+    hashing_pool.shutdown()
+    db_executor.shutdown()
+
+    # Drain any buffered writes before the connection goes away
+    last_used_buffer.flush()
+    if isinstance(rate_limit_storage, PostgresStorage):
+        rate_limit_storage.flush()
 
     if not db.is_closed():
         db.close()
+    if isinstance(db, PooledDatabase):
+        # Connections still checked out by other threads are left alone
+        db.close_idle()
 
 
 from linkpulse.routers import auth, misc
 
 # TODO: Apply migrations on startup in production environments
-app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app = FastAPI(
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+    dependencies=[Depends(release_connection)],
+)
 app.include_router(auth.router)
 app.include_router(misc.router)
 
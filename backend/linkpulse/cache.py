@@ -0,0 +1,501 @@
+"""cache.py
+This module provides the response cache backend behind the `@cache` decorators (see `fastapi_cache`).
+
+`MemoryCacheBackend` replaces `fastapi_cache`'s `InMemoryBackend`, which grows without bound and lets every concurrent
+miss recompute the same value. It is bounded by size, evicting the least recently used entries, and coalesces misses:
+the decorator computes a value after a miss and then `set`s it, so the first caller to miss a key is told so, while
+callers missing the same key in the meantime wait for that `set` instead of computing it again.
+
+With several workers or replicas, each process caching on its own recomputes every value once per process, and
+clearing a value only clears it in one. `TieredCacheBackend` puts the per-process cache in front of a shared tier,
+either in memory shared by the workers on a host or in a Postgres table shared by every replica, and broadcasts
+invalidations to every process with `NOTIFY`.
+"""
+
+import asyncio
+import datetime
+import os
+import struct
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple, Union
+
+import structlog
+from fastapi_cache.types import Backend
+from linkpulse.notify import InvalidationListener
+from linkpulse.sharedtable import SharedTable
+from linkpulse.utilities import utc_now
+
+
+class _Entry:
+    __slots__ = ("data", "expires_at", "size")
+
+    def __init__(self, data: bytes, expires_at: Optional[float], size: int):
+        self.data = data
+        # `time.monotonic`; None never expires
+        self.expires_at = expires_at
+        self.size = size
+
+
+class _Fill:
+    """A miss being computed by one caller, which others wait on."""
+
+    __slots__ = ("done", "started")
+
+    def __init__(self) -> None:
+        self.done = asyncio.Event()
+        self.started = time.monotonic()
+
+
+class MemoryCacheBackend(Backend):
+    """
+    A `fastapi_cache` backend holding up to `max_bytes` of keys & values in process memory, evicting the least
+    recently used entries beyond that. An `expire` of None or 0 caches a value until it is evicted or cleared.
+
+    Concurrent misses for a key are coalesced into one computation. If the computing caller's task ends without
+    `set`ting the value (e.g. it raised or was cancelled), waiting callers are released right away to compute it
+    themselves; they never wait longer than `fill_timeout` seconds regardless.
+
+    With a `stale_ttl`, expired entries are kept that many seconds longer: the first caller to find one recomputes
+    it, while everyone else is served the stale value immediately rather than waiting (stale-while-revalidate).
+
+    Only used from the event loop, so it needs no locking.
+    """
+
+    def __init__(self, max_bytes: int, stale_ttl: float = 0, fill_timeout: float = 10):
+        self.max_bytes = max_bytes
+        self.stale_ttl = stale_ttl
+        self.fill_timeout = fill_timeout
+
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._fills: Dict[str, _Fill] = {}
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.abandoned = 0
+
+    def _lookup(self, key: str, now: float) -> Tuple[Optional[_Entry], bool]:
+        """Get the entry for `key` (moving it to the back of the LRU order), and whether it is fresh."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, False
+        if entry.expires_at is None or now < entry.expires_at:
+            self._entries.move_to_end(key)
+            return entry, True
+        if now < entry.expires_at + self.stale_ttl:
+            return entry, False
+        self._remove(key)
+        return None, False
+
+    def _ttl(self, entry: _Entry, now: float) -> int:
+        # The decorator's `Cache-Control: max-age`; nothing is promised for entries without an expiry
+        if entry.expires_at is None:
+            return 0
+        return max(0, int(entry.expires_at - now))
+
+    def _start_fill(self, key: str) -> Tuple[int, None]:
+        fill = self._fills[key] = _Fill()
+        task = asyncio.current_task()
+        if task is not None:
+            task.add_done_callback(lambda _: self._abandon(key, fill))
+        self.misses += 1
+        return 0, None
+
+    def _abandon(self, key: str, fill: _Fill) -> None:
+        # The caller computing the value is done; if it never `set` it, nobody should keep waiting for it
+        if self._fills.get(key) is fill:
+            del self._fills[key]
+            self.abandoned += 1
+        fill.done.set()
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        now = time.monotonic()
+        entry, fresh = self._lookup(key, now)
+        if entry is not None and fresh:
+            self.hits += 1
+            return self._ttl(entry, now), entry.data
+
+        fill = self._fills.get(key)
+        if fill is not None and now - fill.started >= self.fill_timeout:
+            # Whoever was computing it must have failed
+            fill = None
+
+        if entry is not None:
+            # Stale: one caller revalidates, everyone else gets the stale value meanwhile
+            if fill is None:
+                return self._start_fill(key)
+            self.stale_hits += 1
+            return 0, entry.data
+
+        if fill is None:
+            return self._start_fill(key)
+
+        try:
+            await asyncio.wait_for(fill.done.wait(), self.fill_timeout - (now - fill.started))
+        except asyncio.TimeoutError:
+            pass
+        now = time.monotonic()
+        entry, fresh = self._lookup(key, now)
+        if entry is not None and fresh:
+            self.coalesced += 1
+            return self._ttl(entry, now), entry.data
+        # The value wasn't computed in time; compute it here too, without blocking anyone else on it
+        self.misses += 1
+        return 0, None
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry, fresh = self._lookup(key, time.monotonic())
+        return entry.data if entry is not None and fresh else None
+
+    async def set(self, key: str, value: bytes, expire: Optional[int] = None) -> None:
+        self._remove(key)
+        size = len(key) + len(value)
+        # A value that can't fit is not cached at all, rather than evicting everything else for it
+        if size <= self.max_bytes:
+            expires_at = time.monotonic() + expire if expire else None
+            self._entries[key] = _Entry(value, expires_at, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.size
+                self.evictions += 1
+
+        fill = self._fills.pop(key, None)
+        if fill is not None:
+            fill.done.set()
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        return self.discard(namespace, key)
+
+    def discard(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        """Remove the entries under `namespace`, the entry for `key`, or else every entry; returns how many."""
+        if namespace:
+            keys = [cached for cached in self._entries if cached.startswith(namespace)]
+        elif key:
+            keys = [key] if key in self._entries else []
+        else:
+            keys = list(self._entries)
+        for cached in keys:
+            self._remove(cached)
+        return len(keys)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "abandoned": self.abandoned,
+        }
+
+
+class SharedMemoryCacheTier:
+    """
+    Cached values in a `SharedTable`, shared by every process on the host that opens the same path.
+
+    Each slot holds its key (so namespaces can be cleared) and value, and values that don't fit in `slot_bytes` aren't
+    shared. Copying a value in or out only takes microseconds, so this is used from the event loop directly.
+    """
+
+    # Key hash (0 = empty), expiry (UNIX time, 0 = never), key & value lengths
+    HEADER = struct.Struct("<QdII")
+
+    def __init__(self, path: str, slots: int = 1024, slot_bytes: int = 16384, probes: int = 16):
+        self.table = SharedTable(path, slots, slot_bytes, probes)
+        self.too_large = 0
+
+    def _read(self, slot: int) -> Tuple[int, float, int, int]:
+        return self.HEADER.unpack_from(self.table.map, self.table.offset(slot))
+
+    def _key(self, slot: int, key_length: int) -> bytes:
+        start = self.table.offset(slot) + self.HEADER.size
+        return self.table.map[start : start + key_length]
+
+    def _matches(self, slot: int, encoded: bytes) -> bool:
+        # Different keys may share a hash
+        return self._key(slot, self._read(slot)[2]) == encoded
+
+    async def get(self, key: str) -> Optional[Tuple[bytes, Optional[float]]]:
+        """Get a key's value and expiry (UNIX time, None if it never expires), or None if it isn't cached."""
+        encoded, now = key.encode(), time.time()
+        with self.table.locked():
+            slot = self.table.find(SharedTable.hash(encoded), now, insert=False)
+            if slot is None or not self.table.is_live(slot, now) or not self._matches(slot, encoded):
+                return None
+            _, expiry, key_length, value_length = self._read(slot)
+            start = self.table.offset(slot) + self.HEADER.size + key_length
+            return self.table.map[start : start + value_length], expiry or None
+
+    async def set(self, key: str, value: bytes, expires_at: Optional[float]) -> None:
+        encoded = key.encode()
+        if self.HEADER.size + len(encoded) + len(value) > self.table.slot_bytes:
+            self.too_large += 1
+            return
+
+        key_hash = SharedTable.hash(encoded)
+        with self.table.locked():
+            slot = self.table.find(key_hash, time.time(), insert=True)
+            assert slot is not None
+            offset = self.table.offset(slot)
+            self.HEADER.pack_into(
+                self.table.map, offset, key_hash, expires_at or 0.0, len(encoded), len(value)
+            )
+            start = offset + self.HEADER.size
+            self.table.map[start : start + len(encoded) + len(value)] = encoded + value
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        with self.table.locked():
+            if not namespace and key:
+                encoded = key.encode()
+                slot = self.table.find(SharedTable.hash(encoded), time.time(), insert=False)
+                if slot is None or not self._matches(slot, encoded):
+                    return 0
+                self.table.erase(slot)
+                return 1
+
+            prefix = (namespace or "").encode()
+            count = 0
+            for slot in range(self.table.slots):
+                key_hash, _, key_length, _ = self._read(slot)
+                if key_hash != 0 and self._key(slot, key_length).startswith(prefix):
+                    self.table.erase(slot)
+                    count += 1
+            return count
+
+    def close(self) -> None:
+        self.table.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.table.locked():
+            live = self.table.live(time.time())
+        return {
+            "slots": self.table.slots,
+            "live": live,
+            "evictions": self.table.evictions,
+            "too_large": self.too_large,
+        }
+
+
+class PostgresCacheTier:
+    """
+    Cached values in the `responsecache` table, shared between replicas. Each lookup or write is a query, run on the
+    database threads; expired rows are deleted by `prune`.
+    """
+
+    async def get(self, key: str) -> Optional[Tuple[bytes, Optional[float]]]:
+        """Get a key's value and expiry (UNIX time, None if it never expires), or None if it isn't cached."""
+        from linkpulse.database import run_query
+
+        return await run_query(self._get, key)
+
+    def _get(self, key: str) -> Optional[Tuple[bytes, Optional[float]]]:
+        from linkpulse.models import ResponseCache
+
+        row = (
+            ResponseCache.select(ResponseCache.value, ResponseCache.expiry)
+            .where(
+                (ResponseCache.key == key)
+                & (ResponseCache.expiry.is_null() | (ResponseCache.expiry > utc_now()))
+            )
+            .tuples()
+            .first()
+        )
+        if row is None:
+            return None
+        value, expiry = row
+        if expiry is not None:
+            expiry = expiry.replace(tzinfo=datetime.timezone.utc).timestamp()
+        return bytes(value), expiry
+
+    async def set(self, key: str, value: bytes, expires_at: Optional[float]) -> None:
+        from linkpulse.database import run_query
+        from linkpulse.models import ResponseCache
+
+        expiry = None
+        if expires_at is not None:
+            expiry = datetime.datetime.fromtimestamp(expires_at, datetime.timezone.utc)
+        query = ResponseCache.insert(key=key, value=value, expiry=expiry).on_conflict(
+            conflict_target=[ResponseCache.key], preserve=[ResponseCache.value, ResponseCache.expiry]
+        )
+        await run_query(query.execute)
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        from linkpulse.database import run_query
+        from linkpulse.models import ResponseCache
+        from peewee import fn
+
+        query = ResponseCache.delete()
+        if namespace:
+            query = query.where(fn.starts_with(ResponseCache.key, namespace))
+        elif key:
+            query = query.where(ResponseCache.key == key)
+        return await run_query(query.execute)
+
+    def prune(self) -> int:
+        """Delete expired values. Blocking; meant to be run by the scheduler."""
+        from linkpulse.database import connection_scope
+        from linkpulse.models import ResponseCache
+
+        with connection_scope():
+            return ResponseCache.delete().where(ResponseCache.expiry <= utc_now()).execute()
+
+
+SharedTier = Union[SharedMemoryCacheTier, PostgresCacheTier]
+
+
+class TieredCacheBackend(Backend):
+    """
+    A `fastapi_cache` backend with a `MemoryCacheBackend` in each process, in front of a tier shared by every worker
+    on the host (`SharedMemoryCacheTier`) or every replica (`PostgresCacheTier`), so values computed by one process
+    are reused by the others.
+
+    Local misses go to the shared tier, still coalesced: only the first caller to miss a key looks it up, while the
+    rest wait on it as usual. Values are written to both tiers. The shared tier is an optimization, so failed lookups
+    and writes are logged and treated as misses. Clearing does raise on failure: it removes values from both tiers
+    and, with a `listener`, from the local tier of every other process.
+    """
+
+    def __init__(
+        self, local: MemoryCacheBackend, shared: SharedTier, listener: Optional[InvalidationListener] = None
+    ):
+        self.local = local
+        self.shared = shared
+        self.listener = listener
+        self.logger = structlog.get_logger(__name__)
+
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.shared_errors = 0
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self.listener is not None:
+            self.listener.start(loop)
+
+    def stop(self) -> None:
+        if self.listener is not None:
+            self.listener.stop()
+
+    async def _shared_get(self, key: str) -> Optional[Tuple[bytes, Optional[float]]]:
+        try:
+            found = await self.shared.get(key)
+        except Exception as e:
+            self.shared_errors += 1
+            self.logger.warning("Shared cache lookup failed", key=key, error=str(e))
+            found = None
+        if found is None:
+            self.shared_misses += 1
+        else:
+            self.shared_hits += 1
+        return found
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        ttl, value = await self.local.get_with_ttl(key)
+        if value is not None:
+            return ttl, value
+
+        found = await self._shared_get(key)
+        if found is None:
+            return 0, None
+        value, expires_at = found
+        # Never 0, which would cache it locally without expiry
+        expire = max(1, int(expires_at - time.time())) if expires_at is not None else None
+        # Also hands the value to callers waiting on this key
+        await self.local.set(key, value, expire)
+        return expire or 0, value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value = await self.local.get(key)
+        if value is None:
+            found = await self._shared_get(key)
+            if found is not None:
+                value = found[0]
+        return value
+
+    async def set(self, key: str, value: bytes, expire: Optional[int] = None) -> None:
+        await self.local.set(key, value, expire)
+        try:
+            await self.shared.set(key, value, time.time() + expire if expire else None)
+        except Exception as e:
+            self.shared_errors += 1
+            self.logger.warning("Shared cache write failed", key=key, error=str(e))
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        self.local.discard(namespace, key)
+        count = await self.shared.clear(namespace, key)
+        if self.listener is not None:
+            from linkpulse.database import run_query
+
+            await run_query(self.listener.publish, namespace, key)
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.local.stats()
+        stats.update(
+            {
+                "shared_hits": self.shared_hits,
+                "shared_misses": self.shared_misses,
+                "shared_errors": self.shared_errors,
+            }
+        )
+        if isinstance(self.shared, SharedMemoryCacheTier):
+            stats.update({f"shared_{name}": value for name, value in self.shared.stats().items()})
+        if self.listener is not None:
+            stats.update(self.listener.stats())
+        return stats
+
+
+def _shared_memory_path() -> str:
+    # /dev/shm is memory-backed on Linux; elsewhere the file is still shared, just backed by disk
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "linkpulse-cache")
+
+
+def create_cache_backend(backend: str) -> Union[MemoryCacheBackend, TieredCacheBackend]:
+    """
+    Create the response cache backend for a name: 'memory' (per-process), or a per-process tier in front of 'shared'
+    (per-host) or 'postgres' (shared between replicas).
+    """
+    local = MemoryCacheBackend(
+        max_bytes=int(os.getenv("CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+        # Seconds an expired entry may still be served while it is recomputed; 0 disables
+        stale_ttl=float(os.getenv("CACHE_STALE_TTL", "0")),
+        fill_timeout=float(os.getenv("CACHE_FILL_TIMEOUT", "10")),
+    )
+    if backend == "memory":
+        return local
+
+    shared: SharedTier
+    if backend == "shared":
+        shared = SharedMemoryCacheTier(
+            path=os.getenv("CACHE_SHARED_PATH", _shared_memory_path()),
+            slots=int(os.getenv("CACHE_SHARED_SLOTS", "1024")),
+            # Values larger than a slot (less its key & header) are only cached per-process
+            slot_bytes=int(os.getenv("CACHE_SHARED_SLOT_BYTES", "16384")),
+        )
+    elif backend == "postgres":
+        shared = PostgresCacheTier()
+    else:
+        raise ValueError(f"Unknown response cache backend: {backend!r}")
+
+    # Disable with CACHE_INVALIDATION_NOTIFY=false where the database can't deliver notifications to a long-lived
+    # connection (e.g. behind a transaction-mode pooler); invalidations then only reach this process
+    notify = os.getenv("CACHE_INVALIDATION_NOTIFY", "true").lower() == "true"
+    return TieredCacheBackend(local, shared, InvalidationListener(local) if notify else None)
+
+
+# Which backend the `@cache` decorators use.
+response_cache = create_cache_backend(os.getenv("CACHE_BACKEND", "memory").lower())
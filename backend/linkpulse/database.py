@@ -0,0 +1,341 @@
+"""database.py
+This module provides the database connection (optionally pooled) and an async-safe execution layer for it.
+
+peewee is synchronous, so running queries directly inside `async def` handlers blocks the event loop for the duration
+of every query. `DatabaseExecutor` runs them on a dedicated thread pool instead, where each call checks a connection
+out of the models' database (peewee connections are thread-local) and returns it afterwards.
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+import structlog
+from linkpulse.metrics import db_query_duration, statement_type
+from linkpulse.utilities import worker_count
+from peewee import PostgresqlDatabase
+from playhouse.db_url import parse
+from playhouse.pool import MaxConnectionsExceeded, PooledPostgresqlDatabase
+
+logger = structlog.get_logger()
+
+T = TypeVar("T")
+
+
+class QueryStats:
+    """
+    The statements executed on behalf of a single request (see `track_queries`).
+    Statements are counted by their SQL (with placeholders), so repeats of the same query can be spotted.
+    """
+
+    def __init__(self) -> None:
+        # Statements of one request may run on several database threads at once
+        self._lock = threading.Lock()
+        self.count = 0
+        self.duration = 0.0
+        self.shapes: Counter[str] = Counter()
+
+    def record(self, sql: str, duration: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.duration += duration
+            self.shapes[sql] += 1
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """Get the statements executed more than `threshold` times, most repeated first."""
+        return [(sql, count) for sql, count in self.shapes.most_common() if count > threshold]
+
+
+# The current request's statements; context variables are carried over to database threads by `run_query`
+current_queries: contextvars.ContextVar[Optional[QueryStats]] = contextvars.ContextVar(
+    "current_queries", default=None
+)
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """Record every statement executed within the block (and work it submits to `run_query`)."""
+    stats = QueryStats()
+    token = current_queries.set(stats)
+    try:
+        yield stats
+    finally:
+        current_queries.reset(token)
+
+
+class InstrumentedPostgresqlDatabase(PostgresqlDatabase):
+    """
+    A Postgres database that times every statement it executes, and attributes them to the current request.
+
+    If created without a database name (deferred) but with a `url` callable, the URL is only resolved & parsed when
+    the first connection is opened; importing the models doesn't require (or touch) the database.
+    """
+
+    def __init__(self, *args: Any, url: Optional[Callable[[], str]] = None, **kwargs: Any):
+        self._url = url
+        self._url_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def _resolve_url(self) -> None:
+        if self.deferred and self._url is not None:
+            with self._url_lock:
+                if self.deferred:
+                    self.init(**parse(self._url()))
+
+    def connect(self, reuse_if_open: bool = False) -> bool:
+        self._resolve_url()
+        return super().connect(reuse_if_open)
+
+    def dedicated_connection(self) -> Any:
+        """
+        Open a raw (psycopg2) connection of its own, outside the pool and the per-thread connection state, for work
+        that holds on to a connection indefinitely (e.g. `LISTEN`). The caller must close it.
+        """
+        import psycopg2
+
+        self._resolve_url()
+        connection = psycopg2.connect(dbname=self.database, **self.connect_params)
+        connection.autocommit = True
+        return connection
+
+    def execute_sql(self, sql: str, params: Any = None, commit: Any = None) -> Any:
+        start_time = time.perf_counter()
+        try:
+            return super().execute_sql(sql, params)
+        finally:
+            duration = time.perf_counter() - start_time
+            db_query_duration.observe(duration, statement_type(sql))
+
+            stats = current_queries.get()
+            if stats is not None:
+                stats.record(sql, duration)
+
+
+class InstrumentedPooledPostgresqlDatabase(InstrumentedPostgresqlDatabase, PooledPostgresqlDatabase):  # type: ignore[misc]
+    """
+    A pooled Postgres database that also keeps track of how long threads wait to check out a connection, how often
+    none became free in time (`timeouts`), and how often opening one failed otherwise (`failures`).
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def connect(self, reuse_if_open: bool = False) -> bool:
+        start_time = time.perf_counter()
+        try:
+            return super().connect(reuse_if_open)
+        except MaxConnectionsExceeded:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        except Exception:
+            # e.g. the database is unreachable, which says nothing about the pool's size
+            with self._stats_lock:
+                self.failures += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start_time
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """
+        Get the pool's checked-out/idle connection counts & checkout wait times.
+        """
+        with self._pool_lock:
+            checked_out, idle = len(self._in_use), len(self._connections)
+        with self._stats_lock:
+            return {
+                "max_connections": self._max_connections,
+                "checked_out": checked_out,
+                "idle": idle,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "failures": self.failures,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+            }
+
+
+def listen_connections() -> int:
+    """
+    The connections each process holds open outside the pool, to `LISTEN` for cache invalidations (see
+    `linkpulse.notify`): one for the session cache, and one for a shared response cache.
+    """
+    count = 0
+    if os.getenv("SESSION_CACHE_INVALIDATION_NOTIFY", "true").lower() == "true":
+        count += 1
+    if (
+        os.getenv("CACHE_BACKEND", "memory").lower() in ("shared", "postgres")
+        and os.getenv("CACHE_INVALIDATION_NOTIFY", "true").lower() == "true"
+    ):
+        count += 1
+    return count
+
+
+def connect_database(url: Callable[[], str]) -> PostgresqlDatabase:
+    """
+    Create the database for the URL returned by `url`, which is called when the first connection is opened.
+    Unless `DATABASE_POOL` is disabled, connections are pooled: they are opened on demand, returned to the pool when
+    closed, and recycled after `DATABASE_STALE_TIMEOUT` seconds.
+    """
+    if os.getenv("DATABASE_POOL", "true").lower() != "true":
+        return InstrumentedPostgresqlDatabase(None, url=url)
+
+    # Per process; by default, 20 connections (including those held to `LISTEN`) are split between the app's workers
+    # on the host, leaving each at least one
+    default_connections = max(1, 20 // worker_count() - listen_connections())
+    max_connections = int(os.getenv("DATABASE_MAX_CONNECTIONS", str(default_connections)))
+
+    return InstrumentedPooledPostgresqlDatabase(
+        None,
+        url=url,
+        max_connections=max_connections,
+        stale_timeout=int(os.getenv("DATABASE_STALE_TIMEOUT", "300")),
+        # Seconds to wait for a free connection before giving up
+        timeout=int(os.getenv("DATABASE_POOL_TIMEOUT", "10")),
+    )
+
+
+@contextmanager
+def connection_scope() -> Iterator[None]:
+    """
+    Hold a connection for the duration of the block, returning it to the pool afterwards.
+    If the current thread already has a connection open, it is left open.
+    """
+    from linkpulse.utilities import get_db
+
+    db = get_db()
+    if not db.is_closed():
+        yield
+        return
+
+    db.connect()
+    try:
+        yield
+    finally:
+        db.close()
+
+
+async def release_connection() -> AsyncIterator[None]:
+    """
+    An application-wide dependency that returns any connection the event loop thread checked out during a request.
+    Most database work should go through `run_query` instead, but this keeps a stray synchronous query from pinning
+    a pooled connection to the event loop forever.
+    """
+    yield
+
+    from linkpulse.utilities import get_db
+
+    db = get_db()
+    if not db.is_closed() and not db.in_transaction():
+        db.close()
+
+
+class DatabaseExecutor:
+    """
+    A thread pool dedicated to running (blocking) database work, with saturation metrics.
+
+    Each call is executed as a whole on a single thread, so multi-statement work that must share a connection or
+    transaction (e.g. `db.atomic()`) should be wrapped in one function and submitted together.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.completed = 0
+        self.running = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.run_seconds_total = 0.0
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # Created lazily, so importing this module doesn't start threads
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="linkpulse-db")
+        return self._executor
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Run `fn(*args, **kwargs)` on the database thread pool and await the result.
+        Context variables (e.g. the request ID bound for logging) are carried over to the worker thread.
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        call = partial(context.run, self._call, time.perf_counter(), fn, *args, **kwargs)
+
+        with self._lock:
+            self.submitted += 1
+        return await loop.run_in_executor(self.executor, call)
+
+    def _call(self, submitted_at: float, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        started_at = time.perf_counter()
+        waited = started_at - submitted_at
+        with self._lock:
+            self.running += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+        try:
+            with connection_scope():
+                return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+                self.run_seconds_total += elapsed
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the pool's saturation counters. `queued` greater than zero means every worker is busy.
+        """
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "running": self.running,
+                "queued": self.submitted - self.completed - self.running,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+                "run_seconds_total": self.run_seconds_total,
+            }
+
+
+# More threads than pooled connections would only wait on the pool
+db_executor = DatabaseExecutor(
+    workers=int(os.getenv("DB_WORKERS", str(min(8, max(2, 20 // worker_count())))))
+)
+
+
+async def run_query(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run blocking database work off the event loop, e.g. `await run_query(User.get_or_none, User.email == email)`.
+    """
+    return await db_executor.run(fn, *args, **kwargs)
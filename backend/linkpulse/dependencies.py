@@ -1,41 +1,68 @@
 import os
 from dataclasses import dataclass
+from typing import Optional, Union
 
 import structlog
 from fastapi import HTTPException, Request, Response, status
 from limits import parse
-from limits.aio.storage import MemoryStorage
-from limits.aio.strategies import MovingWindowRateLimiter
+from limits.aio.storage import MovingWindowSupport, Storage
+from limits.aio.strategies import FixedWindowRateLimiter, MovingWindowRateLimiter
+from linkpulse import ratelimit
+from linkpulse.metrics import rate_limit_rejections
 from linkpulse.models import Session
-
-storage = MemoryStorage()
-strategy = MovingWindowRateLimiter(storage)
+from linkpulse.database import run_query
+from linkpulse.sessions import get_session_async, get_signed_session
+from linkpulse.tokens import is_signed
+from linkpulse.utilities import get_client_key
 
 logger = structlog.get_logger()
 is_pytest = os.environ.get("PYTEST_VERSION") is not None
 
 
 class RateLimiter:
-    def __init__(self, limit: str):
+    def __init__(self, limit: str, storage: Optional[Storage] = None, strategy: Optional[str] = None):
+        """
+        :param limit: The limit, e.g. "6/minute".
+        :param storage: Where hits are counted, defaulting to the backend configured by `RATE_LIMIT_STORAGE`.
+                        Storages shared between processes only support a fixed window.
+        :param strategy: 'moving-window', 'fixed-window' or 'gcra', defaulting to `RATE_LIMIT_STRATEGY`.
+                         'gcra' uses constant memory per key and a bounded number of keys, but is per-process and
+                         ignores `storage`.
+        """
         self.limit = parse(limit)
         self.retry_after = str(self.limit.get_expiry())
 
+        self.storage = storage if storage is not None else ratelimit.storage
+        if strategy is None:
+            strategy = ratelimit.default_strategy
+        if strategy == "auto":
+            strategy = "moving-window" if isinstance(self.storage, MovingWindowSupport) else "fixed-window"
+
+        self.strategy: Union[MovingWindowRateLimiter, FixedWindowRateLimiter, ratelimit.GCRARateLimiter]
+        if strategy == "moving-window":
+            self.strategy = MovingWindowRateLimiter(self.storage)
+        elif strategy == "fixed-window":
+            self.strategy = FixedWindowRateLimiter(self.storage)
+        elif strategy == "gcra":
+            self.strategy = ratelimit.gcra
+        else:
+            raise ValueError(f"Unknown rate limit strategy: {strategy!r}")
+
     async def __call__(self, request: Request, response: Response):
-        key = request.headers.get("X-Real-IP")
+        key = get_client_key(request)
 
         if key is None:
-            if request.client is None:
-                logger.warning("No client information available for request.")
-                return False
-            key = request.client.host
+            logger.warning("No client information available for request.")
+            return False
 
         if is_pytest:
             # This is somewhat hacky, I'm not sure if there's a way it can break during pytesting, but look here if odd rate limiting errors occur during tests
             # The reason for this is so tests don't compete with each other for rate limiting
             key += "." + os.environ["PYTEST_CURRENT_TEST"]
 
-        if not await strategy.hit(self.limit, key):
+        if not await self.strategy.hit(self.limit, key):
             logger.warning("Rate limit exceeded", key=key)
+            rate_limit_rejections.inc(str(self.limit))
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 detail="Too Many Requests",
@@ -48,7 +75,7 @@ class SessionDependency:
     def __init__(self, required: bool = False):
         self.required = required
 
-    async def __call__(self, request: Request, response: Response):
+    async def __call__(self, request: Request, response: Response) -> Optional[Session]:
         session_token = request.cookies.get("session")
 
         # If not present, raise 401 if required
@@ -58,11 +85,21 @@ class SessionDependency:
                 raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
             return None
 
-        # Get session from database
-        session = Session.get_or_none(Session.token == session_token)
+        expired = False
+        if is_signed(session_token):
+            # Validated in memory; expired or revoked tokens simply come back as None
+            session = get_signed_session(session_token)
+        else:
+            # Get session from cache, or database
+            session = await get_session_async(session_token)
+
+            # Cached sessions are never expired, so the database is only touched here to revoke one
+            expired = session is not None and session.is_expired(revoke=False)
+            if expired:
+                await run_query(session.delete_instance)  # type: ignore
 
         # This doesn't differentiate between expired or completely invalid sessions
-        if session is None or session.is_expired(revoke=True):
+        if session is None or expired:
             if self.required:
                 logger.debug("Session Cookie Revoked", token=session_token)
                 response.delete_cookie("session")
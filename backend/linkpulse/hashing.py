@@ -0,0 +1,226 @@
+"""hashing.py
+This module moves password hashing off the event loop and onto a dedicated process pool.
+
+Argon2 is deliberately expensive, and calling it inside an `async def` handler blocks every other request for the
+duration of the hash. `HashingPool` runs hashes in worker processes, with a bounded queue that is scheduled
+round-robin between clients so a single client can't starve everyone else.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import cache, partial
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, Optional, Tuple
+
+import structlog
+from linkpulse.utilities import cpu_count, worker_count
+
+if TYPE_CHECKING:
+    from pwdlib import PasswordHash
+
+logger = structlog.get_logger()
+
+
+@cache
+def get_hasher() -> "PasswordHash":
+    # Imported on first use: only the worker processes (and tests) hash anything
+    from pwdlib import PasswordHash
+    from pwdlib.hashers.argon2 import Argon2Hasher
+
+    return PasswordHash([Argon2Hasher()])
+
+
+def __getattr__(name: str) -> Any:
+    # `hasher` is created on first access
+    if name == "hasher":
+        return get_hasher()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# These run inside the worker processes, so they must be importable (picklable) module-level functions.
+def _hash(password: str) -> str:
+    return get_hasher().hash(password)
+
+
+def _verify(password: str, hash: str) -> bool:
+    return get_hasher().verify(password, hash)
+
+
+def _verify_and_update(password: str, hash: str) -> Tuple[bool, Optional[str]]:
+    return get_hasher().verify_and_update(password, hash)
+
+
+class HashingPoolFull(Exception):
+    """Raised when the hashing queue is full; callers should respond with 503 Service Unavailable."""
+
+
+Job = Tuple[Callable[..., Any], Tuple[Any, ...], asyncio.Future, float]
+
+
+class HashingPool:
+    """
+    A process pool for password hashing, with a bounded queue that is fair between clients.
+
+    Jobs are queued per client key (e.g. IP address) and dispatched round-robin between keys, at most `workers` at a
+    time. Once `max_queued` jobs are waiting, further submissions fail immediately with `HashingPoolFull`.
+
+    If a worker process dies (e.g. killed for running out of memory), the jobs it was running fail with
+    `BrokenProcessPool`, and the executor is replaced so later jobs run on fresh workers.
+
+    The pool must only be used from within an event loop (i.e. async handlers); it is not thread-safe.
+    """
+
+    def __init__(self, workers: int, max_queued: int):
+        self.workers = workers
+        self.max_queued = max_queued
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._queues: OrderedDict[str, Deque[Job]] = OrderedDict()
+        self._queued = 0
+        self._running = 0
+
+        self.completed = 0
+        self.rejected = 0
+        self.restarts = 0
+        self.hash_seconds_total = 0.0
+        self.hash_seconds_max = 0.0
+        self.wait_seconds_total = 0.0
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        # Created lazily, so importing this module (or running `migrate`) doesn't spawn processes
+        if self._executor is None:
+            # 'spawn' avoids forking a process that already has threads running (scheduler, anyio, etc.)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _restart(self, broken: ProcessPoolExecutor) -> None:
+        """Drop a broken executor; the next job creates a new one."""
+        if self._executor is broken:
+            logger.warning("Hashing worker died, restarting the pool", workers=self.workers)
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self.restarts += 1
+
+    async def hash(self, key: str, password: str) -> str:
+        return await self._submit(key, _hash, password)
+
+    async def verify(self, key: str, password: str, hash: str) -> bool:
+        return await self._submit(key, _verify, password, hash)
+
+    async def verify_and_update(self, key: str, password: str, hash: str) -> Tuple[bool, Optional[str]]:
+        return await self._submit(key, _verify_and_update, password, hash)
+
+    async def _submit(self, key: str, fn: Callable[..., Any], *args: Any) -> Any:
+        if self._queued >= self.max_queued:
+            self.rejected += 1
+            logger.warning("Hashing queue full", key=key, queued=self._queued)
+            raise HashingPoolFull()
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, deque()).append((fn, args, future, time.perf_counter()))
+        self._queued += 1
+        self._dispatch()
+
+        return await future
+
+    def _dispatch(self) -> None:
+        """Start queued jobs, taking one from each client in turn, until all workers are busy."""
+        while self._running < self.workers and len(self._queues) > 0:
+            key, queue = next(iter(self._queues.items()))
+            fn, args, future, queued_at = queue.popleft()
+            self._queued -= 1
+
+            # Rotate the client to the back of the line, or drop it if it has nothing else queued
+            if len(queue) > 0:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+
+            # The caller went away (e.g. client disconnected) while waiting
+            if future.cancelled():
+                continue
+
+            started_at = time.perf_counter()
+            self.wait_seconds_total += started_at - queued_at
+
+            # Also runs from `_done`, so failures go to the job's caller rather than ours
+            executor = self.executor
+            try:
+                submitted = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                self._restart(executor)
+                executor = self.executor
+                try:
+                    submitted = executor.submit(fn, *args)
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            self._running += 1
+
+            result = asyncio.wrap_future(submitted, loop=future.get_loop())
+            result.add_done_callback(
+                partial(self._done, future=future, started_at=started_at, executor=executor)
+            )
+
+    def _done(
+        self,
+        result: asyncio.Future,
+        *,
+        future: asyncio.Future,
+        started_at: float,
+        executor: ProcessPoolExecutor,
+    ) -> None:
+        elapsed = time.perf_counter() - started_at
+        self._running -= 1
+        if not result.cancelled() and isinstance(result.exception(), BrokenProcessPool):
+            self._restart(executor)
+        self.completed += 1
+        self.hash_seconds_total += elapsed
+        self.hash_seconds_max = max(self.hash_seconds_max, elapsed)
+
+        if not future.cancelled():
+            if result.cancelled():
+                future.cancel()
+            elif result.exception() is not None:
+                future.set_exception(result.exception())  # type: ignore
+            else:
+                future.set_result(result.result())
+
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the pool's queue depth & latency counters.
+        """
+        return {
+            "workers": self.workers,
+            "queued": self._queued,
+            "running": self._running,
+            "max_queued": self.max_queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "restarts": self.restarts,
+            "hash_seconds_total": self.hash_seconds_total,
+            "hash_seconds_max": self.hash_seconds_max,
+            "wait_seconds_total": self.wait_seconds_total,
+        }
+
+
+# The available CPUs are shared between the app's worker processes, each with its own pool
+_workers = int(os.getenv("HASH_WORKERS", str(max(1, cpu_count() // worker_count()))))
+hashing_pool = HashingPool(workers=_workers, max_queued=int(os.getenv("HASH_QUEUE_SIZE", str(_workers * 16))))
@@ -1,7 +1,10 @@
+import contextvars
 import logging
 import os
+import queue
 import sys
-from typing import Any, List, Optional
+import threading
+from typing import IO, Any, Dict, List, Optional, Tuple
 
 import structlog
 from structlog.types import EventDict, Processor
@@ -31,12 +34,139 @@ def drop_color_message_key(_: Any, __: Any, event_dict: EventDict) -> EventDict:
     return event_dict
 
 
-def setup_logging(json_logs: Optional[bool] = None, log_level: Optional[str] = None) -> None:
+class QueuedStreamHandler(logging.Handler):
+    """
+    A handler that formats & writes log records on a background thread, so logging never waits on the stream.
+
+    Records are put on a bounded queue along with the caller's context (for `merge_contextvars`, which runs during
+    formatting for non-structlog records). The writer thread renders them in batches of up to `batch_size`, writing
+    and flushing each batch at once. When the queue is full, records are either dropped (and counted) or the caller
+    blocks until there is room, per `block`; drops are reported by the writer as they happen.
+
+    As records are formatted later, the arguments of `logging`-style messages should not be mutated after logging.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        stream: Optional[IO[str]] = None,
+        max_size: int = 10000,
+        block: bool = False,
+        batch_size: int = 256,
+    ):
+        super().__init__()
+        self.stream = stream if stream is not None else sys.stderr
+        self.block = block
+        self.batch_size = batch_size
+
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_size)
+        self._thread = threading.Thread(target=self._run, name="linkpulse-log-writer", daemon=True)
+        self._thread.start()
+
+        self.dropped = 0
+        self._dropped_reported = 0
+        self.written = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        item = (record, contextvars.copy_context())
+        if self.block:
+            self._queue.put(item)
+            return
+
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # Not locked; an occasional miscount under contention is acceptable here
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = any(item is self._STOP for item in batch)
+            self._write([item for item in batch if item is not self._STOP])
+            if stop:
+                return
+
+    def _write(self, batch: List[Tuple[logging.LogRecord, contextvars.Context]]) -> None:
+        lines = []
+        for record, context in batch:
+            try:
+                lines.append(context.run(self.format, record))
+            except Exception:
+                self.handleError(record)
+
+        dropped = self.dropped - self._dropped_reported
+        if dropped > 0:
+            self._dropped_reported += dropped
+            report = logging.LogRecord(
+                __name__, logging.WARNING, __file__, 0, "Log lines dropped", None, None
+            )
+            report.dropped = dropped  # type: ignore # Added to the entry by `ExtraAdder`
+            lines.append(self.format(report))
+
+        if len(lines) == 0:
+            return
+        try:
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+            self.written += len(lines)
+        except Exception:
+            self.handleError(batch[-1][0])
+
+    def close(self) -> None:
+        # Drain everything queued so far before the stream goes away
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+        super().close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "max_size": self._queue.maxsize,
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+
+# The handler installed by the latest `setup_logging` call, replaced if it is called again.
+handler: Optional[logging.Handler] = None
+
+
+def setup_logging(
+    json_logs: Optional[bool] = None,
+    log_level: Optional[str] = None,
+    queue_size: Optional[int] = None,
+    queue_policy: Optional[str] = None,
+) -> None:
+    """
+    :param json_logs: Render logs as JSON rather than for the console (`LOG_JSON_FORMAT`, default true).
+    :param log_level: The root log level (`LOG_LEVEL`, default INFO).
+    :param queue_size: How many log lines may be waiting to be written by the background writer
+                       (`LOG_QUEUE_SIZE`, default 10000). 0 writes synchronously instead.
+    :param queue_policy: What to do when the queue is full, 'drop' the line or 'block' until there is room
+                         (`LOG_QUEUE_POLICY`, default drop).
+    """
+    global handler
+
     # Pull from environment variables, apply defaults if not set
     if json_logs is None:
         json_logs = os.getenv("LOG_JSON_FORMAT", "true").lower() == "true"
     if log_level is None:
         log_level = os.getenv("LOG_LEVEL", "INFO")
+    if queue_size is None:
+        queue_size = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    if queue_policy is None:
+        queue_policy = os.getenv("LOG_QUEUE_POLICY", "drop").lower()
+    if queue_policy not in ("drop", "block"):
+        raise ValueError(f"Unknown log queue policy: {queue_policy!r}")
 
     def flatten(n):
         """
@@ -106,10 +236,17 @@ def setup_logging(json_logs: Optional[bool] = None, log_level: Optional[str] = N
         ],
     )
 
-    handler = logging.StreamHandler()
+    root_logger = logging.getLogger()
+    if handler is not None:
+        root_logger.removeHandler(handler)
+        handler.close()
+
+    if queue_size > 0:
+        handler = QueuedStreamHandler(max_size=queue_size, block=queue_policy == "block")
+    else:
+        handler = logging.StreamHandler()
     # Use OUR `ProcessorFormatter` to format all `logging` entries.
     handler.setFormatter(formatter)
-    root_logger = logging.getLogger()
     root_logger.addHandler(handler)
     root_logger.setLevel(log_level.upper())
 
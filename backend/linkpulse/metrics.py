@@ -0,0 +1,231 @@
+"""metrics.py
+This module provides an in-process metrics registry, exposed in the Prometheus text format (see `/metrics`).
+
+Updates are cheap enough for hot paths: each thread writes only to its own bucket of values, without locking, and
+buckets are summed when the metrics are collected. Components that already keep their own counters (`stats()`
+methods) are exported as-is through `Registry.register_stats` rather than duplicated here.
+
+This module must not import anything else from `linkpulse`, so it can be used anywhere.
+"""
+
+import bisect
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple
+
+Labels = Tuple[str, ...]
+
+# Seconds; suited to request & query latencies
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if len(names) == 0:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, bool):
+        return str(int(value))
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """A metric whose values are kept in one bucket per thread."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+        self._local = threading.local()
+        self._buckets: List[Dict[Labels, Any]] = []
+        self._buckets_lock = threading.Lock()
+
+    def _bucket(self) -> Dict[Labels, Any]:
+        try:
+            return self._local.bucket
+        except AttributeError:
+            bucket: Dict[Labels, Any] = {}
+            # Buckets outlive their threads, so nothing recorded is ever lost
+            with self._buckets_lock:
+                self._buckets.append(bucket)
+            self._local.bucket = bucket
+            return bucket
+
+    def _snapshots(self) -> Iterator[Dict[Labels, Any]]:
+        with self._buckets_lock:
+            buckets = list(self._buckets)
+        for bucket in buckets:
+            # Copying a dict holds the GIL throughout, so this is safe against the owning thread's writes
+            yield dict(bucket)
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        bucket = self._bucket()
+        bucket[labels] = bucket.get(labels, 0) + amount
+
+    def collect(self) -> Dict[Labels, float]:
+        totals: Dict[Labels, float] = {}
+        for snapshot in self._snapshots():
+            for labels, value in snapshot.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(self.collect().items())
+        ]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, help, labelnames)
+        self.bounds = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        bucket = self._bucket()
+        counts = bucket.get(labels)
+        if counts is None:
+            # Per-bound counts (not cumulative), then the +Inf count & the sum
+            counts = bucket[labels] = [0] * (len(self.bounds) + 1) + [0.0]
+        counts[bisect.bisect_left(self.bounds, value)] += 1
+        counts[-1] += value
+
+    def collect(self) -> Dict[Labels, List[float]]:
+        totals: Dict[Labels, List[float]] = {}
+        for snapshot in self._snapshots():
+            for labels, counts in snapshot.items():
+                counts = list(counts)
+                total = totals.get(labels)
+                totals[labels] = counts if total is None else [a + b for a, b in zip(total, counts)]
+        return totals
+
+    def render(self) -> List[str]:
+        lines = []
+        names = (*self.labelnames, "le")
+        for labels, counts in sorted(self.collect().items()):
+            cumulative = 0.0
+            for bound, count in zip((*self.bounds, float("inf")), counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(names, (*labels, _format_value(bound)))} {int(cumulative)}"
+                )
+            lines.append(
+                f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(counts[-1])}"
+            )
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {int(cumulative)}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._stats: List[Tuple[str, Callable[[], Dict[str, Any]]]] = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))  # type: ignore
+
+    def histogram(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))  # type: ignore
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def register_stats(self, prefix: str, stats: Callable[[], Dict[str, Any]]) -> None:
+        """
+        Export the numeric values of a `stats()` dict, each as `<prefix>_<key>`, whenever metrics are collected.
+        """
+        self._stats.append((prefix, stats))
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+
+        for prefix, stats in self._stats:
+            for key, value in stats().items():
+                # Booleans are numbers too, but descriptive values (e.g. a backend's name) are skipped
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {prefix}_{key} untyped")
+                    lines.append(f"{prefix}_{key} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "linkpulse_http_requests_total", "HTTP requests handled.", ("route", "method", "status")
+)
+http_request_duration = registry.histogram(
+    "linkpulse_http_request_duration_seconds", "Time spent handling HTTP requests.", ("route", "method")
+)
+db_query_duration = registry.histogram(
+    "linkpulse_db_query_duration_seconds", "Time spent executing SQL statements.", ("statement",)
+)
+db_queries_per_request = registry.histogram(
+    "linkpulse_db_queries_per_request",
+    "SQL statements executed per HTTP request.",
+    ("route",),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+rate_limit_rejections = registry.counter(
+    "linkpulse_rate_limit_rejections_total", "Requests rejected by a rate limit.", ("limit",)
+)
+scheduler_job_duration = registry.histogram(
+    "linkpulse_scheduler_job_duration_seconds",
+    "Time spent running scheduled jobs.",
+    ("job", "outcome"),
+    buckets=(0.001, 0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+
+
+def timed_job(job: str, fn: Callable[[], Any]) -> Callable[[], Any]:
+    """Wrap a scheduled job, recording how long each run takes and whether it raised."""
+
+    def run() -> Any:
+        start_time = time.perf_counter()
+        outcome = "error"
+        try:
+            result = fn()
+            outcome = "success"
+            return result
+        finally:
+            scheduler_job_duration.observe(time.perf_counter() - start_time, job, outcome)
+
+    return run
+
+
+def statement_type(sql: str) -> str:
+    """The kind of a SQL statement (e.g. 'select'), as a low-cardinality label."""
+    keyword = sql.lstrip()[:6].lower()
+    return keyword if keyword in ("select", "insert", "update", "delete") else "other"
@@ -1,58 +1,183 @@
+import asyncio
+import itertools
+import logging
+import os
 import time
-from asgi_correlation_id import correlation_id
-import structlog
+from typing import Optional
 
+import structlog
+from asgi_correlation_id import correlation_id
+from linkpulse.database import QueryStats, track_queries
+from linkpulse.metrics import db_queries_per_request, http_request_duration, http_requests
+from linkpulse.profiler import profiler
 from linkpulse.utilities import is_development
-from fastapi import FastAPI, Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from linkpulse.watchdog import current_requests
+from starlette.datastructures import URL, MutableHeaders, QueryParams
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+def level_number(level: str) -> Optional[int]:
+    """The number of a logging level by name (e.g. 'debug'), or None if there is no such level."""
+    number = logging.getLevelName(level.upper())
+    return number if isinstance(number, int) else None
+
+
+# The level access log entries are written at; below the configured `LOG_LEVEL`, they are skipped entirely.
+access_log_level = os.getenv("ACCESS_LOG_LEVEL", "debug").lower()
+if level_number(access_log_level) is None:
+    raise ValueError(f"Unknown ACCESS_LOG_LEVEL: {access_log_level!r}")
+# Log 1 in N successful requests; client & server errors and requests slower than `ACCESS_LOG_SLOW_MS` are always logged.
+access_log_sample_rate = int(os.getenv("ACCESS_LOG_SAMPLE_RATE", "1"))
+access_log_slow_ms = float(os.getenv("ACCESS_LOG_SLOW_MS", "1000"))
+# Warn when a request executes the same statement more than this many times (likely an N+1 query); 0 disables.
+# Only enabled by default in development.
+query_repeat_threshold = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5" if is_development else "0"))
+
+
+def format_ms(ns: int) -> str:
+    return "{:.2f}".format(ns / 10**6)
+
+
+class LoggingMiddleware:
+    """
+    Binds the request ID to all log entries emitted during a request, and writes an access log entry for it.
+
+    This is a plain ASGI middleware rather than a `BaseHTTPMiddleware`: `send` is wrapped to capture the status code
+    and time to first byte as the response starts, so the response itself (streaming or not) passes straight through.
 
+    Access log entries are only built if they will be written: when `level` is enabled for the `api.access` logger,
+    and the request is sampled (1 in `sample_rate`) or is an error (4xx or 5xx) or slower than `slow_ms`.
+    """
 
-class LoggingMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app: FastAPI):
-        super().__init__(app)
+    def __init__(
+        self,
+        app: ASGIApp,
+        level: Optional[str] = None,
+        sample_rate: Optional[int] = None,
+        slow_ms: Optional[float] = None,
+        n_plus_one_threshold: Optional[int] = None,
+    ):
+        self.app = app
         self.access_logger = structlog.get_logger("api.access")
 
-    async def dispatch(self, request: Request, call_next) -> Response:
+        self.level = level or access_log_level
+        self.sample_rate = max(1, sample_rate or access_log_sample_rate)
+        self.slow_ns = int((slow_ms if slow_ms is not None else access_log_slow_ms) * 10**6)
+
+        # structlog hands entries to this logger, whose (cached) level check is all a skipped entry costs
+        self._stdlib_logger = logging.getLogger("api.access")
+        level_no = level_number(self.level)
+        if level_no is None:
+            raise ValueError(f"Unknown access log level: {self.level!r}")
+        self._level_no = level_no
+        self._requests = itertools.count()
+
+        self.n_plus_one_threshold = (
+            n_plus_one_threshold if n_plus_one_threshold is not None else query_repeat_threshold
+        )
+        self.logger = structlog.get_logger(__name__)
+
+    def should_log(self, status_code: int, duration_ns: int) -> bool:
+        if not self._stdlib_logger.isEnabledFor(self._level_no):
+            return False
+        if status_code >= 400 or duration_ns >= self.slow_ns:
+            return True
+        return next(self._requests) % self.sample_rate == 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
         structlog.contextvars.clear_contextvars()
 
         # These context vars will be added to all log entries emitted during the request
         request_id = correlation_id.get()
         structlog.contextvars.bind_contextvars(request_id=request_id)
+        # Lets the event loop watchdog attribute a stall to this request
+        task = asyncio.current_task()
+        if task is not None and request_id is not None:
+            current_requests[task] = request_id
+
+        # Profile this request if asked to; skipped outright unless profiling is configured
+        sampler = None
+        if profiler.token is not None:
+            token = next((value for name, value in scope["headers"] if name == b"x-profile"), None)
+            if profiler.authorized(token.decode("latin-1") if token is not None else None):
+                sampler = profiler.start()
 
         start_time = time.perf_counter_ns()
-        # If the call_next raises an error, we still want to return our own 500 response,
-        # so we can add headers to it (process time, request ID...)
-        response = Response(status_code=500)
+        # If the app raises before starting a response, the server responds with a 500
+        status_code = 500
+        first_byte_ns = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code, first_byte_ns
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                first_byte_ns = time.perf_counter_ns() - start_time
+                if is_development:
+                    MutableHeaders(scope=message).append("X-Process-Time", format_ms(first_byte_ns))
+                if sampler is not None and request_id is not None:
+                    # The profile can be fetched from `/api/profile/<id>` once the request is done
+                    MutableHeaders(scope=message).append("X-Profile-Id", request_id)
+            await send(message)
+
         try:
-            response = await call_next(request)
+            with track_queries() as queries:
+                await self.app(scope, receive, send_wrapper)
         except Exception:
-            # TODO: Validate that we don't swallow exceptions (unit test?)
+            # The exception is re-raised, so the server still handles it as usual
             structlog.stdlib.get_logger("api.error").exception("Uncaught exception")
             raise
         finally:
-            process_time_ms = "{:.2f}".format(
-                (time.perf_counter_ns() - start_time) / 10**6
-            )
-
-            self.access_logger.debug(
-                "Request",
-                http={
-                    "url": str(request.url),
-                    "query": dict(request.query_params),
-                    "status_code": response.status_code,
-                    "method": request.method,
-                    "request_id": request_id,
-                    "version": request.scope["http_version"],
-                },
-                client=(
-                    {"ip": request.client.host, "port": request.client.port}
-                    if request.client
-                    else None
-                ),
-                duration_ms=process_time_ms,
-            )
-
-            if is_development:
-                response.headers["X-Process-Time"] = process_time_ms
-
-            return response
+            duration_ns = time.perf_counter_ns() - start_time
+            if task is not None:
+                current_requests.pop(task, None)
+            if sampler is not None:
+                profiler.stop(sampler, request_id or "unknown")
+
+            # The route's path template rather than the actual path, so labels stay bounded
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            http_requests.inc(route_path, scope["method"], str(status_code))
+            http_request_duration.observe(duration_ns / 10**9, route_path, scope["method"])
+            db_queries_per_request.observe(queries.count, route_path)
+
+            if self.n_plus_one_threshold > 0:
+                for sql, count in queries.repeated(self.n_plus_one_threshold):
+                    self.logger.warning(
+                        "Possible N+1 query", route=route_path, method=scope["method"], count=count, sql=sql
+                    )
+
+            if self.should_log(status_code, duration_ns):
+                self.log(scope, request_id, status_code, duration_ns, first_byte_ns, queries)
+
+    def log(
+        self,
+        scope: Scope,
+        request_id: Optional[str],
+        status_code: int,
+        duration_ns: int,
+        first_byte_ns: Optional[int],
+        queries: QueryStats,
+    ) -> None:
+        client = scope.get("client")
+        # Sampled entries carry their rate, so counts can be scaled back up
+        sampling = {"sample_rate": self.sample_rate} if self.sample_rate > 1 else {}
+        getattr(self.access_logger, self.level)(
+            "Request",
+            http={
+                "url": str(URL(scope=scope)),
+                "query": dict(QueryParams(scope["query_string"])),
+                "status_code": status_code,
+                "method": scope["method"],
+                "request_id": request_id,
+                "version": scope["http_version"],
+            },
+            client={"ip": client[0], "port": client[1]} if client else None,
+            duration_ms=format_ms(duration_ns),
+            ttfb_ms=format_ms(first_byte_ns) if first_byte_ns is not None else None,
+            db={"queries": queries.count, "duration_ms": "{:.2f}".format(queries.duration * 1000)},
+            **sampling,
+        )
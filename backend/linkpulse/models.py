@@ -6,12 +6,28 @@ It also provides a base model with database connection details.
 import datetime
 import secrets
 from os import getenv
-from typing import Optional
+from typing import List, Optional, Tuple
 
 import structlog
+from linkpulse.database import connect_database
+from linkpulse.sessions import invalid_tokens, last_used_buffer, live_tokens
 from linkpulse.utilities import utc_now
-from peewee import AutoField, BitField, CharField, Check, DateTimeField, ForeignKeyField, Model
-from playhouse.db_url import connect
+from peewee import (
+    AutoField,
+    BitField,
+    BlobField,
+    CharField,
+    Check,
+    DateTimeField,
+    ForeignKeyField,
+    IntegerField,
+    Model,
+    Select,
+    TextField,
+    Value,
+    fn,
+)
+from peewee import Tuple as Row
 
 logger = structlog.get_logger()
 
@@ -26,8 +42,8 @@ def _get_database_url():
 
 class BaseModel(Model):
     class Meta:
-        # accessed via `BaseModel._meta.database`
-        database = connect(url=_get_database_url())
+        # accessed via `BaseModel._meta.database`; `DATABASE_URL` is only read once a connection is first needed
+        database = connect_database(url=_get_database_url)
 
 
 class User(BaseModel):
@@ -46,6 +62,40 @@ class User(BaseModel):
     # TODO: delete method, ensure sessions are deleted as well
     # TODO: undelete method
 
+    @classmethod
+    def register(cls, email: str, password_hash: str, token: str, expiry: datetime.datetime) -> Optional[int]:
+        """
+        Create a user along with their first session, in a single statement (and so a single transaction).
+
+        The user is inserted with `ON CONFLICT (email) DO NOTHING`, and the session is inserted from its result, so a
+        taken email creates nothing; concurrent registrations for the same email are settled by the unique index.
+
+        :return: The new user's ID, or None if the email is already registered.
+        """
+        now = utc_now()
+        new_user = (
+            cls.insert(email=email, password_hash=password_hash, created_at=now, updated_at=now)
+            .on_conflict(action="IGNORE", conflict_target=[cls.email])
+            .returning(cls.id)
+            .cte("new_user")
+        )
+        query = (
+            Session.insert_from(
+                Select([new_user], [Value(token), new_user.c.id, Value(expiry), Value(now)]),
+                fields=[Session.token, Session.user, Session.expiry, Session.created_at],
+            )
+            .with_cte(new_user)
+            .returning(Session.user)
+        )
+
+        row = query.tuples().execute()
+        user_id = next(iter(row), (None,))[0]
+        if user_id is not None:
+            # Inserted directly, so `Session.save` isn't there to do this
+            live_tokens.add(token)
+            invalid_tokens.discard(token)
+        return user_id
+
 
 class Session(BaseModel):
     """
@@ -59,12 +109,19 @@ class Session(BaseModel):
     token = CharField(unique=True, primary_key=True, max_length=32)
     user = ForeignKeyField(User, backref="sessions", on_delete="CASCADE")
 
-    expiry = DateTimeField()
+    expiry = DateTimeField(index=True)
 
-    created_at = DateTimeField(default=utc_now)
+    created_at = DateTimeField(default=utc_now, index=True)
     last_used = DateTimeField(default=None, null=True)
 
+    # Set by peewee (the foreign key's column), `page_active` & `linkpulse.sessions.get_signed_session` respectively
+    user_id: int
+    digest: str
+    user_loaded: bool
+
     class Meta:
+        # Serves listing a user's active sessions (`/api/sessions`) with a single index range scan
+        indexes = ((("user", "expiry"), False),)
         constraints = [
             Check("LENGTH(token) = 32", name="session_token_length"),
             Check("expiry > created_at", name="session_expiry_created_at"),
@@ -74,11 +131,62 @@ class Session(BaseModel):
             ),
         ]
 
+    def save(self, force_insert: bool = False, only=None) -> int:
+        rows = super().save(force_insert=force_insert, only=only)
+        # The primary key isn't generated, so new sessions are always inserted explicitly (e.g. `Session.create`)
+        if force_insert:
+            live_tokens.add(self.token)  # type: ignore[arg-type]
+            invalid_tokens.discard(self.token)  # type: ignore[arg-type]
+        return rows
+
     @classmethod
     def generate_token(cls) -> str:
         alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
         return "".join(secrets.choice(alphabet) for _ in range(32))
 
+    @classmethod
+    def get_with_user(cls, token: str) -> Optional["Session"]:
+        """
+        Get a session by token with a slim projection of its user (id, email & flags), joined in a single query.
+        Accessing `session.user` on the result will not issue another query.
+        """
+        return (
+            cls.select(cls, User.id, User.email, User.flags)
+            .join(User)
+            .where(cls.token == token)
+            .get_or_none()
+        )
+
+    @classmethod
+    def page_active(
+        cls,
+        user_id: int,
+        limit: int,
+        after: Optional[Tuple[datetime.datetime, str]] = None,
+        now: Optional[datetime.datetime] = None,
+    ) -> List["Session"]:
+        """
+        Get a page of a user's unexpired sessions, latest expiry first, via keyset pagination on the (user, expiry) index.
+
+        Each returned session has a `digest` attribute (an MD5 of the token) which identifies it without revealing the
+        token itself, and breaks ties between equal expiry times.
+
+        :param after: The (expiry, digest) of the last session on the previous page, if any.
+        """
+        if now is None:
+            now = utc_now()
+
+        digest = fn.md5(cls.token)
+        query = (
+            cls.select(cls.token, cls.created_at, cls.last_used, cls.expiry, digest.alias("digest"))
+            .where((cls.user == user_id) & (cls.expiry > now))
+            .order_by(cls.expiry.desc(), digest.desc())
+            .limit(limit)
+        )
+        if after is not None:
+            query = query.where(Row(cls.expiry, digest) < Row(*after))
+        return list(query)
+
     @property
     def expiry_utc(self) -> datetime.datetime:
         return self.expiry.replace(tzinfo=datetime.timezone.utc)  # type: ignore
@@ -91,7 +199,7 @@ class Session(BaseModel):
             now = utc_now()
 
         if self.expiry_utc < now:
-            logger.debug("Session expired", token=self.token, user=self.user.email, revoke=revoke)
+            logger.debug("Session expired", token=self.token, user_id=self.user_id, revoke=revoke)
             if revoke:
                 self.delete_instance()
             return True
@@ -100,10 +208,44 @@ class Session(BaseModel):
     def use(self, now: Optional[datetime.datetime] = None):
         """
         Update the last_used field of the session.
+
+        The database is not written to immediately; the timestamp is held in `last_used_buffer` and flushed in batches,
+        so the stored value may lag behind by up to `last_used_buffer.interval` seconds.
         """
         if now is None:
             now = utc_now()
         self.last_used = now  # type: ignore
-        # TODO: This should be buffered, as it'll be called *constantly*, perhaps every single request.
-        # The ideal solution would be emitting updates to a Redis-based cache, and then flushing to the database every few seconds/minute.
-        self.save()
+        last_used_buffer.record(self.token, now)  # type: ignore
+
+
+class SessionRevocation(BaseModel):
+    """
+    A session that was deleted before its expiry. Kept until then, so signed tokens for it are still rejected.
+    See `linkpulse.tokens` for details.
+    """
+
+    token = CharField(primary_key=True, max_length=32)
+    expiry = DateTimeField(index=True)
+
+
+class RateLimit(BaseModel):
+    """
+    A fixed-window rate limit counter shared between replicas; see `linkpulse.ratelimit.PostgresStorage`.
+    The table is UNLOGGED, as losing counters on a crash is harmless.
+    """
+
+    key = TextField(primary_key=True)
+    count = IntegerField()
+    expiry = DateTimeField(index=True)
+
+
+class ResponseCache(BaseModel):
+    """
+    A response cached by the `@cache` decorators, shared between replicas; see `linkpulse.cache.PostgresCacheTier`.
+    The table is UNLOGGED, as losing cached responses on a crash is harmless.
+    """
+
+    key = TextField(primary_key=True)
+    value = BlobField()
+    # None never expires
+    expiry = DateTimeField(null=True, index=True)
@@ -0,0 +1,145 @@
+"""notify.py
+This module provides `InvalidationListener`, which broadcasts invalidations of per-process caches (the response
+cache's local tier, and the session cache) to every other process through Postgres' `LISTEN`/`NOTIFY`.
+
+It doesn't import the web framework, so the session helpers (and thus the models) can use it.
+"""
+
+import asyncio
+import json
+import os
+import select
+import threading
+import uuid
+from typing import Any, Dict, Optional, Protocol, Tuple, cast
+
+import structlog
+
+
+class Discards(Protocol):
+    """A per-process cache that invalidations can be applied to; `discard(None, None)` drops every entry."""
+
+    def discard(self, namespace: Optional[str] = None, key: Optional[str] = None) -> Any: ...
+
+
+class InvalidationListener:
+    """
+    Broadcasts cache invalidations to every process on every replica through Postgres' `NOTIFY` on `channel`, and
+    applies those of other processes to this process's `cache` (a `MemoryCacheBackend`, or the `SessionCache`).
+
+    A thread `LISTEN`s on a dedicated connection, to which notifications are delivered as soon as the transaction
+    sending them commits; they are applied on the event loop. Notifications sent while that connection is down are
+    lost, so after reconnecting, the whole local cache is dropped rather than risk serving invalidated values.
+    """
+
+    CHANNEL = "linkpulse_cache"
+
+    def __init__(self, cache: Discards, channel: str = CHANNEL, reconnect_interval: float = 5.0):
+        self.cache = cache
+        self.channel = channel
+        self.reconnect_interval = reconnect_interval
+        # Identifies this process's notifications, which it has already applied
+        self.origin = uuid.uuid4().hex
+        self.logger = structlog.get_logger(__name__)
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._wakeup: Optional[Tuple[int, int]] = None
+        # Set while the connection is listening
+        self.listening = threading.Event()
+
+        self.sent = 0
+        self.received = 0
+        self.reconnects = 0
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Start listening; invalidations are applied on `loop`."""
+        self._loop = loop
+        self._stop.clear()
+        self._wakeup = os.pipe()
+        self._thread = threading.Thread(
+            target=self._listen, name=f"linkpulse-{self.channel}-listener", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None and self._wakeup is not None:
+            self._stop.set()
+            os.write(self._wakeup[1], b"\0")
+            self._thread.join()
+            self._thread = None
+            for fd in self._wakeup:
+                os.close(fd)
+            self._wakeup = None
+
+    def publish(self, namespace: Optional[str] = None, key: Optional[str] = None) -> None:
+        """Notify every other process of an invalidation. Blocking."""
+        from linkpulse.utilities import get_db
+
+        payload = json.dumps({"origin": self.origin, "namespace": namespace, "key": key})
+        get_db().execute_sql("SELECT pg_notify(%s, %s)", (self.channel, payload))
+        self.sent += 1
+
+    def _listen(self) -> None:
+        from linkpulse.database import InstrumentedPostgresqlDatabase
+        from linkpulse.utilities import get_db
+
+        assert self._wakeup is not None
+        db = cast(InstrumentedPostgresqlDatabase, get_db())
+        connected = False
+        while not self._stop.is_set():
+            try:
+                connection = db.dedicated_connection()
+            except Exception as e:
+                self.logger.warning(
+                    "Invalidation listener failed to connect", channel=self.channel, error=str(e)
+                )
+                self._stop.wait(self.reconnect_interval)
+                continue
+
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                if connected:
+                    self.reconnects += 1
+                    self._apply(None, None)
+                connected = True
+                self.listening.set()
+
+                while not self._stop.is_set():
+                    readable, _, _ = select.select([connection, self._wakeup[0]], [], [])
+                    if connection in readable:
+                        connection.poll()
+                        while connection.notifies:
+                            self._receive(connection.notifies.pop(0).payload)
+            except Exception as e:
+                self.logger.warning("Invalidation listener disconnected", channel=self.channel, error=str(e))
+                self._stop.wait(self.reconnect_interval)
+            finally:
+                self.listening.clear()
+                connection.close()
+
+    def _receive(self, payload: str) -> None:
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        if message.get("origin") == self.origin:
+            return
+        self.received += 1
+        self._apply(message.get("namespace"), message.get("key"))
+
+    def _apply(self, namespace: Optional[str], key: Optional[str]) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self.cache.discard, namespace, key)  # type: ignore
+        except RuntimeError:
+            # The loop has closed
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "invalidations_sent": self.sent,
+            "invalidations_received": self.received,
+            "listener_reconnects": self.reconnects,
+        }
@@ -0,0 +1,115 @@
+"""profiler.py
+This module provides an on-demand sampling profiler, producing collapsed stacks (the input format of flamegraph tools
+such as `flamegraph.pl`, speedscope or inferno).
+
+While a profile is running, a background thread samples the stacks of every other thread in the process (the event
+loop, database threads, etc.) at a fixed interval. Nothing runs, and nothing is hooked, while no profile is running.
+
+Profiles are started either for a single request, by sending `X-Profile: <PROFILER_TOKEN>` (see `LoggingMiddleware`),
+or for a window of time through `/api/profile`. Both are disabled unless `PROFILER_TOKEN` is set.
+"""
+
+import hmac
+import os
+import sys
+import threading
+from collections import Counter, OrderedDict
+from types import FrameType
+from typing import Any, Dict, List, Optional
+
+
+class Sampler:
+    """
+    Samples the stacks of all other threads every `interval` seconds, until stopped.
+    Each sample is counted by its collapsed stack: the thread name, then each frame from the outermost in.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="linkpulse-profiler", daemon=True)
+
+    def start(self) -> "Sampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> "Sampler":
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self.stacks[f"{names.get(ident, ident)};{collapse(frame)}"] += 1
+            self.samples += 1
+
+    def render(self) -> str:
+        """Render the samples as collapsed stacks, one `<stack> <count>` per line."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def collapse(frame: Optional[FrameType]) -> str:
+    frames: List[str] = []
+    while frame is not None:
+        code = frame.f_code
+        # e.g. `argon2.low_level:hash_secret`, `peewee:execute_sql`
+        frames.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+class Profiler:
+    """
+    Runs at most one `Sampler` at a time (so profiling can't pile up overhead), and keeps the last few profiles.
+    Profiling is only possible when a `token` is configured, which callers must present.
+    """
+
+    def __init__(self, token: Optional[str], interval: float, keep: int = 16):
+        self.token = token
+        self.interval = interval
+        self.keep = keep
+
+        self._lock = threading.Lock()
+        self._active: Optional[Sampler] = None
+        self._profiles: OrderedDict[str, str] = OrderedDict()
+
+    def authorized(self, token: Optional[str]) -> bool:
+        return self.token is not None and token is not None and hmac.compare_digest(token, self.token)
+
+    def start(self) -> Optional[Sampler]:
+        """Start sampling, or return None if a profile is already running."""
+        with self._lock:
+            if self._active is not None:
+                return None
+            self._active = Sampler(self.interval).start()
+            return self._active
+
+    def stop(self, sampler: Sampler, profile_id: str) -> str:
+        """Stop sampling, keeping the profile under `profile_id`."""
+        profile = sampler.stop().render()
+        with self._lock:
+            self._active = None
+            self._profiles[profile_id] = profile
+            while len(self._profiles) > self.keep:
+                self._profiles.popitem(last=False)
+        return profile
+
+    def get(self, profile_id: str) -> Optional[str]:
+        return self._profiles.get(profile_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"active": self._active is not None, "kept": len(self._profiles)}
+
+
+profiler = Profiler(
+    token=os.getenv("PROFILER_TOKEN") or None,
+    # Seconds between samples
+    interval=float(os.getenv("PROFILER_INTERVAL", "0.005")),
+)
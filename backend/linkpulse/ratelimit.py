@@ -0,0 +1,379 @@
+"""ratelimit.py
+This module provides rate limit storage backends that are shared between processes, for use with `limits`.
+
+`limits`' own `MemoryStorage` is per-process, so with several workers each one enforces the full limit on its own.
+`SharedMemoryStorage` keeps counters in a memory-mapped file that every worker on the host maps, and
+`PostgresStorage` keeps them in the database (batching increments locally) for deployments with several replicas.
+
+Both only support fixed-window counters (`incr`/`get`), not the moving window's per-hit timestamps.
+
+`GCRARateLimiter` is an alternative, per-process strategy that keeps a single timestamp per key and caps the number of
+keys it tracks, so memory stays bounded no matter how many distinct clients show up.
+"""
+
+import datetime
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple, Type, Union
+
+import structlog
+from limits import RateLimitItem
+from limits.aio.storage import MemoryStorage, Storage
+from limits.util import WindowStats
+from linkpulse.sharedtable import SharedTable
+from linkpulse.utilities import utc_now, worker_count
+from peewee import EXCLUDED, Case, DatabaseError
+
+logger = structlog.get_logger()
+
+
+class SharedMemoryStorage(Storage):
+    """
+    Fixed-window counters in a `SharedTable`, shared by every process on the host that opens the same path.
+
+    Each slot holds a key's hash, expiry & count. As the table never grows, a key may be evicted when every slot it
+    probes is live, which can only make the limit more lenient for that key.
+    """
+
+    STORAGE_SCHEME = None
+
+    SLOT = struct.Struct("<Qdq")  # key hash (0 = empty), expiry (UNIX time), count
+
+    def __init__(self, path: str, slots: int = 65536, probes: int = 16):
+        super().__init__()
+        self.table = SharedTable(path, slots, self.SLOT.size, probes)
+
+    @property
+    def evictions(self) -> int:
+        return self.table.evictions
+
+    @property
+    def base_exceptions(self) -> Union[Type[Exception], Tuple[Type[Exception], ...]]:
+        return OSError
+
+    def _read(self, slot: int) -> Tuple[int, float, int]:
+        return self.SLOT.unpack_from(self.table.map, self.table.offset(slot))
+
+    def _write(self, slot: int, key_hash: int, expiry: float, count: int) -> None:
+        self.SLOT.pack_into(self.table.map, self.table.offset(slot), key_hash, expiry, count)
+
+    async def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+        key_hash, now = SharedTable.hash(key.encode()), time.time()
+        with self.table.locked():
+            slot = self.table.find(key_hash, now, insert=True)
+            assert slot is not None
+            slot_hash, slot_expiry, count = self._read(slot)
+
+            if slot_hash != key_hash or slot_expiry <= now:
+                count, slot_expiry = amount, now + expiry
+            else:
+                count += amount
+                if elastic_expiry:
+                    slot_expiry = now + expiry
+
+            self._write(slot, key_hash, slot_expiry, count)
+            return count
+
+    def _get(self, key: str) -> Tuple[int, float]:
+        key_hash, now = SharedTable.hash(key.encode()), time.time()
+        with self.table.locked():
+            slot = self.table.find(key_hash, now, insert=False)
+            if slot is None:
+                return 0, now
+            _, expiry, count = self._read(slot)
+            return (count, expiry) if expiry > now else (0, now)
+
+    async def get(self, key: str) -> int:
+        return self._get(key)[0]
+
+    async def get_expiry(self, key: str) -> int:
+        return int(self._get(key)[1])
+
+    async def check(self) -> bool:
+        return not self.table.map.closed
+
+    async def reset(self) -> Optional[int]:
+        with self.table.locked():
+            live = self.table.live(time.time())
+            self.table.reset()
+        return live
+
+    async def clear(self, key: str) -> None:
+        key_hash = SharedTable.hash(key.encode())
+        with self.table.locked():
+            slot = self.table.find(key_hash, time.time(), insert=False)
+            if slot is not None:
+                self.table.erase(slot)
+
+    def close(self) -> None:
+        self.table.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.table.locked():
+            live = self.table.live(time.time())
+        return {"backend": "shared", "slots": self.table.slots, "live": live, "evictions": self.evictions}
+
+
+class PostgresStorage(Storage):
+    """
+    Fixed-window counters in the `ratelimit` table, shared between replicas.
+
+    Increments are counted locally and written in one upsert every `interval` seconds (see `flush`), which also
+    brings back the global counts. Between flushes, a key's count is its last known global count plus this process's
+    unflushed hits, so the limit may be exceeded by up to one interval's worth of hits from the other replicas.
+    """
+
+    STORAGE_SCHEME = None
+
+    def __init__(self, interval: float = 1.0):
+        super().__init__()
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        # key -> (unflushed hits, window length in seconds)
+        self._pending: Dict[str, Tuple[int, int]] = {}
+        # key -> (global count as of the last flush, expiry as UNIX time)
+        self._known: Dict[str, Tuple[int, float]] = {}
+
+        self.flushes = 0
+        self.flush_failures = 0
+        self.flush_seconds_last = 0.0
+
+    @property
+    def base_exceptions(self) -> Union[Type[Exception], Tuple[Type[Exception], ...]]:
+        return DatabaseError
+
+    def _known_count(self, key: str, now: float) -> Tuple[int, Optional[float]]:
+        count, expiry = self._known.get(key, (0, 0.0))
+        return (count, expiry) if expiry > now else (0, None)
+
+    async def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+        with self._lock:
+            pending, _ = self._pending.get(key, (0, expiry))
+            self._pending[key] = (pending + amount, expiry)
+            return self._known_count(key, time.time())[0] + pending + amount
+
+    async def get(self, key: str) -> int:
+        with self._lock:
+            return self._known_count(key, time.time())[0] + self._pending.get(key, (0, 0))[0]
+
+    async def get_expiry(self, key: str) -> int:
+        now = time.time()
+        with self._lock:
+            _, expiry = self._known_count(key, now)
+            if expiry is None:
+                expiry = now + self._pending.get(key, (0, 0))[1]
+        return int(expiry)
+
+    async def check(self) -> bool:
+        return True
+
+    async def reset(self) -> Optional[int]:
+        from linkpulse.database import run_query
+        from linkpulse.models import RateLimit
+
+        with self._lock:
+            self._pending.clear()
+            self._known.clear()
+        return await run_query(RateLimit.delete().execute)
+
+    async def clear(self, key: str) -> None:
+        from linkpulse.database import run_query
+        from linkpulse.models import RateLimit
+
+        with self._lock:
+            self._pending.pop(key, None)
+            self._known.pop(key, None)
+        await run_query(RateLimit.delete().where(RateLimit.key == key).execute)
+
+    def flush(self) -> int:
+        """
+        Write unflushed hits to the database in a single upsert, and update the known global counts.
+        Blocking; meant to be run by the scheduler.
+
+        :return: The number of keys written.
+        """
+        from linkpulse.database import connection_scope
+        from linkpulse.models import RateLimit
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            now = time.time()
+            self._known = {key: known for key, known in self._known.items() if known[1] > now}
+        if len(pending) == 0:
+            return 0
+
+        start_time = time.perf_counter()
+        now_dt = utc_now()
+        rows = [
+            {"key": key, "count": amount, "expiry": now_dt + datetime.timedelta(seconds=window)}
+            for key, (amount, window) in pending.items()
+        ]
+
+        # An expired window restarts with this batch's hits, otherwise they are added on
+        expired = RateLimit.expiry <= now_dt
+        query = (
+            RateLimit.insert_many(rows)
+            .on_conflict(
+                conflict_target=[RateLimit.key],
+                update={
+                    RateLimit.count: Case(
+                        None, [(expired, EXCLUDED.count)], RateLimit.count + EXCLUDED.count
+                    ),
+                    RateLimit.expiry: Case(None, [(expired, EXCLUDED.expiry)], RateLimit.expiry),
+                },
+            )
+            .returning(RateLimit.key, RateLimit.count, RateLimit.expiry)
+        )
+
+        try:
+            with connection_scope():
+                results = list(query.tuples().execute())
+        except Exception as e:
+            # Put the hits back so they're counted on the next attempt
+            with self._lock:
+                for key, (amount, window) in pending.items():
+                    merged, _ = self._pending.get(key, (0, window))
+                    self._pending[key] = (merged + amount, window)
+                self.flush_failures += 1
+            logger.warning("Rate limit flush failed", error=str(e), keys=len(pending))
+            return 0
+
+        with self._lock:
+            for key, count, expiry in results:
+                self._known[key] = (count, expiry.replace(tzinfo=datetime.timezone.utc).timestamp())
+            self.flushes += 1
+            self.flush_seconds_last = time.perf_counter() - start_time
+        return len(results)
+
+    def prune(self) -> int:
+        """Delete expired counters. Blocking; meant to be run by the scheduler."""
+        from linkpulse.database import connection_scope
+        from linkpulse.models import RateLimit
+
+        with connection_scope():
+            return RateLimit.delete().where(RateLimit.expiry <= utc_now()).execute()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "postgres",
+                "pending": len(self._pending),
+                "known": len(self._known),
+                "flushes": self.flushes,
+                "flush_failures": self.flush_failures,
+                "flush_seconds_last": self.flush_seconds_last,
+            }
+
+
+class GCRARateLimiter:
+    """
+    A rate limiting strategy using the Generic Cell Rate Algorithm, with the same interface as `limits`' strategies.
+
+    Each key is a single "theoretical arrival time" (TAT): hits push it forward by `period / amount`, and a hit is
+    rejected if that would put it more than `period` ahead of now. This allows the same bursts as a fixed window but
+    spreads the remaining hits out evenly, in constant memory per key.
+
+    At most `maxsize` keys are tracked; the least recently used is evicted beyond that, and keys whose TAT has passed
+    (i.e. that are back to a full allowance) are dropped as they're found. Evicting a live key only forgets its hits.
+    Keys are stored as their (64-bit) hash rather than the full string, to keep each entry small.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._tats: OrderedDict[int, float] = OrderedDict()
+
+        self.evictions = 0
+
+    def _prune(self, now: float) -> None:
+        # The least recently used keys are the most likely to have expired; checking a couple per call is enough
+        for _ in range(2):
+            if len(self._tats) == 0:
+                break
+            key, tat = next(iter(self._tats.items()))
+            if tat > now:
+                break
+            del self._tats[key]
+
+        while len(self._tats) > self.maxsize:
+            self._tats.popitem(last=False)
+            self.evictions += 1
+
+    def _next(self, item: RateLimitItem, key: int, now: float, cost: int) -> Tuple[float, bool]:
+        """Get the key's TAT after `cost` more hits, and whether they are allowed."""
+        period = item.get_expiry()
+        tat = max(self._tats.get(key, now), now) + period / item.amount * cost
+        return tat, tat - now <= period
+
+    async def hit(self, item: RateLimitItem, *identifiers: str, cost: int = 1) -> bool:
+        key, now = hash(item.key_for(*identifiers)), time.time()
+        tat, allowed = self._next(item, key, now, cost)
+        if allowed:
+            self._tats[key] = tat
+            self._tats.move_to_end(key)
+            self._prune(now)
+        return allowed
+
+    async def test(self, item: RateLimitItem, *identifiers: str, cost: int = 1) -> bool:
+        return self._next(item, hash(item.key_for(*identifiers)), time.time(), cost)[1]
+
+    async def get_window_stats(self, item: RateLimitItem, *identifiers: str) -> WindowStats:
+        now = time.time()
+        tat = max(self._tats.get(hash(item.key_for(*identifiers)), now), now)
+        interval = item.get_expiry() / item.amount
+        remaining = int((item.get_expiry() - (tat - now)) // interval)
+        return WindowStats(int(tat), max(0, min(item.amount, remaining)))
+
+    async def clear(self, item: RateLimitItem, *identifiers: str) -> None:
+        self._tats.pop(hash(item.key_for(*identifiers)), None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "strategy": "gcra",
+            "keys": len(self._tats),
+            "maxsize": self.maxsize,
+            "evictions": self.evictions,
+        }
+
+
+def _shared_memory_path() -> str:
+    # /dev/shm is memory-backed on Linux; elsewhere the file is still shared, just backed by disk
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "linkpulse-ratelimit")
+
+
+def create_storage(backend: str) -> Storage:
+    """
+    Create the rate limit storage for a backend name: 'memory' (per-process), 'shared' (per-host) or 'postgres'.
+    """
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "shared":
+        return SharedMemoryStorage(
+            path=os.getenv("RATE_LIMIT_SHARED_PATH", _shared_memory_path()),
+            slots=int(os.getenv("RATE_LIMIT_SHARED_SLOTS", "65536")),
+        )
+    if backend == "postgres":
+        return PostgresStorage(interval=float(os.getenv("RATE_LIMIT_FLUSH_INTERVAL", "1")))
+    raise ValueError(f"Unknown rate limit storage backend: {backend!r}")
+
+
+# Which storage `RateLimiter` uses by default; with several workers, limits must be counted across all of them
+_storage = os.getenv("RATE_LIMIT_STORAGE", "memory" if worker_count() == 1 else "shared").lower()
+if _storage == "memory" and worker_count() > 1:
+    raise ValueError(
+        "RATE_LIMIT_STORAGE=memory would enforce every limit separately in each of the WEB_CONCURRENCY workers;"
+        " use 'shared' or 'postgres'"
+    )
+storage = create_storage(_storage)
+
+# Which strategy `RateLimiter` uses by default: 'auto' (moving window where the storage supports it, otherwise fixed
+# window), 'moving-window', 'fixed-window' or 'gcra'.
+default_strategy = os.getenv("RATE_LIMIT_STRATEGY", "auto").lower()
+
+# Shared by every limiter using the 'gcra' strategy, so the cap applies to all of them together.
+gcra = GCRARateLimiter(maxsize=int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")))
@@ -1,20 +1,22 @@
-from datetime import datetime, timedelta
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timedelta, timezone
 from typing import Annotated, Optional, Tuple
 
 import structlog
-from fastapi import APIRouter, Depends, Response, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from linkpulse.database import run_query
 from linkpulse.dependencies import RateLimiter, SessionDependency
+from linkpulse.hashing import HashingPoolFull, hashing_pool
 from linkpulse.models import Session, User
-from linkpulse.utilities import utc_now, is_development
-from pwdlib import PasswordHash
-from pwdlib.hashers.argon2 import Argon2Hasher
+from linkpulse.sessions import get_session, get_session_user, last_used_buffer, session_cache
+from linkpulse.tokens import issue_signed, revoke_session, revoke_user_sessions, signer
+from linkpulse.utilities import get_client_key, utc_now, is_development
 from pydantic import BaseModel, EmailStr, Field
 
 logger = structlog.get_logger()
 
 router = APIRouter()
 
-hasher = PasswordHash([Argon2Hasher()])
 # cspell: disable
 dummy_hash = (
     "$argon2id$v=19$m=65536,t=3,p=4$Ii3hm5/NqcJddQDFK24Wtw$I99xV/qkaLROo0VZcvaZrYMAD9RTcWzxY5/RbMoRLQ4"
@@ -25,6 +27,15 @@ default_session_expiry = timedelta(hours=12)
 remember_me_session_expiry = timedelta(days=14)
 
 
+def set_session_cookie(
+    response: Response, token: str, user_id: int, expiry: datetime, duration: timedelta
+) -> None:
+    """Set the session cookie, signing the token if signed tokens are issued."""
+    cookie = signer.sign(token, user_id, expiry) if issue_signed and signer is not None else token
+    max_age = int(duration.total_seconds())
+    response.set_cookie("session", cookie, max_age=max_age, secure=not is_development, httponly=True)
+
+
 def validate_session(token: str, user: bool = True) -> Tuple[bool, bool, Optional[User]]:
     """Given a token, validate that the session exists and is not expired.
 
@@ -43,7 +54,7 @@ def validate_session(token: str, user: bool = True) -> Tuple[bool, bool, Optiona
     :rtype: Tuple[bool, bool, Optional[User]]
     """
     # Check if session exists
-    session = Session.get_or_none(Session.token == token)
+    session = get_session(token)
     if session is None:
         return False, False, None
 
@@ -53,7 +64,7 @@ def validate_session(token: str, user: bool = True) -> Tuple[bool, bool, Optiona
 
     if user:
         session.use()
-    return True, True, session.user
+    return True, True, session.user  # type: ignore[return-value]
 
 
 class LoginBody(BaseModel):
@@ -76,18 +87,27 @@ class LoginSuccess(BaseModel):
     responses={200: {"model": LoginSuccess}, 401: {"model": LoginError}},
     dependencies=[Depends(RateLimiter("6/minute"))],
 )
-async def login(body: LoginBody, response: Response):
+async def login(body: LoginBody, request: Request, response: Response):
     # Acquire user by email
-    user = User.get_or_none(User.email == body.email)
-
-    if user is None:
-        # Hash regardless of user existence to prevent timing attacks
-        hasher.verify(body.password, dummy_hash)
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return LoginError(error="Invalid email or password")
-
-    logger.warning("Hash", hash=user.password_hash)
-    valid, updated_hash = hasher.verify_and_update(body.password, user.password_hash)
+    user = await run_query(User.get_or_none, User.email == body.email)
+
+    # Hashing is queued fairly per client (keyed like `RateLimiter`), so one client can't starve the rest
+    client = get_client_key(request) or "unknown"
+
+    try:
+        if user is None:
+            # Hash regardless of user existence to prevent timing attacks
+            await hashing_pool.verify(client, body.password, dummy_hash)
+            response.status_code = status.HTTP_401_UNAUTHORIZED
+            return LoginError(error="Invalid email or password")
+
+        valid, updated_hash = await hashing_pool.verify_and_update(client, body.password, user.password_hash)
+    except HashingPoolFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service Unavailable",
+            headers={"Retry-After": "1"},
+        )
 
     # Check if password matches, return 401 if not
     if not valid:
@@ -97,20 +117,19 @@ async def login(body: LoginBody, response: Response):
     # Update password hash if necessary
     if updated_hash:
         user.password_hash = updated_hash
-        user.save()
+        await run_query(user.save)
 
     # Create session
     token = Session.generate_token()
     session_duration = remember_me_session_expiry if body.remember_me else default_session_expiry
-    session = Session.create(
+    session = await run_query(
+        Session.create,
         token=token,
         user=user,
         expiry=utc_now() + session_duration,
     )
 
-    # Set Cookie of session token
-    max_age = int(session_duration.total_seconds())
-    response.set_cookie("session", token, max_age=max_age, secure=not is_development, httponly=True)
+    set_session_cookie(response, token, user.id, session.expiry, session_duration)
     return {"email": user.email, "expiry": session.expiry}
 
 
@@ -122,40 +141,123 @@ async def logout(
 ):
     # We can assume the session is valid via the dependency
     if not all:
-        session.delete_instance()
-        logger.debug("Session deleted", user=session.user.email, token=session.token)
+        await run_query(revoke_session, session)
+        session_cache.invalidate(session.token)  # type: ignore[arg-type]
+        logger.debug("Session deleted", user_id=session.user_id, token=session.token)
     else:
-        count = Session.delete().where(Session.user == session.user).execute()
-        logger.debug("All sessions deleted", user=session.user.email, count=count, source_token=session.token)
+        count = await run_query(revoke_user_sessions, session.user_id)
+        session_cache.invalidate_user(session.user_id)
+        logger.debug("All sessions deleted", user_id=session.user_id, count=count, source_token=session.token)
 
     response.delete_cookie("session")
 
 
-@router.post("/api/register")
-async def register():
-    # Validate parameters
-    # Hash password
-    # Create User
-    # Create Session
-    # Set Cookie of session token
-    # Return 200 with mild user information
-    pass
+class RegisterBody(BaseModel):
+    email: EmailStr = Field(max_length=45)
+    # Long passwords are allowed, but not unbounded ones; hashing cost grows with the input
+    password: str = Field(min_length=8, max_length=128)
+    remember_me: bool = False
+
+
+class RegisterError(BaseModel):
+    error: str
+
+
+class RegisterSuccess(BaseModel):
+    email: EmailStr
+    expiry: datetime
+
+
+@router.post(
+    "/api/register",
+    responses={200: {"model": RegisterSuccess}, 409: {"model": RegisterError}},
+    dependencies=[Depends(RateLimiter("6/minute"))],
+)
+async def register(body: RegisterBody, request: Request, response: Response):
+    # Hash first, off the event loop; the database is then touched exactly once
+    try:
+        password_hash = await hashing_pool.hash(get_client_key(request) or "unknown", body.password)
+    except HashingPoolFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service Unavailable",
+            headers={"Retry-After": "1"},
+        )
+
+    # Create user & session together
+    token = Session.generate_token()
+    session_duration = remember_me_session_expiry if body.remember_me else default_session_expiry
+    expiry = utc_now() + session_duration
+    user_id = await run_query(User.register, body.email, password_hash, token, expiry)
+
+    if user_id is None:
+        response.status_code = status.HTTP_409_CONFLICT
+        return RegisterError(error="Email already registered")
+
+    set_session_cookie(response, token, user_id, expiry, session_duration)
+    return {"email": body.email, "expiry": expiry}
 
 
 @router.get("/api/session")
 async def session(session: Annotated[Session, Depends(SessionDependency(required=True))]):
     # Returns the session information for the current session
+    user = await get_session_user(session)
     return {
         "user": {
-            "email": session.user.email,
+            "email": user.email,
         }
     }
 
 
+def encode_cursor(expiry: datetime, digest: str) -> str:
+    """Encode the position of the last session on a page into an opaque cursor."""
+    return urlsafe_b64encode(f"{expiry.isoformat()}|{digest}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decode a cursor created by `encode_cursor`, raising 400 if it is malformed."""
+    try:
+        expiry, digest = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(expiry), digest
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def as_utc(dt: Optional[datetime]) -> Optional[datetime]:
+    """Timestamps are stored without a timezone, but are always UTC."""
+    if dt is None or dt.tzinfo is not None:
+        return dt
+    return dt.replace(tzinfo=timezone.utc)
+
+
 @router.get("/api/sessions")
-async def sessions(session: Annotated[Session, Depends(SessionDependency(required=True))]):
-    # Returns a list of all active sessions for this user
-    return {}
+async def sessions(
+    session: Annotated[Session, Depends(SessionDependency(required=True))],
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+    cursor: Optional[str] = None,
+):
+    # Returns a page of all active sessions for this user, pass `next` back as `cursor` for the following page
+    after = decode_cursor(cursor) if cursor is not None else None
+
+    # One extra row tells us whether there's another page
+    page = await run_query(Session.page_active, session.user_id, limit + 1, after)
+    has_more = len(page) > limit
+    page = page[:limit]
+
+    return {
+        "sessions": [
+            {
+                "id": other.digest,
+                "current": other.token == session.token,
+                "created_at": as_utc(other.created_at),  # type: ignore[arg-type]
+                # The buffered value is fresher than what's in the database, if present
+                "last_used": as_utc(last_used_buffer.pending(other.token) or other.last_used),  # type: ignore[arg-type]
+                "expiry": as_utc(other.expiry),  # type: ignore[arg-type]
+            }
+            for other in page
+        ],
+        "next": encode_cursor(page[-1].expiry, page[-1].digest) if has_more else None,  # type: ignore[arg-type]
+    }
 
 
 # GET /api/user/{id}/sessions
@@ -1,12 +1,20 @@
 """Miscellaneous endpoints for the Linkpulse API."""
 
+import asyncio
+import hmac
+import os
+import time
 from pathlib import Path
-from typing import Any
+from typing import Annotated, Any, Optional
 
 import structlog
 import toml
-from fastapi import APIRouter
+from fastapi import APIRouter, Header, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
 from fastapi_cache.decorator import cache
+from linkpulse.database import run_query
+from linkpulse.metrics import registry
+from linkpulse.profiler import profiler
 from linkpulse.utilities import get_db
 
 logger = structlog.get_logger(__name__)
@@ -15,6 +23,9 @@ router = APIRouter()
 
 db = get_db()
 
+# If set, `/metrics` requires `Authorization: Bearer <token>`.
+metrics_token = os.getenv("METRICS_TOKEN") or None
+
 
 @router.get("/api/version")
 @cache(expire=None)
@@ -53,7 +64,71 @@ async def get_migration() -> dict[str, Any]:
     :return: The last migration name and timestamp.
     :rtype: dict[str, Any]
     """
-    # Kind of insecure, but this is just a demo thing to show that migratehistory is available.
-    cursor = db.execute_sql("SELECT name, migrated_at FROM migratehistory ORDER BY migrated_at DESC LIMIT 1")
-    name, migrated_at = cursor.fetchone()
+
+    def last_migration():
+        # Kind of insecure, but this is just a demo thing to show that migratehistory is available.
+        cursor = db.execute_sql(
+            "SELECT name, migrated_at FROM migratehistory ORDER BY migrated_at DESC LIMIT 1"
+        )
+        return cursor.fetchone()
+
+    name, migrated_at = await run_query(last_migration)
     return {"name": name, "migrated_at": migrated_at}
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(authorization: Annotated[Optional[str], Header()] = None) -> PlainTextResponse:
+    """Get this process's metrics, in the Prometheus text format.
+    :return: The metrics.
+    :rtype: PlainTextResponse"""
+    if metrics_token is not None and not hmac.compare_digest(authorization or "", f"Bearer {metrics_token}"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+def require_profiler(authorization: Optional[str]) -> None:
+    """Profiling endpoints don't exist unless profiling is configured, and require its token."""
+    if profiler.token is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+    token = authorization[len("Bearer ") :] if authorization and authorization.startswith("Bearer ") else None
+    if not profiler.authorized(token):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+
+
+@router.post("/api/profile", response_class=PlainTextResponse)
+async def profile(
+    seconds: Annotated[float, Query(gt=0, le=60)] = 10,
+    authorization: Annotated[Optional[str], Header()] = None,
+) -> PlainTextResponse:
+    """Profile the whole process for a number of seconds.
+    :return: The samples, as collapsed stacks.
+    :rtype: PlainTextResponse"""
+    require_profiler(authorization)
+
+    sampler = profiler.start()
+    if sampler is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A profile is already running")
+
+    profile_id = f"window-{int(time.time())}"
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        collapsed = profiler.stop(sampler, profile_id)
+    return PlainTextResponse(collapsed, headers={"X-Profile-Id": profile_id})
+
+
+@router.get("/api/profile/{profile_id}", response_class=PlainTextResponse)
+async def get_profile(
+    profile_id: str, authorization: Annotated[Optional[str], Header()] = None
+) -> PlainTextResponse:
+    """Get a recent profile, e.g. of a request sent with `X-Profile` (see its `X-Profile-Id` response header).
+    :return: The samples, as collapsed stacks.
+    :rtype: PlainTextResponse"""
+    require_profiler(authorization)
+
+    collapsed = profiler.get(profile_id)
+    if collapsed is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return PlainTextResponse(collapsed)
@@ -0,0 +1,352 @@
+"""serve.py
+This module runs the application server for `python -m linkpulse serve`.
+
+In development, a single Uvicorn process is run with auto-reload. Otherwise, a `Supervisor` forks several Uvicorn
+worker processes, each listening on its own socket bound with `SO_REUSEPORT` so the kernel balances connections between
+them, and keeps them healthy: workers whose event loop stops responding, or whose memory grows past a ceiling, are
+replaced.
+"""
+
+import logging
+import mmap
+import os
+import signal
+import socket
+import struct
+import time
+from typing import Any, Dict, Optional, Union
+
+import structlog
+from linkpulse.utilities import cpu_count, is_development
+
+logger = structlog.get_logger()
+
+APP = "linkpulse.app:app"
+
+host = os.getenv("HOST", "0.0.0.0" if is_development else "::")
+port = int(os.getenv("PORT", "8000"))
+
+# Defaults to one worker per available CPU, up to 8
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(cpu_count(), 8))))
+# Import the app once in the supervisor, so workers share its (copy-on-write) memory and start faster
+preload = os.getenv("PRELOAD_APP", "false").lower() == "true"
+# Seconds between starting each worker, so they don't all import & connect at once
+worker_stagger = float(os.getenv("WORKER_STAGGER", "0.5"))
+# Seconds a worker may go without a heartbeat from its event loop (including while starting up) before it is killed
+worker_timeout = float(os.getenv("WORKER_TIMEOUT", "60"))
+# Workers using more private memory than this are gracefully restarted; 0 disables the check
+worker_max_memory_mb = int(os.getenv("WORKER_MAX_MEMORY_MB", "0"))
+# Seconds between checks of the workers' memory, which reads each one's /proc/<pid>/smaps_rollup
+worker_memory_interval = float(os.getenv("WORKER_MEMORY_CHECK_INTERVAL", "5"))
+# Seconds a stopping worker may take to finish in-flight requests before it is killed
+graceful_timeout = float(os.getenv("WORKER_GRACEFUL_TIMEOUT", "30"))
+
+# The event loop implementation: 'auto' (uvloop if installed), 'asyncio' or 'uvloop'
+server_loop = os.getenv("SERVER_LOOP", "auto")
+# The HTTP/1.1 parser: 'auto' (httptools if installed), 'h11' or 'httptools'
+server_http = os.getenv("SERVER_HTTP", "auto")
+# Seconds an idle keep-alive connection is held open; should exceed the idle timeout of any proxy in front
+server_keep_alive = int(os.getenv("SERVER_KEEP_ALIVE", "5"))
+# Connections the kernel may queue for each worker before refusing more
+server_backlog = int(os.getenv("SERVER_BACKLOG", "2048"))
+# Concurrent connections & tasks per worker before new requests are answered with a 503; 0 means no limit
+server_max_concurrency = int(os.getenv("SERVER_MAX_CONCURRENCY", "0"))
+
+
+def uvicorn_options() -> Dict[str, Any]:
+    """Options shared by every way of running Uvicorn."""
+    return {
+        "loop": server_loop,
+        "http": server_http,
+        "timeout_keep_alive": server_keep_alive,
+        "backlog": server_backlog,
+        "limit_concurrency": server_max_concurrency or None,
+        "log_config": {
+            "version": 1,
+            "disable_existing_loggers": False,
+            "loggers": {
+                "uvicorn": {"propagate": True},
+                "uvicorn.access": {"propagate": True},
+            },
+        },
+    }
+
+
+def bind_socket(host: str, port: int, reuse_port: bool) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    # The protocol must be explicit: asyncio only disables Nagle's algorithm on accepted sockets whose protocol is TCP,
+    # and small responses would otherwise wait on delayed ACKs (~40ms each)
+    sock = socket.socket(family, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    if family == socket.AF_INET6:
+        # Accept IPv4 connections too, as Uvicorn does for '::'
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+    sock.bind((host, port))
+    return sock
+
+
+def private_memory(pid: int) -> Optional[int]:
+    """
+    The bytes of memory used by the process alone, excluding pages shared with other processes (e.g. preloaded
+    modules), or None if unknown. Only supported on Linux.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as file:
+            total = 0
+            for line in file:
+                if line.startswith(("Private_Clean:", "Private_Dirty:")):
+                    total += int(line.split()[1]) * 1024
+            return total
+    except (OSError, ValueError):
+        return None
+
+
+def _exit_on_signal(signum: int, _: Any) -> None:
+    raise SystemExit(0)
+
+
+class Heartbeats:
+    """
+    A table of heartbeat times, one slot per worker, in memory shared with the forked workers.
+    Times are from `time.monotonic`, which is system-wide on Linux.
+    """
+
+    _SLOT = struct.Struct("<d")
+
+    def __init__(self, slots: int):
+        self._map = mmap.mmap(-1, self._SLOT.size * slots)
+
+    def beat(self, slot: int) -> None:
+        self._SLOT.pack_into(self._map, slot * self._SLOT.size, time.monotonic())
+
+    def last(self, slot: int) -> float:
+        return self._SLOT.unpack_from(self._map, slot * self._SLOT.size)[0]
+
+    def reset(self, slot: int) -> None:
+        self._SLOT.pack_into(self._map, slot * self._SLOT.size, 0.0)
+
+
+class Worker:
+    def __init__(self, pid: int, slot: int):
+        self.pid = pid
+        self.slot = slot
+        self.started = time.monotonic()
+        # Once asked to stop, when the worker will be killed if it hasn't exited
+        self.kill_at: Optional[float] = None
+
+
+class Supervisor:
+    """
+    Starts `workers` Uvicorn worker processes, restarts them as they exit, and stops them on SIGTERM/SIGINT.
+
+    Each worker's event loop beats a heartbeat every second (via Uvicorn's `callback_notify`). A worker that misses
+    them for `timeout` seconds is blocked or deadlocked, so it is killed outright; one using more than `max_memory`
+    bytes of private memory is asked to stop gracefully instead. Workers that exit are replaced, backing off while
+    they keep failing before their first heartbeat.
+    """
+
+    def __init__(
+        self,
+        app: str = APP,
+        host: str = host,
+        port: int = port,
+        workers: int = workers,
+        preload: bool = preload,
+        stagger: float = worker_stagger,
+        timeout: float = worker_timeout,
+        max_memory: Optional[int] = worker_max_memory_mb * 1024 * 1024 or None,
+        memory_interval: float = worker_memory_interval,
+        graceful_timeout: float = graceful_timeout,
+    ):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        self.preload = preload
+        self.stagger = stagger
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.memory_interval = memory_interval
+        self._memory_checked_at = 0.0
+        self.graceful_timeout = graceful_timeout
+
+        # Without SO_REUSEPORT, workers accept from a single socket bound here instead
+        self.reuse_port = hasattr(socket, "SO_REUSEPORT")
+        self._socket: Optional[socket.socket] = None
+
+        self.heartbeats = Heartbeats(self.workers)
+        self.running: Dict[int, Worker] = {}
+        # Slots waiting for a worker, with the time it may be started at
+        self.pending: Dict[int, float] = {}
+        self._failures: Dict[int, int] = {}
+        self._stopping = False
+
+    def run(self) -> None:
+        # Per-process resources (pools, rate limit storage) are sized by it; see `linkpulse.utilities.worker_count`
+        os.environ["WEB_CONCURRENCY"] = str(self.workers)
+
+        app: Union[str, Any] = self.app
+        if self.preload:
+            from uvicorn.importer import import_from_string
+
+            app = import_from_string(self.app)
+        # The log writer thread could be holding its queue's lock when a worker is forked, leaving it locked in the
+        # worker; the supervisor logs little, so it writes synchronously instead
+        from linkpulse.logging import setup_logging
+
+        setup_logging(queue_size=0)
+
+        if not self.reuse_port:
+            self._socket = bind_socket(self.host, self.port, reuse_port=False)
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        logger.info(
+            "Starting workers", workers=self.workers, preload=self.preload, reuse_port=self.reuse_port
+        )
+
+        now = time.monotonic()
+        self.pending = {slot: now + slot * self.stagger for slot in range(self.workers)}
+        while not self._stopping:
+            self.reap()
+            self.check()
+            now = time.monotonic()
+            for slot, start_at in sorted(self.pending.items()):
+                if start_at <= now:
+                    del self.pending[slot]
+                    self.spawn(slot, app)
+            time.sleep(0.1)
+
+        self.shutdown()
+
+    def _handle_stop(self, signum: int, _: Any) -> None:
+        self._stopping = True
+
+    def spawn(self, slot: int, app: Union[str, Any]) -> None:
+        self.heartbeats.reset(slot)
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                self._run_worker(slot, app)
+                code = 0
+            except SystemExit:
+                # Stopped by SIGTERM (see `_run_worker`)
+                code = 0
+            except BaseException:
+                logger.exception("Worker failed", slot=slot)
+            finally:
+                # Drains the log queue before exiting
+                logging.shutdown()
+                os._exit(code)
+
+        self.running[pid] = Worker(pid, slot)
+        logger.info("Started worker", pid=pid, slot=slot)
+
+    def _run_worker(self, slot: int, app: Union[str, Any]) -> None:
+        # The supervisor stops workers itself, so an interactive Ctrl+C isn't handled twice
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        # Uvicorn handles SIGTERM while serving, then re-raises it once shut down; this then exits cleanly, after
+        # flushing logs, rather than dying to the signal
+        signal.signal(signal.SIGTERM, _exit_on_signal)
+
+        # The log writer thread doesn't survive the fork
+        from linkpulse.logging import setup_logging
+
+        setup_logging()
+
+        from uvicorn import Config, Server
+
+        async def notify() -> None:
+            self.heartbeats.beat(slot)
+
+        sock = self._socket or bind_socket(self.host, self.port, reuse_port=True)
+        config = Config(app, callback_notify=notify, timeout_notify=1, **uvicorn_options())
+        self.heartbeats.beat(slot)
+        Server(config).run(sockets=[sock])
+
+    def reap(self) -> None:
+        """Collect exited workers, scheduling their replacements."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            worker = self.running.pop(pid, None)
+            if worker is None:
+                continue
+
+            beat = self.heartbeats.last(worker.slot) > worker.started
+            failures = 0 if beat else self._failures.get(worker.slot, 0) + 1
+            self._failures[worker.slot] = failures
+            delay = min(2**failures, 30) if failures > 0 else self.stagger
+
+            log = logger.info if worker.kill_at is not None or self._stopping else logger.warning
+            log("Worker exited", pid=pid, slot=worker.slot, code=os.waitstatus_to_exitcode(status))
+            if not self._stopping:
+                self.pending[worker.slot] = time.monotonic() + delay
+
+    def check(self) -> None:
+        """Kill hung workers, ask workers over the memory limit to stop, and kill workers that won't stop."""
+        now = time.monotonic()
+        # Reading each worker's memory usage isn't free, so it's checked less often
+        max_memory = None
+        if self.max_memory is not None and now - self._memory_checked_at >= self.memory_interval:
+            max_memory = self.max_memory
+            self._memory_checked_at = now
+        for worker in list(self.running.values()):
+            if worker.kill_at is not None:
+                if now >= worker.kill_at:
+                    self._kill(worker, signal.SIGKILL)
+                continue
+
+            last_beat = max(worker.started, self.heartbeats.last(worker.slot))
+            if now - last_beat > self.timeout:
+                logger.warning("Worker unresponsive, killing it", pid=worker.pid, slot=worker.slot)
+                self._kill(worker, signal.SIGKILL)
+                worker.kill_at = now
+                continue
+
+            if max_memory is not None:
+                memory = private_memory(worker.pid)
+                if memory is not None and memory > max_memory:
+                    logger.warning("Worker over memory limit, restarting it", pid=worker.pid, memory=memory)
+                    self.retire(worker)
+
+    def retire(self, worker: Worker) -> None:
+        """Ask a worker to stop once its in-flight requests are done."""
+        self._kill(worker, signal.SIGTERM)
+        worker.kill_at = time.monotonic() + self.graceful_timeout
+
+    def _kill(self, worker: Worker, signum: int) -> None:
+        try:
+            os.kill(worker.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def shutdown(self) -> None:
+        logger.info("Stopping workers", workers=len(self.running))
+        for worker in self.running.values():
+            self.retire(worker)
+        while len(self.running) > 0:
+            self.reap()
+            self.check()
+            time.sleep(0.1)
+
+
+def serve() -> None:
+    if is_development:
+        from uvicorn import run
+
+        # Auto-reload restarts a single process; it doesn't mix with multiple workers
+        os.environ["WEB_CONCURRENCY"] = "1"
+        logger.debug("Invoking uvicorn.run")
+        run(APP, reload=True, host=host, port=port, **uvicorn_options())
+        return
+
+    Supervisor().run()
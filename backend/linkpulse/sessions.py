@@ -0,0 +1,689 @@
+"""sessions.py
+This module provides in-memory helpers that sit in front of the `Session` model, keeping the hot
+authentication path from writing to the database on every single request.
+"""
+
+import asyncio
+import datetime
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+
+import structlog
+from linkpulse.notify import InvalidationListener
+from linkpulse.utilities import utc_now, worker_count
+
+if TYPE_CHECKING:
+    from linkpulse.models import Session, User
+
+logger = structlog.get_logger()
+
+
+class LastUsedBuffer:
+    """
+    A write-behind buffer for `Session.last_used` timestamps.
+
+    Instead of issuing an UPDATE every time a session is used, timestamps are collected in memory (one entry per token,
+    keeping only the newest) and written in a single batched `UPDATE ... FROM (VALUES ...)` statement by `flush()`.
+    `flush()` is expected to be invoked periodically (every `interval` seconds) by the application's scheduler, which
+    bounds how stale `last_used` can be in the database.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._pending: Dict[str, datetime.datetime] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def record(self, token: str, when: datetime.datetime) -> None:
+        """
+        Record that the session identified by `token` was used at `when`.
+        """
+        with self._lock:
+            current = self._pending.get(token)
+            if current is None or current < when:
+                self._pending[token] = when
+
+    def pending(self, token: str) -> Optional[datetime.datetime]:
+        """
+        Get the buffered (not yet flushed) `last_used` timestamp for a token, if any.
+        """
+        return self._pending.get(token)
+
+    def flush(self) -> int:
+        """
+        Write all buffered timestamps to the database in a single statement.
+        Sessions that were deleted in the meantime are silently skipped.
+
+        :return: The number of rows updated.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if len(pending) == 0:
+            return 0
+
+        from linkpulse.database import connection_scope
+        from linkpulse.models import Session
+        from peewee import ValuesList
+
+        start_time = time.perf_counter()
+        values = ValuesList(list(pending.items()), columns=("token", "last_used"), alias="buffered")
+        try:
+            # Runs on the scheduler's thread, so the connection must be handed back to the pool afterwards
+            with connection_scope():
+                updated = (
+                    Session.update(last_used=values.c.last_used)
+                    .from_(values)
+                    .where(
+                        (Session.token == values.c.token)
+                        & (Session.last_used.is_null() | (Session.last_used < values.c.last_used))
+                    )
+                    .execute()
+                )
+        except Exception:
+            # Put the timestamps back so they're retried on the next flush, unless they were superseded.
+            with self._lock:
+                for token, when in pending.items():
+                    current = self._pending.get(token)
+                    if current is None or current < when:
+                        self._pending[token] = when
+            raise
+
+        logger.debug(
+            "Flushed session last_used buffer",
+            buffered=len(pending),
+            updated=updated,
+            duration_ms="{:.2f}".format((time.perf_counter() - start_time) * 1000),
+        )
+        return updated
+
+
+class SessionCache:
+    """
+    A bounded, thread-safe LRU cache of validated sessions, keyed by token.
+
+    Each cached session carries a slim projection of its user (id, email & flags only), so handlers can read
+    `session.user` without another query. Entries are dropped after `ttl` seconds, and never outlive the session's
+    own expiry. Entries must be invalidated explicitly when a session is deleted (see `invalidate` & `invalidate_user`);
+    other processes are told through `session_listener`, and drop the user's sessions (see `discard`).
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = datetime.timedelta(seconds=ttl)
+        self._entries: OrderedDict[str, Tuple["Session", datetime.datetime]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, token: str, now: Optional[datetime.datetime] = None) -> Optional["Session"]:
+        """
+        Get a cached session by token, or None if it isn't cached (or its entry has lapsed).
+        """
+        if now is None:
+            now = utc_now()
+
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            session, deadline = entry
+            if deadline <= now:
+                del self._entries[token]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return session
+
+    def put(self, session: "Session", now: Optional[datetime.datetime] = None) -> None:
+        """
+        Cache a validated session. The session's `user` should already be loaded.
+        """
+        if self.maxsize <= 0:
+            return
+
+        if now is None:
+            now = utc_now()
+
+        deadline = min(now + self.ttl, session.expiry_utc)
+        if deadline <= now:
+            return
+
+        with self._lock:
+            self._entries[session.token] = (session, deadline)  # type: ignore[index]
+            self._entries.move_to_end(session.token)  # type: ignore[arg-type]
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, token: str) -> None:
+        """
+        Drop a single session from the cache.
+        """
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def invalidate_user(self, user_id: int) -> None:
+        """
+        Drop all of a user's sessions from the cache.
+        """
+        with self._lock:
+            for token in [
+                token for token, (session, _) in self._entries.items() if session.user_id == user_id
+            ]:
+                del self._entries[token]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def discard(self, namespace: Optional[str] = None, key: Optional[str] = None) -> None:
+        """
+        Apply an invalidation broadcast by another process: drop a user's sessions (`namespace` 'user', `key` the
+        user's id), or else every session. Tokens are never broadcast, so a single revoked session drops them all.
+        """
+        if namespace == "user" and key is not None:
+            self.invalidate_user(int(key))
+        else:
+            self.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the cache's counters, useful for sizing `maxsize` and `ttl`.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups > 0 else 0.0,
+        }
+
+
+class InvalidTokenCache:
+    """
+    A short-lived, bounded set of tokens recently found not to belong to any session.
+
+    Repeated requests with the same bogus token are then rejected without a database lookup.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, token: str) -> bool:
+        with self._lock:
+            deadline = self._entries.get(token)
+            if deadline is None:
+                return False
+            if deadline <= time.monotonic():
+                del self._entries[token]
+                return False
+            self.hits += 1
+            return True
+
+    def add(self, token: str) -> None:
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._entries[token] = time.monotonic() + self.ttl
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, token: str) -> None:
+        with self._lock:
+            self._entries.pop(token, None)
+
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter over strings, sized for `capacity` items at the target false-positive rate.
+    """
+
+    def __init__(self, capacity: int, fp_rate: float):
+        self.capacity = max(capacity, 1)
+        self.size = max(math.ceil(-self.capacity * math.log(fp_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / self.capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str) -> Iterator[int]:
+        # Double hashing; two 64-bit halves of a single digest stand in for `hashes` independent functions
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def estimated_fp_rate(self) -> float:
+        """The expected false-positive rate given the number of items added so far."""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+class LiveTokenFilter:
+    """
+    A Bloom filter of the tokens of all unexpired sessions, used to reject made-up tokens without looking each one up
+    in the database.
+
+    The filter is rebuilt from the database periodically (`rebuild`), dropping expired & deleted sessions, and kept
+    current between rebuilds in two ways: sessions created by this process are added as they're saved, and sessions
+    created by other processes (workers or replicas) are picked up by `sync` every few seconds. Until the first
+    rebuild completes, every token is let through to the database.
+
+    A token missing from the filter may still be too new to be in it (e.g. from a login on another worker a moment
+    ago), so a miss alone proves nothing; see `confirm_missing`.
+    """
+
+    def __init__(self, fp_rate: float, sync_margin: float = 5.0, miss_sync_interval: float = 0.05):
+        self.fp_rate = fp_rate
+        self.sync_margin = datetime.timedelta(seconds=sync_margin)
+        self.miss_sync_interval = miss_sync_interval
+
+        self._filter: Optional[BloomFilter] = None
+        self._lock = threading.Lock()
+        self._rebuilding: Optional[List[str]] = None
+        self._synced_at: Optional[datetime.datetime] = None
+        # Serializes syncs; `time.monotonic` when the last one started
+        self._sync_lock = threading.Lock()
+        self._sync_started = 0.0
+        # The next sync for misses, shared by every miss awaiting it (see `confirm_missing`)
+        self._miss_sync: Optional["asyncio.Future[None]"] = None
+
+        self.rejected = 0
+        self.late = 0
+        self.miss_syncs = 0
+        self.passed = 0
+        self.false_positives = 0
+        self.rebuilds = 0
+        self.rebuild_seconds_last = 0.0
+        self.rebuild_tokens_last = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._filter is not None
+
+    def add(self, token: str) -> None:
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(token)
+            # Tokens created mid-rebuild could be missing from the new filter, so they're replayed into it
+            if self._rebuilding is not None:
+                self._rebuilding.append(token)
+
+    def might_exist(self, token: str) -> bool:
+        """
+        False only if the token doesn't belong to an unexpired session as of the last sync; it may have been created
+        since (see `confirm_missing`).
+        """
+        bloom = self._filter
+        if bloom is None:
+            return True
+
+        if token in bloom:
+            self.passed += 1
+            return True
+        return False
+
+    async def confirm_missing(self, token: str) -> bool:
+        """
+        Check a token that missed the filter against the sessions created since the last sync, by awaiting a sync that
+        starts after the miss.
+
+        Misses share that sync, and syncs for misses are at least `miss_sync_interval` seconds apart, so a flood of
+        made-up tokens costs one query per interval. Waiting happens on the event loop; only the sync itself takes a
+        database thread.
+
+        :return: True if the token definitely doesn't belong to an unexpired session.
+        """
+        loop = asyncio.get_running_loop()
+        if self._miss_sync is None or self._miss_sync.get_loop() is not loop:
+            self._miss_sync = loop.create_task(self._sync_for_misses())
+
+        try:
+            await asyncio.shield(self._miss_sync)
+        except Exception:
+            # Without a sync, the miss proves nothing; the lookup decides
+            return False
+
+        if self.might_exist(token):
+            self.late += 1
+            return False
+        self.rejected += 1
+        return True
+
+    async def _sync_for_misses(self) -> None:
+        from linkpulse.database import run_query
+
+        try:
+            await asyncio.sleep(max(0.0, self._sync_started + self.miss_sync_interval - time.monotonic()))
+        finally:
+            # Misses from here on need a sync that starts after them
+            self._miss_sync = None
+        self._sync_started = time.monotonic()
+        await run_query(self.sync)
+        self.miss_syncs += 1
+
+    def record_false_positive(self) -> None:
+        """Called when a token passed the filter, but no session was found for it."""
+        if self._filter is not None:
+            self.false_positives += 1
+
+    def rebuild(self) -> None:
+        """Replace the filter with a freshly sized one containing every unexpired session's token."""
+        from linkpulse.database import connection_scope
+        from linkpulse.models import Session
+
+        start_time = time.perf_counter()
+        with self._lock:
+            self._rebuilding = []
+
+        try:
+            now = utc_now()
+            with connection_scope():
+                live = Session.select(Session.token).where(Session.expiry > now)
+                # Leave room for sessions created before the next rebuild
+                bloom = BloomFilter(capacity=max(live.count() * 2, 1024), fp_rate=self.fp_rate)
+                for (token,) in live.tuples().iterator():
+                    bloom.add(token)
+
+            with self._lock:
+                for token in self._rebuilding:
+                    bloom.add(token)
+                self._filter = bloom
+                self._synced_at = now
+        finally:
+            with self._lock:
+                self._rebuilding = None
+
+        self.rebuilds += 1
+        self.rebuild_seconds_last = time.perf_counter() - start_time
+        self.rebuild_tokens_last = bloom.count
+        logger.info(
+            "Rebuilt session token filter",
+            tokens=bloom.count,
+            size_bytes=len(bloom.bits),
+            duration_ms="{:.2f}".format(self.rebuild_seconds_last * 1000),
+        )
+
+    def sync(self) -> int:
+        """Add sessions created (by any process) since the last sync or rebuild."""
+        with self._sync_lock:
+            return self._sync()
+
+    def _sync(self) -> int:
+        self._sync_started = time.monotonic()
+        if self._synced_at is None:
+            return 0
+
+        from linkpulse.database import connection_scope
+        from linkpulse.models import Session
+
+        now = utc_now()
+        # The margin covers clock skew & transactions that were still in flight during the previous sync
+        since = self._synced_at - self.sync_margin
+        with connection_scope():
+            tokens = [
+                token
+                for (token,) in Session.select(Session.token).where(Session.created_at >= since).tuples()
+            ]
+
+        for token in tokens:
+            self.add(token)
+            invalid_tokens.discard(token)
+        self._synced_at = now
+        return len(tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the filter's counters. `observed_fp_rate` is the share of tokens let through that turned out not to exist.
+        """
+        bloom = self._filter
+        return {
+            "ready": bloom is not None,
+            "tokens": bloom.count if bloom is not None else 0,
+            "size_bytes": len(bloom.bits) if bloom is not None else 0,
+            "rejected": self.rejected,
+            "passed": self.passed,
+            "late": self.late,
+            "miss_syncs": self.miss_syncs,
+            "false_positives": self.false_positives,
+            "observed_fp_rate": self.false_positives / self.passed if self.passed > 0 else 0.0,
+            "estimated_fp_rate": bloom.estimated_fp_rate() if bloom is not None else 0.0,
+            "rebuilds": self.rebuilds,
+            "rebuild_seconds_last": self.rebuild_seconds_last,
+            "rebuild_tokens_last": self.rebuild_tokens_last,
+        }
+
+
+def get_signed_session(value: str) -> Optional["Session"]:
+    """
+    Validate a signed session token entirely in memory (signature, expiry & revocation).
+
+    Unless it happens to be cached, the returned session is built from the token's claims rather than loaded from the
+    database; only its token, user ID & expiry are populated, and its user isn't loaded (see `get_session_user`).
+    """
+    from linkpulse.tokens import revocations, signer
+
+    if signer is None:
+        return None
+
+    claims = signer.verify(value)
+    if claims is None or claims.expiry <= utc_now() or claims.token in revocations:
+        return None
+
+    session = session_cache.get(claims.token)
+    if session is not None:
+        return session
+
+    from linkpulse.models import Session
+
+    session = Session(token=claims.token, user=claims.user_id, expiry=claims.expiry)
+    session.user_loaded = False
+    return session
+
+
+async def get_session_user(session: "Session") -> "User":
+    """
+    Get a session's user. Sessions loaded from the database (or the cache) carry it already, while those built from a
+    signed token's claims have it loaded on the database thread pool, rather than by a query on the event loop.
+    """
+    if getattr(session, "user_loaded", True):
+        return session.user  # type: ignore[return-value]
+
+    from linkpulse.database import run_query
+
+    user = await run_query(lambda: session.user)
+    session.user_loaded = True
+    return user  # type: ignore[return-value]
+
+
+def get_session(token: str) -> Optional["Session"]:
+    """
+    Look up a session by token, consulting `session_cache` & `invalid_tokens` before the database.
+
+    The returned session may be expired (callers are expected to check with `Session.is_expired`), but only
+    unexpired sessions are ever cached. Blocking, so `live_tokens` misses aren't confirmed; they're simply looked up.
+    """
+    session = session_cache.get(token)
+    if session is not None:
+        return session
+    if token in invalid_tokens:
+        return None
+    return _load_session(token, filtered=False)
+
+
+async def get_session_async(token: str) -> Optional["Session"]:
+    """
+    The same as `get_session`, but cache misses are loaded on the database thread pool instead of the event loop, and
+    tokens missing from `live_tokens` are rejected without a lookup once a sync confirms they're missing.
+    """
+    session = session_cache.get(token)
+    if session is not None:
+        return session
+    if token in invalid_tokens:
+        return None
+    if not live_tokens.might_exist(token) and await live_tokens.confirm_missing(token):
+        invalid_tokens.add(token)
+        return None
+
+    from linkpulse.database import run_query
+
+    return await run_query(_load_session, token)
+
+
+def _load_session(token: str, filtered: bool = True) -> Optional["Session"]:
+    from linkpulse.models import Session
+
+    session = Session.get_with_user(token)
+    if session is None:
+        if filtered:
+            live_tokens.record_false_positive()
+        invalid_tokens.add(token)
+        return None
+
+    if not session.is_expired(revoke=False):
+        session_cache.put(session)
+    return session
+
+
+# An arbitrary, application-wide key for the advisory lock held while reaping sessions.
+REAPER_LOCK_ID = 0x6C70_0001
+
+# How often (in seconds) expired sessions are reaped, and how many rows are deleted per statement.
+reaper_interval = float(os.getenv("SESSION_REAPER_INTERVAL", "300"))
+reaper_batch_size = int(os.getenv("SESSION_REAPER_BATCH_SIZE", "1000"))
+
+
+def _delete_expired(model: Any, batch_size: int, now: datetime.datetime) -> Tuple[int, int]:
+    """
+    Delete a model's rows with an `expiry` before `now` in batches of at most `batch_size`.
+
+    :return: The number of rows deleted, and the number of batches it took.
+    """
+    deleted = batches = 0
+    while True:
+        # Uses the `expiry` index; rows locked by someone else are left for the next run
+        expired = (
+            model.select(model.token)
+            .where(model.expiry < now)
+            .order_by(model.expiry)
+            .limit(batch_size)
+            .for_update("FOR UPDATE SKIP LOCKED")
+        )
+        count = model.delete().where(model.token.in_(expired)).execute()
+        deleted += count
+        batches += 1
+        if count < batch_size:
+            return deleted, batches
+
+
+def reap_expired_sessions(
+    batch_size: Optional[int] = None, now: Optional[datetime.datetime] = None
+) -> Optional[int]:
+    """
+    Delete expired sessions (and session revocations) in bounded batches, each its own short statement, so no
+    long-lived locks are held.
+
+    Only one process (across all replicas) reaps at a time, coordinated with a Postgres advisory lock. If another
+    process holds it, this run is skipped.
+
+    :return: The number of sessions deleted, or None if the run was skipped.
+    """
+    from linkpulse.database import connection_scope
+    from linkpulse.models import Session, SessionRevocation
+
+    if batch_size is None:
+        batch_size = reaper_batch_size
+    if now is None:
+        now = utc_now()
+
+    db = Session._meta.database  # type: ignore
+    start_time = time.perf_counter()
+
+    # The advisory lock belongs to the connection, so the whole run must happen on the same one
+    with connection_scope():
+        (acquired,) = db.execute_sql("SELECT pg_try_advisory_lock(%s)", (REAPER_LOCK_ID,)).fetchone()
+        if not acquired:
+            logger.debug("Session reaper already running elsewhere, skipping")
+            return None
+
+        try:
+            deleted, batches = _delete_expired(Session, batch_size, now)
+            revocations_deleted, revocation_batches = _delete_expired(SessionRevocation, batch_size, now)
+            batches += revocation_batches
+        finally:
+            db.execute_sql("SELECT pg_advisory_unlock(%s)", (REAPER_LOCK_ID,))
+
+    logger.info(
+        "Reaped expired sessions",
+        deleted=deleted,
+        revocations_deleted=revocations_deleted,
+        batches=batches,
+        duration_ms="{:.2f}".format((time.perf_counter() - start_time) * 1000),
+    )
+    return deleted
+
+
+# The maximum number of seconds a `last_used` timestamp may remain only in memory.
+last_used_buffer = LastUsedBuffer(interval=float(os.getenv("SESSION_LAST_USED_FLUSH_INTERVAL", "5")))
+
+# Disable with SESSION_CACHE_INVALIDATION_NOTIFY=false where the database can't deliver notifications to a long-lived
+# connection; other processes then serve a revoked session until their entry lapses, so entries lapse sooner.
+session_notify = os.getenv("SESSION_CACHE_INVALIDATION_NOTIFY", "true").lower() == "true"
+
+session_cache = SessionCache(
+    maxsize=int(os.getenv("SESSION_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("SESSION_CACHE_TTL", "60" if session_notify or worker_count() == 1 else "10")),
+)
+
+# Tells the session caches of other workers & replicas about revoked sessions (see `tokens.revoke_session`).
+session_listener = (
+    InvalidationListener(session_cache, channel="linkpulse_sessions") if session_notify else None
+)
+
+invalid_tokens = InvalidTokenCache(
+    maxsize=int(os.getenv("SESSION_INVALID_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("SESSION_INVALID_CACHE_TTL", "10")),
+)
+
+live_tokens = LiveTokenFilter(
+    fp_rate=float(os.getenv("SESSION_FILTER_FP_RATE", "0.01")),
+    # The minimum number of seconds between syncs for tokens missing from the filter
+    miss_sync_interval=float(os.getenv("SESSION_FILTER_MISS_SYNC_INTERVAL", "0.05")),
+)
+# How often (in seconds) the filter is rebuilt from scratch, and synced with sessions created by other processes.
+filter_rebuild_interval = float(os.getenv("SESSION_FILTER_REBUILD_INTERVAL", "600"))
+filter_sync_interval = float(os.getenv("SESSION_FILTER_SYNC_INTERVAL", "1"))
@@ -0,0 +1,141 @@
+"""sharedtable.py
+This module provides `SharedTable`, a fixed-size hash table in a memory-mapped file shared by every process on the host.
+
+It backs both `linkpulse.ratelimit.SharedMemoryStorage` (counters) and `linkpulse.cache.SharedMemoryCacheTier`
+(cached values), which each lay out the rest of a slot as they need.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional, Tuple
+
+
+class SharedTable:
+    """
+    An open-addressed hash table of `slots` slots of `slot_bytes` each, in a memory-mapped file shared by every process
+    on the host that opens the same path. Its size never grows.
+
+    Every slot starts with `HEAD`: the key's hash (0 = empty) and its expiry (UNIX time, 0 = never); the owner stores
+    whatever else it needs after it. Keys are probed over at most `probes` slots; if all of them are live, the one
+    closest to expiring is evicted.
+
+    Access is serialized with `flock` (see `locked`). `flock` locks belong to the open file, which a forked process
+    shares with its parent, so every process must open the file itself: forked children (e.g. workers of a preloaded
+    app) reopen it.
+    """
+
+    HEAD = struct.Struct("<Qd")
+
+    def __init__(self, path: str, slots: int, slot_bytes: int, probes: int = 16):
+        self.path = path
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.probes = min(probes, slots)
+
+        self._open()
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: _reopen_after_fork(ref))
+
+        self.evictions = 0
+
+    def _open(self, resize: bool = True) -> None:
+        self._lock = threading.Lock()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = self.slots * self.slot_bytes
+        if resize:
+            with self.locked():
+                if os.fstat(self._fd).st_size < size:
+                    os.ftruncate(self._fd, size)
+        self.map = mmap.mmap(self._fd, size)
+
+    def _reopen(self) -> None:
+        # Only this process's copies of the inherited descriptor & mapping are closed
+        if not self.map.closed:
+            self.map.close()
+            os.close(self._fd)
+            # Already sized by the parent, which may be holding the lock right now
+            self._open(resize=False)
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """Hold the table exclusively; every read & write must happen within this."""
+        # flock excludes other processes, but not other threads sharing this descriptor
+        import fcntl
+
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def hash(key: bytes) -> int:
+        # Zero marks an empty slot
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little") or 1
+
+    @staticmethod
+    def _expiry(expiry: float) -> float:
+        return expiry or float("inf")
+
+    def offset(self, slot: int) -> int:
+        return slot * self.slot_bytes
+
+    def head(self, slot: int) -> Tuple[int, float]:
+        return self.HEAD.unpack_from(self.map, self.offset(slot))
+
+    def is_live(self, slot: int, now: float) -> bool:
+        key_hash, expiry = self.head(slot)
+        return key_hash != 0 and self._expiry(expiry) > now
+
+    def erase(self, slot: int) -> None:
+        self.map[self.offset(slot) : self.offset(slot) + self.slot_bytes] = bytes(self.slot_bytes)
+
+    def find(self, key_hash: int, now: float, insert: bool) -> Optional[int]:
+        """
+        Find the slot holding a key. With `insert`, fall back to the first free (or expired) slot, or else the live
+        slot closest to expiring.
+        """
+        start = key_hash % self.slots
+        free = oldest = None
+        oldest_expiry = float("inf")
+
+        for i in range(self.probes):
+            slot = (start + i) % self.slots
+            slot_hash, expiry = self.head(slot)
+            if slot_hash == key_hash:
+                return slot
+            if free is None and (slot_hash == 0 or self._expiry(expiry) <= now):
+                free = slot
+            elif oldest is None or self._expiry(expiry) < oldest_expiry:
+                oldest, oldest_expiry = slot, self._expiry(expiry)
+
+        if not insert:
+            return None
+        if free is None:
+            self.evictions += 1
+            return oldest
+        return free
+
+    def live(self, now: float) -> int:
+        """The number of unexpired slots."""
+        return sum(1 for slot in range(self.slots) if self.is_live(slot, now))
+
+    def reset(self) -> None:
+        """Empty every slot."""
+        self.map[:] = bytes(len(self.map))
+
+    def close(self) -> None:
+        self.map.close()
+        os.close(self._fd)
+
+
+def _reopen_after_fork(ref: "weakref.ref[Any]") -> None:
+    table = ref()
+    if table is not None:
+        table._reopen()
@@ -0,0 +1,107 @@
+"""startup_profile.py
+This module reports where the time goes when importing a module (the app, by default), for
+`python -m linkpulse startup-profile`.
+
+The module is imported in a fresh interpreter with `-X importtime`, a few times over (the fastest run is reported, so
+the first run's bytecode compilation doesn't skew it). Time is broken down by top-level package and by module.
+With `--budget`, the command fails when the import takes longer, so regressions can be caught in CI.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from collections import Counter
+from typing import List, NamedTuple, Optional
+
+
+class ImportTime(NamedTuple):
+    module: str
+    # Microseconds spent in the module itself, and including everything it imported
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse(output: str) -> List[ImportTime]:
+    """Parse the `import time:` lines written to stderr by `python -X importtime`."""
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            # The header
+            continue
+        module = name.strip()
+        # Each level of nesting is indented by two more spaces, after the one separating the column
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append(ImportTime(module, int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def profile(module: str) -> List[ImportTime]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=os.environ,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    return parse(result.stderr)
+
+
+def total_us(entries: List[ImportTime], module: str) -> int:
+    return next(entry.cumulative_us for entry in entries if entry.module == module and entry.depth == 0)
+
+
+def report(entries: List[ImportTime], module: str, top: int) -> str:
+    total = total_us(entries, module)
+    # Only what this import pulled in, not the interpreter's own startup (`site`, `encodings`, ...)
+    start = next(i for i, entry in enumerate(entries) if entry.module == module and entry.depth == 0)
+    first = start
+    while first > 0 and entries[first - 1].depth > 0:
+        first -= 1
+    imported = entries[first : start + 1]
+
+    packages: Counter[str] = Counter()
+    for entry in imported:
+        packages[entry.module.split(".")[0]] += entry.self_us
+
+    def ms(us: int) -> str:
+        return "{:.1f}ms".format(us / 1000)
+
+    lines = [f"Importing {module} took {ms(total)} ({len(imported)} modules)", "", "By package (self time):"]
+    for package, us in packages.most_common(top):
+        lines.append(f"  {package:<32} {ms(us):>10} {us / total:>7.1%}")
+
+    lines += ["", "Slowest modules (self time):"]
+    for entry in sorted(imported, key=lambda entry: entry.self_us, reverse=True)[:top]:
+        lines.append(f"  {entry.module:<48} {ms(entry.self_us):>10}  (cumulative {ms(entry.cumulative_us)})")
+    return "\n".join(lines)
+
+
+def main(*args: str) -> None:
+    """Args are fed directly from sys.argv, starting with the command's name."""
+    parser = argparse.ArgumentParser(prog="python -m linkpulse startup-profile", description=__doc__)
+    parser.add_argument("module", nargs="?", default="linkpulse.app")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget", type=float, default=None, help="Fail if importing takes longer (ms)")
+    options = parser.parse_args(args[1:])
+
+    fastest: Optional[List[ImportTime]] = None
+    for _ in range(max(1, options.runs)):
+        entries = profile(options.module)
+        if fastest is None or total_us(entries, options.module) < total_us(fastest, options.module):
+            fastest = entries
+    assert fastest is not None
+
+    print(report(fastest, options.module, options.top))
+
+    total_ms = total_us(fastest, options.module) / 1000
+    if options.budget is not None and total_ms > options.budget:
+        print(f"\nOver budget: {total_ms:.1f}ms > {options.budget:.1f}ms", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,48 @@
+import logging
+from contextlib import contextmanager
+from typing import Iterator, List
+
+# peewee logs every statement passed to `Database.execute_sql` at DEBUG level
+peewee_logger = logging.getLogger("peewee")
+
+
+class QueryCounter(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__(level=logging.DEBUG)
+        self.queries: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Ignore child loggers, e.g. `peewee.pool`
+        if record.name != peewee_logger.name:
+            return
+        sql, _ = record.msg  # type: ignore
+        self.queries.append(sql)
+
+
+@contextmanager
+def count_queries() -> Iterator[QueryCounter]:
+    """Count the SQL statements executed (by any thread) within the block."""
+    counter = QueryCounter()
+    level, propagate = peewee_logger.level, peewee_logger.propagate
+
+    peewee_logger.setLevel(logging.DEBUG)
+    peewee_logger.propagate = False
+    peewee_logger.addHandler(counter)
+    try:
+        yield counter
+    finally:
+        peewee_logger.removeHandler(counter)
+        peewee_logger.setLevel(level)
+        peewee_logger.propagate = propagate
+
+
+@contextmanager
+def max_queries(limit: int) -> Iterator[QueryCounter]:
+    """Fail if more than `limit` SQL statements are executed within the block."""
+    with count_queries() as counter:
+        yield counter
+    assert counter.count <= limit, f"Expected at most {limit} queries, got {counter.count}: {counter.queries}"
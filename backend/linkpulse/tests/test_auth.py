@@ -6,6 +6,11 @@ import structlog
 from fastapi import status
 from fastapi.testclient import TestClient
 from linkpulse.app import app
+from linkpulse.hashing import hasher
+from linkpulse.models import Session, User
+from linkpulse.sessions import session_cache
+from linkpulse.tests.queries import max_queries
+from linkpulse.tests.random import random_email
 from linkpulse.tests.test_session import expired_session, session
 from linkpulse.tests.test_user import user
 from linkpulse.utilities import utc_now
@@ -64,6 +69,94 @@ def test_auth_login_logout(user):
         assert client.cookies.get("session") is None
 
 
+def test_auth_logout_invalidates_cache(user):
+    args = {"email": user.email, "password": "password"}
+
+    with TestClient(app) as client:
+        response = client.post("/api/login", json=args)
+        assert response.status_code == status.HTTP_200_OK
+        token = client.cookies.get("session")
+
+        # Second request is served from the session cache
+        for _ in range(2):
+            response = client.get("/api/session")
+            assert response.status_code == status.HTTP_200_OK
+            assert response.json()["user"]["email"] == user.email
+
+        response = client.post("/api/logout")
+        assert response.status_code == status.HTTP_200_OK
+
+        # The cached session must not outlive the logout
+        client.cookies.set("session", token)
+        response = client.get("/api/session")
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_auth_query_count(user, session):
+    with TestClient(app) as client:
+        # Lookup user, create session
+        with max_queries(2):
+            response = client.post("/api/login", json={"email": user.email, "password": "password"})
+            assert response.status_code == status.HTTP_200_OK
+
+        # Session and user are resolved together
+        session_cache.invalidate(session.token)
+        client.cookies.set("session", session.token)
+        with max_queries(1):
+            response = client.get("/api/session")
+            assert response.status_code == status.HTTP_200_OK
+
+        # Served entirely from the session cache
+        with max_queries(0):
+            response = client.get("/api/session")
+            assert response.status_code == status.HTTP_200_OK
+
+        # Delete the session, and tell other processes
+        with max_queries(2):
+            response = client.post("/api/logout")
+            assert response.status_code == status.HTTP_200_OK
+
+
+def test_auth_sessions(user, session):
+    others = [
+        Session.create(user=user, token=Session.generate_token(), expiry=utc_now() + timedelta(hours=i + 1))
+        for i in range(4)
+    ]
+    Session.create(
+        user=user,
+        token=Session.generate_token(),
+        created_at=utc_now() - timedelta(hours=2),
+        expiry=utc_now() - timedelta(hours=1),
+    )
+
+    with TestClient(app) as client:
+        client.cookies.set("session", session.token)
+
+        seen, cursor = [], None
+        while True:
+            with max_queries(2):
+                params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+                response = client.get("/api/sessions", params=params)
+                assert response.status_code == status.HTTP_200_OK
+
+            page = response.json()
+            assert len(page["sessions"]) <= 2
+            seen.extend(page["sessions"])
+            cursor = page["next"]
+            if cursor is None:
+                break
+
+        # All active sessions (the expired one excluded), latest expiry first, without exposing tokens
+        assert len(seen) == len(others) + 1
+        assert len({s["id"] for s in seen}) == len(seen)
+        assert [s["expiry"] for s in seen] == sorted((s["expiry"] for s in seen), reverse=True)
+        assert [s["current"] for s in seen].count(True) == 1
+        assert all(other.token not in response.text for other in others)
+
+        response = client.get("/api/sessions", params={"cursor": "not-a-cursor"})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
 def test_auth_logout_expired(expired_session):
     # Test that an expired session cannot be used to logout, but still removes the cookie
     with TestClient(app) as client:
@@ -80,3 +173,33 @@ def test_auth_logout_expired(expired_session):
         assert response.headers.get("set-cookie") is not None
 
         # TODO: Ensure ?all=True doesn't do anything either
+
+
+def test_auth_register():
+    args = {"email": random_email(), "password": "password"}
+
+    with TestClient(app) as client:
+        # User & session are created in a single statement
+        with max_queries(1):
+            response = client.post("/api/register", json=args)
+            assert response.status_code == status.HTTP_200_OK
+        assert response.json()["email"] == args["email"]
+
+        # The issued session is immediately usable
+        response = client.get("/api/session")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["user"]["email"] == args["email"]
+
+        # A taken email creates nothing
+        with max_queries(1):
+            response = client.post("/api/register", json={**args, "password": "another password"})
+            assert response.status_code == status.HTTP_409_CONFLICT
+        assert User.select().where(User.email == args["email"]).count() == 1
+
+        # Too short a password
+        response = client.post("/api/register", json={**args, "password": "short"})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    # The stored hash verifies
+    user = User.get(User.email == args["email"])
+    assert hasher.verify("password", user.password_hash)
@@ -0,0 +1,249 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from linkpulse import cache
+from linkpulse.app import app
+from linkpulse.cache import (
+    InvalidationListener,
+    MemoryCacheBackend,
+    PostgresCacheTier,
+    SharedMemoryCacheTier,
+    TieredCacheBackend,
+    response_cache,
+)
+from linkpulse.models import ResponseCache
+from linkpulse.tests.queries import count_queries
+from linkpulse.tests.random import random_string
+
+
+@pytest.fixture
+def shared_path(tmp_path):
+    return str(tmp_path / "cache")
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def test_cache_lru_eviction():
+    backend = MemoryCacheBackend(max_bytes=30)
+
+    async def run():
+        await backend.set("a", b"x" * 9)
+        await backend.set("b", b"x" * 9)
+        await backend.set("c", b"x" * 9)
+        # 'a' becomes the most recently used, so 'b' is evicted to make room for 'd'
+        assert await backend.get("a") is not None
+        await backend.set("d", b"x" * 9)
+
+        assert await backend.get("b") is None
+        assert await backend.get("a") is not None
+        # Too large to ever fit; cached values stay
+        await backend.set("e", b"x" * 100)
+        assert await backend.get("e") is None
+
+    asyncio.run(run())
+    assert backend.bytes <= backend.max_bytes
+    assert backend.stats()["evictions"] == 1
+
+
+def test_cache_coalesces_misses():
+    backend = MemoryCacheBackend(max_bytes=1024)
+    computed = 0
+
+    async def cached_call():
+        nonlocal computed
+        _, value = await backend.get_with_ttl("key")
+        if value is None:
+            computed += 1
+            await asyncio.sleep(0.05)
+            value = b"value"
+            await backend.set("key", value, 60)
+        return value
+
+    async def run():
+        return await asyncio.gather(*(cached_call() for _ in range(10)))
+
+    assert asyncio.run(run()) == [b"value"] * 10
+    assert computed == 1
+    assert backend.stats()["misses"] == 1
+    assert backend.stats()["coalesced"] == 9
+
+
+def test_cache_fill_timeout():
+    backend = MemoryCacheBackend(max_bytes=1024, fill_timeout=0.05)
+
+    async def run():
+        # The first caller misses and never sets a value, e.g. because it raised
+        assert await backend.get_with_ttl("key") == (0, None)
+        # Others wait for it, then compute the value themselves
+        assert await backend.get_with_ttl("key") == (0, None)
+
+    asyncio.run(run())
+    assert backend.stats()["misses"] == 2
+
+
+def test_cache_filler_fails():
+    backend = MemoryCacheBackend(max_bytes=1024, fill_timeout=10)
+
+    async def failing_call():
+        _, value = await backend.get_with_ttl("key")
+        if value is None:
+            await asyncio.sleep(0.05)
+            raise RuntimeError("database unavailable")
+
+    async def waiting_call():
+        await asyncio.sleep(0.01)
+        # Released as soon as the filler fails, rather than after `fill_timeout`
+        return await backend.get_with_ttl("key")
+
+    async def run():
+        start = time.monotonic()
+        results = await asyncio.gather(
+            asyncio.create_task(failing_call()), waiting_call(), waiting_call(), return_exceptions=True
+        )
+        assert isinstance(results[0], RuntimeError)
+        assert results[1:] == [(0, None), (0, None)]
+        assert time.monotonic() - start < 1
+
+        # Later callers aren't blocked either
+        assert await asyncio.wait_for(backend.get_with_ttl("key"), 1) == (0, None)
+
+    asyncio.run(run())
+    # The last caller never sets a value either
+    assert backend.stats()["abandoned"] == 2
+
+
+def test_cache_stale_while_revalidate(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=clock.monotonic))
+    backend = MemoryCacheBackend(max_bytes=1024, stale_ttl=30)
+
+    async def run():
+        await backend.set("key", b"old", 10)
+        assert await backend.get_with_ttl("key") == (10, b"old")
+
+        clock.now += 15
+        # The first caller after expiry revalidates, the rest are served the stale value meanwhile
+        assert await backend.get_with_ttl("key") == (0, None)
+        assert await backend.get_with_ttl("key") == (0, b"old")
+        await backend.set("key", b"new", 10)
+        assert await backend.get_with_ttl("key") == (10, b"new")
+
+        # Past the stale window, it's a plain miss
+        clock.now += 45
+        assert await backend.get_with_ttl("key") == (0, None)
+
+    asyncio.run(run())
+    assert backend.stats()["stale_hits"] == 1
+
+
+def test_cache_migration_endpoint():
+    with TestClient(app) as client:
+        client.portal.call(response_cache.clear)
+
+        with count_queries() as counter, ThreadPoolExecutor(10) as pool:
+            responses = list(pool.map(lambda _: client.get("/api/migration"), range(10)))
+
+        assert all(response.status_code == 200 for response in responses)
+        assert len({response.json()["name"] for response in responses}) == 1
+        assert len([sql for sql in counter.queries if "migratehistory" in sql]) == 1
+
+
+def test_shared_memory_tier(shared_path):
+    # Two workers, each with its own local tier, mapping the same file
+    first = TieredCacheBackend(
+        MemoryCacheBackend(1024), SharedMemoryCacheTier(shared_path, slots=8, slot_bytes=256)
+    )
+    second = TieredCacheBackend(
+        MemoryCacheBackend(1024), SharedMemoryCacheTier(shared_path, slots=8, slot_bytes=256)
+    )
+
+    async def run():
+        assert await first.get_with_ttl("ns:a") == (0, None)
+        await first.set("ns:a", b"value", 60)
+        await first.set("ns:b", b"forever")
+
+        # Found in the shared tier, then served locally
+        ttl, value = await second.get_with_ttl("ns:a")
+        assert value == b"value" and 58 <= ttl <= 60
+        assert (await second.get_with_ttl("ns:a"))[1] == b"value"
+        assert second.local.stats()["hits"] == 1
+        assert await second.get_with_ttl("ns:b") == (0, b"forever")
+
+        # Too large to share, but still cached locally
+        await first.set("large", b"x" * 512, 60)
+        assert await first.get("large") is not None
+        assert await second.get("large") is None
+
+        assert await second.clear(namespace="ns:") == 2
+        assert await first.shared.get("ns:a") is None
+
+    asyncio.run(run())
+    assert second.stats()["shared_hits"] == 2
+    assert first.stats()["shared_too_large"] == 1
+
+
+def test_postgres_tier():
+    tier = PostgresCacheTier()
+    prefix = random_string(16)
+
+    async def run():
+        assert await tier.get(f"{prefix}:a") is None
+        await tier.set(f"{prefix}:a", b"first", time.time() + 60)
+        await tier.set(f"{prefix}:a", b"second", time.time() + 60)
+        value, expires_at = await tier.get(f"{prefix}:a")
+        assert value == b"second" and expires_at > time.time()
+
+        await tier.set(f"{prefix}:b", b"forever", None)
+        assert await tier.get(f"{prefix}:b") == (b"forever", None)
+
+        await tier.set(f"{prefix}:c", b"expired", time.time() - 1)
+        assert await tier.get(f"{prefix}:c") is None
+
+    asyncio.run(run())
+    assert tier.prune() >= 1
+    assert asyncio.run(tier.clear(namespace=prefix)) == 2
+    assert ResponseCache.select().where(ResponseCache.key.startswith(prefix)).count() == 0
+
+
+def test_invalidation_broadcast(shared_path):
+    # Two replicas, whose local tiers are invalidated through the database
+    backends = []
+    for _ in range(2):
+        local = MemoryCacheBackend(1024)
+        shared = SharedMemoryCacheTier(shared_path, slots=8, slot_bytes=256)
+        backends.append(TieredCacheBackend(local, shared, InvalidationListener(local)))
+    first, second = backends
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        for backend in backends:
+            backend.start(loop)
+            assert await loop.run_in_executor(None, backend.listener.listening.wait, 5)
+        try:
+            await first.set("key", b"value", 60)
+            assert await second.get_with_ttl("key") != (0, None)
+
+            await first.clear(key="key")
+            deadline = time.monotonic() + 2
+            while await second.local.get("key") is not None:
+                assert time.monotonic() < deadline, "invalidation wasn't received"
+                await asyncio.sleep(0.005)
+        finally:
+            for backend in backends:
+                backend.stop()
+
+    asyncio.run(run())
+    assert first.listener.stats()["invalidations_sent"] == 1
+    # Its own notification is skipped
+    assert first.listener.stats()["invalidations_received"] == 0
+    assert second.listener.stats()["invalidations_received"] == 1
@@ -0,0 +1,83 @@
+import asyncio
+import os
+import threading
+
+import pytest
+import structlog
+from linkpulse.database import DatabaseExecutor, InstrumentedPooledPostgresqlDatabase
+from linkpulse.models import User
+from linkpulse.tests.test_user import user
+from linkpulse.utilities import get_db
+from peewee import OperationalError
+from playhouse.pool import MaxConnectionsExceeded
+
+
+def test_executor_runs_off_thread(user):
+    executor = DatabaseExecutor(workers=2)
+
+    async def run():
+        structlog.contextvars.bind_contextvars(request_id="test")
+
+        def query():
+            context = structlog.contextvars.get_contextvars()
+            return threading.current_thread().name, context, User.get_or_none(User.id == user.id)
+
+        return await executor.run(query)
+
+    try:
+        thread_name, context, fetched = asyncio.run(run())
+    finally:
+        executor.shutdown()
+
+    assert thread_name.startswith("linkpulse-db")
+    assert context["request_id"] == "test"
+    assert fetched.email == user.email
+
+    stats = executor.stats()
+    assert stats["submitted"] == stats["completed"] == 1
+    assert stats["running"] == stats["queued"] == 0
+
+
+def test_pool_returns_connections(user):
+    db = get_db()
+    assert isinstance(db, InstrumentedPooledPostgresqlDatabase)
+
+    executor = DatabaseExecutor(workers=4)
+    before = db.pool_stats()
+
+    async def run():
+        await asyncio.gather(*[executor.run(User.get_by_id, user.id) for _ in range(8)])
+
+    try:
+        asyncio.run(run())
+    finally:
+        executor.shutdown()
+
+    after = db.pool_stats()
+    # Every connection checked out by the executor was handed back
+    assert after["checked_out"] == before["checked_out"]
+    assert after["checkouts"] >= before["checkouts"] + 8
+    assert after["idle"] >= 1
+
+
+def test_pool_timeouts_and_failures():
+    url = os.environ["DATABASE_URL"]
+    db = InstrumentedPooledPostgresqlDatabase(None, url=lambda: url, max_connections=1, timeout=0.1)
+    db.connect()
+    try:
+        # The only connection is held by this thread
+        thread = threading.Thread(target=lambda: pytest.raises(MaxConnectionsExceeded, db.connect))
+        thread.start()
+        thread.join()
+    finally:
+        db.close_all()
+    assert db.pool_stats()["timeouts"] == 1
+    assert db.pool_stats()["failures"] == 0
+
+    unreachable = InstrumentedPooledPostgresqlDatabase(
+        None, url=lambda: "postgres://linkpulse@127.0.0.1:1/linkpulse", max_connections=1
+    )
+    with pytest.raises(OperationalError):
+        unreachable.connect()
+    assert unreachable.pool_stats()["timeouts"] == 0
+    assert unreachable.pool_stats()["failures"] == 1
@@ -0,0 +1,74 @@
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from linkpulse.hashing import HashingPool, HashingPoolFull, hasher
+
+password_hash = hasher.hash("password")
+
+
+@pytest.fixture
+def pool():
+    pool = HashingPool(workers=1, max_queued=4)
+    yield pool
+    pool.shutdown()
+
+
+def test_hashing_pool_verify(pool):
+    async def run():
+        assert await pool.verify("a", "password", password_hash) is True
+        assert await pool.verify("a", "wrong", password_hash) is False
+        valid, updated = await pool.verify_and_update("a", "password", password_hash)
+        assert valid is True and updated is None
+
+    asyncio.run(run())
+    assert pool.stats()["completed"] == 3
+    assert pool.stats()["queued"] == 0
+
+
+def test_hashing_pool_fair(pool):
+    order = []
+
+    async def verify(key: str):
+        await pool.verify(key, "password", password_hash)
+        order.append(key)
+
+    async def run():
+        # One client floods the queue, the other shouldn't have to wait behind all of it
+        await asyncio.gather(*[verify("flood") for _ in range(4)], verify("other"))
+
+    asyncio.run(run())
+    assert order == ["flood", "flood", "other", "flood", "flood"]
+
+
+def test_hashing_pool_full(pool):
+    pool.max_queued = 1
+
+    async def run():
+        return await asyncio.gather(
+            *[pool.verify(str(i), "password", password_hash) for i in range(3)], return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert results[:2] == [True, True]
+    assert isinstance(results[2], HashingPoolFull)
+    assert pool.rejected == 1
+
+
+def test_hashing_pool_worker_killed(pool):
+    async def run():
+        assert await pool.verify("a", "password", password_hash) is True
+        for process in pool.executor._processes.values():
+            process.kill()
+            process.join()
+
+        # The pool starts over rather than hanging; a job sent before it noticed the dead worker fails
+        first = await asyncio.gather(
+            asyncio.wait_for(pool.verify("a", "password", password_hash), 10), return_exceptions=True
+        )
+        assert first == [True] or isinstance(first[0], BrokenProcessPool)
+        assert await asyncio.wait_for(pool.verify("a", "password", password_hash), 10) is True
+
+    asyncio.run(run())
+    assert pool.stats()["running"] == 0
+    assert pool.stats()["restarts"] == 1
@@ -0,0 +1,49 @@
+import io
+import logging
+import threading
+
+from linkpulse.logging import QueuedStreamHandler
+
+
+class BlockingStream(io.StringIO):
+    """A stream whose writes wait until released, like a backed-up stdout."""
+
+    def __init__(self):
+        super().__init__()
+        self.released = threading.Event()
+
+    def write(self, s):
+        self.released.wait()
+        return super().write(s)
+
+
+def record(message: str) -> logging.LogRecord:
+    return logging.LogRecord("test", logging.INFO, __file__, 0, message, None, None)
+
+
+def test_queued_handler_writes():
+    stream = io.StringIO()
+    handler = QueuedStreamHandler(stream, max_size=100, block=True)
+    for i in range(50):
+        handler.handle(record(f"line {i}"))
+    handler.close()
+
+    assert stream.getvalue().splitlines() == [f"line {i}" for i in range(50)]
+    assert handler.stats()["written"] == 50
+
+
+def test_queued_handler_drops():
+    stream = BlockingStream()
+    handler = QueuedStreamHandler(stream, max_size=10, block=False, batch_size=1)
+
+    # The writer is stuck on the first line, so the rest fill the queue and overflow without blocking
+    for i in range(100):
+        handler.handle(record(f"line {i}"))
+    assert handler.dropped > 0
+
+    stream.released.set()
+    handler.close()
+
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 100 - handler.dropped + 1
+    assert lines.count("Log lines dropped") == 1
@@ -0,0 +1,73 @@
+import threading
+
+from fastapi.testclient import TestClient
+from linkpulse.app import app
+from linkpulse.metrics import Registry, scheduler_job_duration, timed_job
+
+
+def test_counter_threads():
+    registry = Registry()
+    counter = registry.counter("test_total", "Test.", ("kind",))
+
+    def work():
+        for _ in range(1000):
+            counter.inc("a")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc("b", amount=2)
+
+    # Each thread counted into its own bucket; they are summed on collection
+    assert counter.collect() == {("a",): 4000, ("b",): 2}
+
+
+def test_histogram_render():
+    registry = Registry()
+    histogram = registry.histogram("test_seconds", "Test.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value, '/a"b')
+    registry.register_stats("test_stats", lambda: {"size": 3, "enabled": True, "backend": "memory"})
+
+    lines = registry.render().splitlines()
+    assert "# TYPE test_seconds histogram" in lines
+    assert 'test_seconds_bucket{route="/a\\"b",le="0.1"} 2' in lines
+    assert 'test_seconds_bucket{route="/a\\"b",le="1.0"} 3' in lines
+    assert 'test_seconds_bucket{route="/a\\"b",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{route="/a\\"b"} 4' in lines
+    assert 'test_seconds_sum{route="/a\\"b"} 5.65' in lines
+    assert "test_stats_size 3" in lines
+    assert "test_stats_enabled 1" in lines
+    assert not any(line.startswith("test_stats_backend") for line in lines)
+
+
+def test_timed_job():
+    def fail():
+        raise RuntimeError()
+
+    timed_job("test_job", lambda: None)()
+    try:
+        timed_job("test_job", fail)()
+    except RuntimeError:
+        pass
+
+    # Observation counts (excluding the trailing sum) for each outcome
+    runs = scheduler_job_duration.collect()
+    assert sum(runs[("test_job", "success")][:-1]) == 1
+    assert sum(runs[("test_job", "error")][:-1]) == 1
+
+
+def test_metrics_endpoint():
+    with TestClient(app) as client:
+        client.get("/health")
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+
+    body = response.text
+    assert 'linkpulse_http_requests_total{route="/health",method="GET",status="200"}' in body
+    assert "linkpulse_http_request_duration_seconds_bucket" in body
+    assert "linkpulse_db_query_duration_seconds_count" in body
+    assert "linkpulse_db_executor_submitted" in body
@@ -0,0 +1,146 @@
+import logging
+import os
+import subprocess
+import sys
+
+import pytest
+import structlog
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from linkpulse.database import run_query
+from linkpulse.middleware import LoggingMiddleware
+from linkpulse.utilities import get_db
+
+
+def create_client(**options):
+    app = FastAPI()
+
+    @app.get("/ok")
+    async def ok():
+        return "OK"
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for i in range(3):
+                yield f"chunk {i}\n"
+
+        return StreamingResponse(chunks())
+
+    @app.get("/queries/{n}")
+    async def queries(n: int):
+        db = get_db()
+        for _ in range(n):
+            await run_query(db.execute_sql, "SELECT 1")
+        return "OK"
+
+    @app.get("/error")
+    async def error():
+        raise RuntimeError("boom")
+
+    app.add_middleware(LoggingMiddleware, **options)
+    return TestClient(app, raise_server_exceptions=False)
+
+
+@pytest.fixture
+def client():
+    return create_client(level="warning")
+
+
+def access_logs(logs):
+    return [log for log in logs if log["event"] == "Request"]
+
+
+def test_logging_middleware(client):
+    with structlog.testing.capture_logs() as logs:
+        response = client.get("/ok", params={"a": "1"})
+    assert response.status_code == 200
+    assert "X-Process-Time" in response.headers
+
+    (log,) = access_logs(logs)
+    assert log["http"]["status_code"] == 200
+    assert log["http"]["query"] == {"a": "1"}
+    assert log["http"]["method"] == "GET"
+    assert float(log["ttfb_ms"]) <= float(log["duration_ms"])
+
+
+def test_logging_middleware_streaming(client):
+    with structlog.testing.capture_logs() as logs:
+        response = client.get("/stream")
+    assert response.text == "chunk 0\nchunk 1\nchunk 2\n"
+    assert access_logs(logs)[0]["http"]["status_code"] == 200
+
+
+def test_logging_middleware_exception(client):
+    with structlog.testing.capture_logs() as logs:
+        response = client.get("/error")
+    assert response.status_code == 500
+
+    assert any(log["event"] == "Uncaught exception" for log in logs)
+    assert access_logs(logs)[0]["http"]["status_code"] == 500
+
+
+def test_logging_middleware_queries():
+    client = create_client(level="warning", n_plus_one_threshold=5)
+
+    with structlog.testing.capture_logs() as logs:
+        client.get("/queries/3")
+        client.get("/queries/6")
+
+    # Statements run on the database threads are attributed to the request that submitted them
+    assert [log["db"]["queries"] for log in access_logs(logs)] == [3, 6]
+
+    (warning,) = [log for log in logs if log["event"] == "Possible N+1 query"]
+    assert warning["route"] == "/queries/{n}"
+    assert warning["count"] == 6
+    assert warning["sql"] == "SELECT 1"
+
+
+def test_logging_middleware_level():
+    client = create_client(level="debug")
+    access_logger = logging.getLogger("api.access")
+    level = access_logger.level
+
+    # Below the logger's level, no entry is built at all
+    access_logger.setLevel(logging.INFO)
+    try:
+        with structlog.testing.capture_logs() as logs:
+            assert client.get("/ok").status_code == 200
+        assert access_logs(logs) == []
+    finally:
+        access_logger.setLevel(level)
+
+
+def test_logging_middleware_sampling():
+    client = create_client(level="warning", sample_rate=4, slow_ms=10_000)
+
+    with structlog.testing.capture_logs() as logs:
+        for _ in range(8):
+            client.get("/ok")
+        for _ in range(2):
+            client.get("/error")
+        for _ in range(3):
+            client.get("/missing")
+
+    # 1 in 4 successful requests, but every client or server error
+    statuses = [log["http"]["status_code"] for log in access_logs(logs)]
+    assert statuses.count(200) == 2
+    assert statuses.count(500) == 2
+    assert statuses.count(404) == 3
+    assert all(log["sample_rate"] == 4 for log in access_logs(logs))
+
+
+def test_logging_middleware_unknown_level():
+    with pytest.raises(ValueError):
+        LoggingMiddleware(FastAPI(), level="verbose")
+
+    # Rejected at import, rather than logging everything at 'Level VERBOSE'
+    result = subprocess.run(
+        [sys.executable, "-c", "import linkpulse.middleware"],
+        env={**os.environ, "ACCESS_LOG_LEVEL": "verbose"},
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode != 0
+    assert "ValueError: Unknown ACCESS_LOG_LEVEL: 'verbose'" in result.stderr
@@ -0,0 +1,64 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from linkpulse.app import app
+from linkpulse.profiler import Sampler, profiler
+
+
+def busy_wait(seconds: float) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+@pytest.fixture
+def token(monkeypatch):
+    monkeypatch.setattr(profiler, "token", "secret")
+    return "secret"
+
+
+def test_sampler():
+    sampler = Sampler(interval=0.001).start()
+    busy_wait(0.1)
+    collapsed = sampler.stop().render()
+
+    assert sampler.samples > 0
+    # Stacks are rooted at the thread's name and read outermost frame first
+    assert any(
+        line.startswith("MainThread;") and "test_profiler:busy_wait" in line
+        for line in collapsed.splitlines()
+    )
+
+
+def test_profiler_disabled():
+    with TestClient(app) as client:
+        response = client.get("/health", headers={"X-Profile": "anything"})
+        assert "X-Profile-Id" not in response.headers
+
+        response = client.post("/api/profile", params={"seconds": 0.1})
+        assert response.status_code == 404
+
+
+def test_profiler_request(token):
+    with TestClient(app) as client:
+        response = client.get("/health", headers={"X-Profile": "wrong"})
+        assert "X-Profile-Id" not in response.headers
+
+        response = client.get("/health", headers={"X-Profile": token})
+        profile_id = response.headers["X-Profile-Id"]
+
+        response = client.get(f"/api/profile/{profile_id}")
+        assert response.status_code == 401
+        response = client.get(f"/api/profile/{profile_id}", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200
+
+
+def test_profiler_window(token):
+    with TestClient(app) as client:
+        response = client.post(
+            "/api/profile", params={"seconds": 0.2}, headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200
+        # The event loop was sampled while it waited
+        assert "asyncio" in response.text
@@ -0,0 +1,138 @@
+import asyncio
+import multiprocessing
+
+import pytest
+from limits import parse
+from limits.aio.strategies import FixedWindowRateLimiter
+from linkpulse.dependencies import RateLimiter
+from linkpulse.models import RateLimit
+from linkpulse.ratelimit import GCRARateLimiter, PostgresStorage, SharedMemoryStorage
+from linkpulse.tests.random import random_string
+
+
+@pytest.fixture
+def shared_path(tmp_path):
+    return str(tmp_path / "ratelimit")
+
+
+def _hit_shared(path: str, key: str, hits: int) -> None:
+    storage = SharedMemoryStorage(path, slots=64)
+    for _ in range(hits):
+        asyncio.run(storage.incr(key, 60))
+    storage.close()
+
+
+def test_shared_memory_storage(shared_path):
+    first, second = SharedMemoryStorage(shared_path, slots=64), SharedMemoryStorage(shared_path, slots=64)
+
+    async def run():
+        # Two mappings of the same file (i.e. two workers) share their counters
+        assert await first.incr("a", 60) == 1
+        assert await second.incr("a", 60) == 2
+        assert await first.get("a") == 2
+        assert await second.get("b") == 0
+
+        await second.clear("a")
+        assert await first.get("a") == 0
+
+        # Expired windows restart
+        assert await first.incr("c", 0) == 1
+        assert await first.incr("c", 0) == 1
+
+    asyncio.run(run())
+
+
+def test_shared_memory_storage_processes(shared_path):
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=_hit_shared, args=(shared_path, "key", 50)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    # No increments are lost to concurrent updates
+    assert asyncio.run(SharedMemoryStorage(shared_path, slots=64).get("key")) == 200
+
+
+def test_shared_memory_storage_bounded(shared_path):
+    storage = SharedMemoryStorage(shared_path, slots=8, probes=4)
+
+    async def run():
+        for i in range(100):
+            await storage.incr(f"key-{i}", 60)
+
+    asyncio.run(run())
+    assert storage.stats()["live"] <= 8
+    assert storage.evictions > 0
+
+
+def test_postgres_storage():
+    first, second = PostgresStorage(), PostgresStorage()
+    key = random_string(16)
+
+    async def hit(storage):
+        return await storage.incr(key, 60)
+
+    # Counted locally until flushed
+    assert asyncio.run(hit(first)) == 1
+    assert asyncio.run(hit(first)) == 2
+    assert RateLimit.get_or_none(RateLimit.key == key) is None
+
+    assert first.flush() == 1
+    assert RateLimit.get(RateLimit.key == key).count == 2
+
+    # The other replica learns the global count on its own flush
+    assert asyncio.run(hit(second)) == 1
+    second.flush()
+    assert asyncio.run(hit(second)) == 4
+    assert first.flush() == 0
+
+    RateLimit.delete().where(RateLimit.key == key).execute()
+
+
+def test_rate_limiter_fixed_window(shared_path):
+    limiter = RateLimiter("2/minute", storage=SharedMemoryStorage(shared_path, slots=64))
+    assert isinstance(limiter.strategy, FixedWindowRateLimiter)
+
+    async def run():
+        limit = parse("2/minute")
+        return [await limiter.strategy.hit(limit, "key") for _ in range(3)]
+
+    assert asyncio.run(run()) == [True, True, False]
+
+
+def test_gcra():
+    limiter = GCRARateLimiter(maxsize=100)
+    limit = parse("6/minute")
+
+    async def run():
+        # The full allowance is available as a burst, then nothing until it refills
+        assert [await limiter.hit(limit, "key") for _ in range(7)] == [True] * 6 + [False]
+        assert await limiter.test(limit, "key") is False
+        assert (await limiter.get_window_stats(limit, "key")).remaining == 0
+
+        # Keys are independent, and clearing one restores its allowance
+        assert await limiter.hit(limit, "other") is True
+        await limiter.clear(limit, "key")
+        assert (await limiter.get_window_stats(limit, "key")).remaining == 6
+
+    asyncio.run(run())
+
+
+def test_gcra_bounded():
+    limiter = GCRARateLimiter(maxsize=10)
+    limit = parse("6/minute")
+
+    async def run():
+        for i in range(100):
+            await limiter.hit(limit, f"key-{i}")
+
+    asyncio.run(run())
+    assert limiter.stats()["keys"] == 10
+    assert limiter.evictions == 90
+
+
+def test_rate_limiter_strategy():
+    assert isinstance(RateLimiter("6/minute", strategy="gcra").strategy, GCRARateLimiter)
+    with pytest.raises(ValueError):
+        RateLimiter("6/minute", strategy="unknown")
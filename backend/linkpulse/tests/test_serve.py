@@ -0,0 +1,198 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+from linkpulse import serve
+from linkpulse.serve import Heartbeats, Supervisor, Worker
+from linkpulse.utilities import cpu_count
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start(*args: str, **env: str) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, *args],
+        env={**os.environ, "ENVIRONMENT": "production", "LOG_JSON_FORMAT": "true", **env},
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+
+
+def stop(process: subprocess.Popen) -> str:
+    process.send_signal(signal.SIGTERM)
+    output, _ = process.communicate(timeout=30)
+    return output
+
+
+async def hung_app(scope, receive, send):
+    """An app whose startup never finishes, blocking its event loop."""
+    time.sleep(3600)
+
+
+def test_heartbeats():
+    heartbeats = Heartbeats(2)
+    assert heartbeats.last(0) == heartbeats.last(1) == 0
+
+    heartbeats.beat(1)
+    assert heartbeats.last(0) == 0
+    assert 0 < heartbeats.last(1) <= time.monotonic()
+
+    heartbeats.reset(1)
+    assert heartbeats.last(1) == 0
+
+
+def test_serve_workers():
+    port = free_port()
+    process = start(
+        "-m", "linkpulse", "serve", PORT=str(port), HOST="127.0.0.1", WEB_CONCURRENCY="2", WORKER_STAGGER="0"
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                assert httpx.get(f"http://127.0.0.1:{port}/health").status_code == 200
+                break
+            except httpx.TransportError:
+                assert time.monotonic() < deadline, "server didn't start"
+                time.sleep(0.2)
+    finally:
+        output = stop(process)
+
+    assert process.returncode == 0
+    assert output.count('"msg":"Started worker"') == 2
+    # Workers shut down gracefully, with their logs flushed
+    assert output.count('"code":0') == 2
+    assert '"msg":"Application shutdown complete."' in output
+
+
+def test_serve_restarts_hung_worker():
+    script = (
+        "from linkpulse.serve import Supervisor;"
+        f"Supervisor('linkpulse.tests.test_serve:hung_app', host='127.0.0.1', port={free_port()}, workers=1, timeout=1, graceful_timeout=1).run()"
+    )
+    process = start("-c", script)
+    time.sleep(4)
+    output = stop(process)
+
+    assert "Worker unresponsive, killing it" in output
+    assert output.count("Started worker") >= 2
+
+
+def test_uvicorn_options(monkeypatch):
+    monkeypatch.setattr(serve, "server_loop", "uvloop")
+    monkeypatch.setattr(serve, "server_max_concurrency", 0)
+    options = serve.uvicorn_options()
+    assert options["loop"] == "uvloop"
+    # 0 means no limit
+    assert options["limit_concurrency"] is None
+
+    monkeypatch.setattr(serve, "server_max_concurrency", 100)
+    assert serve.uvicorn_options()["limit_concurrency"] == 100
+
+
+def test_bind_socket():
+    with serve.bind_socket("127.0.0.1", 0, reuse_port=True) as sock:
+        # Accepted sockets inherit this; asyncio only sets TCP_NODELAY on sockets that are explicitly TCP
+        assert sock.proto == socket.IPPROTO_TCP
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT) == 1
+
+
+def test_per_worker_defaults(tmp_path):
+    script = (
+        "from linkpulse import database, hashing, models, ratelimit;"
+        "print(type(ratelimit.storage).__name__, database.db_executor.workers, hashing.hashing_pool.workers,"
+        " models.BaseModel._meta.database._max_connections)"
+    )
+    env = {**os.environ, "RATE_LIMIT_SHARED_PATH": str(tmp_path / "ratelimit")}
+    env.pop("RATE_LIMIT_STORAGE", None)
+    env.pop("HASH_WORKERS", None)
+    env.pop("DB_WORKERS", None)
+    env.pop("DATABASE_MAX_CONNECTIONS", None)
+
+    # Rate limits are counted across workers, and pools are split between them
+    result = subprocess.run(
+        [sys.executable, "-c", script], env={**env, "WEB_CONCURRENCY": "10"}, capture_output=True, text=True
+    )
+    storage, db_workers, hash_workers, max_connections = result.stdout.split()
+    assert storage == "SharedMemoryStorage"
+    assert int(db_workers) == 2
+    assert int(hash_workers) == max(1, cpu_count() // 10)
+    # 20 // 10, less the connection listening for session invalidations
+    assert int(max_connections) == 1
+
+    # Per-process limits with several workers are refused
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        env={**env, "WEB_CONCURRENCY": "10", "RATE_LIMIT_STORAGE": "memory"},
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode != 0 and "RATE_LIMIT_STORAGE=memory" in result.stderr
+
+
+def test_serve_preload_shared_backends(tmp_path):
+    port = free_port()
+    process = start(
+        "-m",
+        "linkpulse",
+        "serve",
+        PORT=str(port),
+        HOST="127.0.0.1",
+        WEB_CONCURRENCY="2",
+        WORKER_STAGGER="0",
+        PRELOAD_APP="true",
+        RATE_LIMIT_STORAGE="shared",
+        RATE_LIMIT_SHARED_PATH=str(tmp_path / "ratelimit"),
+        CACHE_BACKEND="shared",
+        CACHE_SHARED_PATH=str(tmp_path / "cache"),
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            assert time.monotonic() < deadline, "server didn't start"
+            time.sleep(0.2)
+        time.sleep(1)
+
+        # A new connection each time, spread over both workers; the limit holds across them
+        headers = {"X-Real-IP": "10.0.0.1"}
+        body = {"email": "nobody@example.com", "password": "password"}
+        codes = [
+            httpx.post(f"http://127.0.0.1:{port}/api/login", json=body, headers=headers).status_code
+            for _ in range(10)
+        ]
+        assert codes.count(429) == 4, codes
+
+        # Cached responses are served by either worker
+        responses = [httpx.get(f"http://127.0.0.1:{port}/api/migration") for _ in range(10)]
+        assert all(response.status_code == 200 for response in responses)
+        assert len({response.json()["name"] for response in responses}) == 1
+    finally:
+        output = stop(process)
+    assert process.returncode == 0, output
+
+
+def test_memory_check_interval(monkeypatch):
+    checked = []
+    monkeypatch.setattr(serve, "private_memory", lambda pid: checked.append(pid) or 0)
+    supervisor = Supervisor(workers=1, max_memory=1024, memory_interval=60)
+    supervisor.running[os.getpid()] = Worker(os.getpid(), 0)
+    supervisor.heartbeats.beat(0)
+
+    # Hung workers are checked for every time, memory only every `memory_interval` seconds
+    for _ in range(3):
+        supervisor.check()
+    assert checked == [os.getpid()]
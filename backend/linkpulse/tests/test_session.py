@@ -1,9 +1,26 @@
+import asyncio
+import threading
+import time
 from datetime import timedelta
 
 import pytest
 import structlog
+from linkpulse.database import run_query
 from linkpulse.models import Session
 from linkpulse.routers.auth import validate_session
+from linkpulse.sessions import (
+    REAPER_LOCK_ID,
+    BloomFilter,
+    SessionCache,
+    get_session,
+    get_session_async,
+    invalid_tokens,
+    last_used_buffer,
+    live_tokens,
+    reap_expired_sessions,
+    session_cache,
+)
+from linkpulse.tests.queries import max_queries
 from linkpulse.tests.random import random_string
 from linkpulse.tests.test_user import user
 from linkpulse.utilities import utc_now
@@ -74,5 +91,208 @@ def test_session_constraint_expiry(user):
 def test_validate_session(db, session):
     assert session.last_used is None
     assert validate_session(session.token, user=True) == (True, True, session.user)
+    last_used_buffer.flush()
     session = Session.get(Session.token == session.token)
     assert session.last_used is not None
+
+
+def test_session_cache(session):
+    cache = SessionCache(maxsize=2, ttl=60)
+    assert cache.get(session.token) is None
+    cache.put(session)
+    assert cache.get(session.token) is session
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Entries never outlive the session's expiry
+    assert cache.get(session.token, now=session.expiry_utc) is None
+    assert len(cache) == 0
+
+
+def test_session_cache_eviction(user):
+    cache = SessionCache(maxsize=2, ttl=60)
+    sessions = [
+        Session.create(user=user, token=Session.generate_token(), expiry=utc_now() + timedelta(hours=1))
+        for _ in range(3)
+    ]
+    for s in sessions:
+        cache.put(s)
+
+    assert len(cache) == 2
+    assert cache.evictions == 1
+    assert cache.get(sessions[0].token) is None
+
+    cache.invalidate_user(user.id)
+    assert len(cache) == 0
+
+
+def test_get_with_user(session):
+    with max_queries(1):
+        fetched = Session.get_with_user(session.token)
+        assert fetched.user.email == session.user.email
+        assert fetched.is_expired(revoke=False) is False
+
+    assert Session.get_with_user(Session.generate_token()) is None
+
+
+def test_get_session_cached(session):
+    session_cache.invalidate(session.token)
+    first = get_session(session.token)
+    assert first is not None and first.user.email == session.user.email
+    assert get_session(session.token) is first
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(capacity=1000, fp_rate=0.01)
+    present = [random_string(32) for _ in range(1000)]
+    for token in present:
+        bloom.add(token)
+
+    # No false negatives, and roughly the requested false positive rate
+    assert all(token in bloom for token in present)
+    false_positives = sum(random_string(32) in bloom for _ in range(10000))
+    assert false_positives < 300
+    assert bloom.estimated_fp_rate() == pytest.approx(0.01, rel=0.5)
+
+
+def test_live_token_filter(user, session):
+    live_tokens.rebuild()
+    assert live_tokens.ready
+
+    # Garbage tokens are never looked up, only checked against sessions created since the last sync
+    garbage = Session.generate_token()
+    with max_queries(1):
+        assert asyncio.run(get_session_async(garbage)) is None
+    with max_queries(0):
+        assert asyncio.run(get_session_async(garbage)) is None
+
+    # Sessions created after the rebuild are added as they're saved
+    created = Session.create(user=user, token=Session.generate_token(), expiry=utc_now() + timedelta(hours=1))
+    assert get_session(session.token) is not None
+    assert get_session(created.token) is not None
+
+    # Sessions created elsewhere (without going through `save`) are picked up by the next sync
+    token = Session.generate_token()
+    Session.insert(user=user, token=token, expiry=utc_now() + timedelta(hours=1)).execute()
+    invalid_tokens.add(token)  # as if it was looked up here before the sync
+    assert live_tokens.sync() >= 1
+    assert token not in invalid_tokens
+    assert get_session(token) is not None
+
+
+def test_live_token_filter_new_session(user):
+    live_tokens.rebuild()
+
+    # Created by another worker or replica since the last sync; the filter misses it, but it's still found
+    token = Session.generate_token()
+    Session.insert(user=user, token=token, expiry=utc_now() + timedelta(hours=1)).execute()
+    late = live_tokens.stats()["late"]
+    assert asyncio.run(get_session_async(token)) is not None
+    assert live_tokens.stats()["late"] == late + 1
+    assert token not in invalid_tokens
+
+
+def test_live_token_filter_shares_syncs():
+    live_tokens.rebuild()
+    syncs = live_tokens.stats()["miss_syncs"]
+
+    async def run():
+        return await asyncio.gather(*[get_session_async(Session.generate_token()) for _ in range(200)])
+
+    # Misses arriving together share a sync, rather than each looking up its token
+    with max_queries(2):
+        assert asyncio.run(run()) == [None] * 200
+    assert live_tokens.stats()["miss_syncs"] - syncs <= 2
+
+
+def test_live_token_filter_misses_free_db_threads():
+    live_tokens.rebuild()
+    # Without the filter's false positives, which are simply looked up
+    tokens = [
+        token for token in (Session.generate_token() for _ in range(50)) if not live_tokens.might_exist(token)
+    ]
+
+    async def run():
+        # Holding up the sync; misses wait for it on the event loop, not on database threads
+        with live_tokens._sync_lock:
+            misses = [asyncio.ensure_future(get_session_async(token)) for token in tokens]
+            await asyncio.sleep(0.1)
+            assert not any(miss.done() for miss in misses)
+            assert await asyncio.wait_for(run_query(lambda: "free"), 1) == "free"
+        return await asyncio.gather(*misses)
+
+    assert asyncio.run(run()) == [None] * len(tokens)
+
+
+def test_reap_expired_sessions(db, user, session):
+    # Far enough in the past to not interfere with other tests' expired sessions
+    long_ago = utc_now() - timedelta(days=1000)
+    expired = []
+    for _ in range(5):
+        expired.append(
+            Session.create(
+                user=user,
+                token=Session.generate_token(),
+                created_at=long_ago - timedelta(hours=2),
+                expiry=long_ago - timedelta(hours=1),
+            )
+        )
+
+    # Small batches, so several are needed
+    assert reap_expired_sessions(batch_size=2, now=long_ago) >= 5
+    assert Session.select().where(Session.token.in_([s.token for s in expired])).count() == 0
+    assert Session.get_or_none(Session.token == session.token) is not None
+
+
+def test_reap_expired_sessions_locked(db, expired_session):
+    # Another process is already reaping
+    db.execute_sql("SELECT pg_advisory_lock(%s)", (REAPER_LOCK_ID,))
+    try:
+        result = []
+        thread = threading.Thread(target=lambda: result.append(reap_expired_sessions()))
+        thread.start()
+        thread.join()
+        assert result == [None]
+    finally:
+        db.execute_sql("SELECT pg_advisory_unlock(%s)", (REAPER_LOCK_ID,))
+
+    assert Session.get_or_none(Session.token == expired_session.token) is not None
+
+
+def test_last_used_buffered(session):
+    first, second = utc_now(), utc_now() + timedelta(minutes=1)
+    session.use(now=second)
+    session.use(now=first)
+
+    # Not written until flushed, and only the newest timestamp is kept
+    assert Session.get(Session.token == session.token).last_used is None
+    assert last_used_buffer.pending(session.token) == second
+
+    assert last_used_buffer.flush() >= 1
+    assert last_used_buffer.pending(session.token) is None
+    assert Session.get(Session.token == session.token).last_used is not None
+
+
+def test_session_cache_invalidation_broadcast(user, session):
+    # Another process's cache, told about the revocation through the database
+    from linkpulse.notify import InvalidationListener
+    from linkpulse.tokens import revoke_session
+
+    other = SessionCache(maxsize=10, ttl=60)
+    listener = InvalidationListener(other, channel="linkpulse_sessions")
+    other.put(get_session(session.token))
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        listener.start(loop)
+        try:
+            assert await loop.run_in_executor(None, listener.listening.wait, 5)
+            await loop.run_in_executor(None, revoke_session, session)
+            deadline = time.monotonic() + 2
+            while other.get(session.token) is not None:
+                assert time.monotonic() < deadline, "invalidation wasn't received"
+                await asyncio.sleep(0.005)
+        finally:
+            listener.stop()
+
+    asyncio.run(run())
+    assert listener.stats()["invalidations_received"] == 1
@@ -0,0 +1,41 @@
+import fcntl
+import os
+import time
+
+from linkpulse.sharedtable import SharedTable
+
+
+def test_shared_table_find(tmp_path):
+    table = SharedTable(str(tmp_path / "table"), slots=4, slot_bytes=SharedTable.HEAD.size, probes=2)
+    now = time.time()
+
+    with table.locked():
+        assert table.find(1, now, insert=False) is None
+        slot = table.find(1, now, insert=True)
+        SharedTable.HEAD.pack_into(table.map, table.offset(slot), 1, now + 60)
+        assert table.find(1, now, insert=False) == slot
+
+        # Both probed slots live: the one closest to expiring is evicted
+        SharedTable.HEAD.pack_into(table.map, table.offset((slot + 1) % 4), 5, now + 30)
+        assert table.find(9, now, insert=True) == (slot + 1) % 4
+        assert table.evictions == 1
+        assert table.live(now) == 2
+
+
+def test_shared_table_fork(tmp_path):
+    table = SharedTable(str(tmp_path / "table"), slots=8, slot_bytes=64)
+    with table.locked():
+        pid = os.fork()
+        if pid == 0:
+            # The child reopens the file, so the parent's lock excludes it rather than being shared with it
+            try:
+                fcntl.flock(table._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os._exit(1)
+            except BlockingIOError:
+                os._exit(0)
+        _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+    # Still usable afterwards
+    with table.locked():
+        assert table.live(time.time()) == 0
@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+
+from linkpulse.startup_profile import ImportTime, parse, report
+
+OUTPUT = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:      1500 |       1500 |       peewee.fields
+import time:      2000 |       3500 |     peewee
+import time:       300 |       3800 |   linkpulse.models
+import time:       200 |       4000 | linkpulse
+"""
+
+
+def imported(module: str) -> list:
+    """The modules loaded by importing `module` in a fresh interpreter, without a database configured."""
+    env = {key: value for key, value in os.environ.items() if key != "DATABASE_URL"}
+    result = subprocess.run(
+        [sys.executable, "-c", f"import sys, {module}; print('\\n'.join(sys.modules))"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.splitlines()
+
+
+def test_parse():
+    entries = parse(OUTPUT)
+    assert entries[0] == ImportTime("_io", 120, 120, 1)
+    assert entries[1] == ImportTime("peewee.fields", 1500, 1500, 3)
+    assert entries[-1] == ImportTime("linkpulse", 200, 4000, 0)
+
+
+def test_report():
+    text = report(parse(OUTPUT), "linkpulse", top=2)
+    assert text.startswith("Importing linkpulse took 4.0ms (5 modules)")
+    # peewee & peewee.fields are counted together
+    assert text.splitlines()[3].split() == ["peewee", "3.5ms", "87.5%"]
+
+
+def test_models_import_lazily():
+    modules = imported("linkpulse.models")
+    # Neither the web framework nor the database connection are needed to define the models
+    assert "fastapi" not in modules
+    assert "linkpulse.app" not in modules
+
+
+def test_app_imports_lazily():
+    modules = imported("linkpulse.app")
+    for module in ("apscheduler", "pwdlib", "argon2", "fastapi_cache.backends.inmemory"):
+        assert module not in modules
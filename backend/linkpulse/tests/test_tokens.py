@@ -0,0 +1,131 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+from linkpulse import tokens
+from linkpulse.app import app
+from linkpulse.models import Session, SessionRevocation
+from linkpulse.routers import auth
+from linkpulse.sessions import get_session_user, get_signed_session
+from linkpulse.tests.queries import max_queries
+from linkpulse.tests.test_session import session
+from linkpulse.tests.test_user import user
+from linkpulse.tokens import RevocationList, TokenSigner, is_signed
+from linkpulse.utilities import utc_now
+
+
+@pytest.fixture
+def signer(monkeypatch):
+    signer = TokenSigner(b"test-signing-key")
+    monkeypatch.setattr(tokens, "signer", signer)
+    monkeypatch.setattr(tokens, "revocations", RevocationList())
+    monkeypatch.setattr(auth, "signer", signer)
+    monkeypatch.setattr(auth, "issue_signed", True)
+    return signer
+
+
+def test_token_sign_verify():
+    signer = TokenSigner(b"key")
+    expiry = (utc_now() + timedelta(hours=1)).replace(microsecond=0)
+    value = signer.sign("a" * 32, 42, expiry)
+
+    assert is_signed(value)
+    assert not is_signed("a" * 32)
+
+    claims = signer.verify(value)
+    assert claims is not None
+    assert (claims.token, claims.user_id, claims.expiry) == ("a" * 32, 42, expiry)
+
+
+def test_token_tampered():
+    signer = TokenSigner(b"key")
+    value = signer.sign("a" * 32, 42, utc_now() + timedelta(hours=1))
+    prefix, token, user_id, expiry, signature = value.split(".")
+
+    # Another user's ID, a later expiry, a different key and garbage are all rejected
+    assert signer.verify(".".join([prefix, token, "43", expiry, signature])) is None
+    assert signer.verify(".".join([prefix, token, user_id, str(int(expiry) + 1), signature])) is None
+    assert TokenSigner(b"other").verify(value) is None
+    assert signer.verify("v1.garbage") is None
+    assert signer.verify("v1.a.b.c.d.e") is None
+
+
+def test_token_signed_session(signer, user):
+    with TestClient(app) as client:
+        response = client.post("/api/login", json={"email": user.email, "password": "password"})
+        assert response.status_code == status.HTTP_200_OK
+        value = client.cookies.get("session")
+        assert is_signed(value.strip('"'))
+
+        # The session is validated in memory; only the user (returned by the endpoint) is loaded
+        with max_queries(1) as counter:
+            response = client.get("/api/session")
+            assert response.status_code == status.HTTP_200_OK
+        assert all('FROM "session"' not in query for query in counter.queries)
+
+        response = client.post("/api/logout")
+        assert response.status_code == status.HTTP_200_OK
+
+        # Revoked immediately in this process, and recorded for the others
+        token = signer.verify(value.strip('"')).token
+        assert token in tokens.revocations
+        assert SessionRevocation.get_or_none(SessionRevocation.token == token) is not None
+
+        client.cookies.set("session", value)
+        response = client.get("/api/session")
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_token_signed_expired(signer, session):
+    with TestClient(app) as client:
+        client.cookies.set(
+            "session", signer.sign(session.token, session.user_id, utc_now() - timedelta(seconds=1))
+        )
+        response = client.get("/api/session")
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_token_revoke_all(signer, user):
+    sessions = [
+        Session.create(user=user, token=Session.generate_token(), expiry=utc_now() + timedelta(hours=1))
+        for _ in range(3)
+    ]
+
+    assert tokens.revoke_user_sessions(user.id) == len(sessions)
+    assert all(session.token in tokens.revocations for session in sessions)
+
+    # Other processes pick up the revocations on their next refresh
+    revocations = RevocationList()
+    revocations.refresh()
+    assert all(session.token in revocations for session in sessions)
+
+
+def test_token_signed_session_user(signer, session):
+    value = signer.sign(session.token, session.user_id, session.expiry)
+    signed = get_signed_session(value)
+    assert signed is not None
+
+    # Loaded on demand, then kept
+    assert asyncio.run(get_session_user(signed)).id == session.user_id
+    with max_queries(0):
+        assert asyncio.run(get_session_user(signed)).id == session.user_id
+
+
+def test_token_revoke_during_refresh(monkeypatch):
+    revocations = RevocationList()
+
+    def now():
+        # Revoked (and committed) after the refresh started, but before its query ran
+        revocations.revoke("revoked-during-refresh")
+        return utc_now()
+
+    monkeypatch.setattr(tokens, "utc_now", now)
+    revocations.refresh()
+    assert "revoked-during-refresh" in revocations
+
+    # Once a refresh starts after it, the database is trusted (this one was never persisted, so it's dropped)
+    monkeypatch.setattr(tokens, "utc_now", utc_now)
+    revocations.refresh()
+    assert "revoked-during-refresh" not in revocations
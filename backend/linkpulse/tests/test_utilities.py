@@ -1,5 +1,8 @@
+import os
 import re
-from linkpulse.utilities import utc_now
+from linkpulse import utilities
+from linkpulse.utilities import cpu_count, get_client_key, utc_now
+from fastapi import Request
 from fastapi.testclient import TestClient
 
 from linkpulse.app import app
@@ -19,3 +22,30 @@ def test_api_version():
         version = response.json()["version"]
         assert isinstance(version, str)
         assert re.match(r"^\d+\.\d+\.\d+$", version)
+
+
+def test_get_client_key():
+    def request(*headers):
+        scope = {
+            "type": "http",
+            "headers": [(k.encode(), v.encode()) for k, v in headers],
+            "client": ("10.0.0.1", 80),
+        }
+        return Request(scope)
+
+    assert get_client_key(request()) == "10.0.0.1"
+    assert get_client_key(request(("x-real-ip", "192.0.2.1"))) == "192.0.2.1"
+    # Chosen by the client, so never trusted
+    assert get_client_key(request(("x-forwarded-for", "192.0.2.2"))) == "10.0.0.1"
+
+
+def test_cpu_count(monkeypatch):
+    available = len(os.sched_getaffinity(0))
+
+    # A container's CPU quota applies, rounded up, rather than the host's CPU count
+    monkeypatch.setattr(utilities, "_cgroup_cpu_quota", lambda: 0.5)
+    assert cpu_count() == 1
+    monkeypatch.setattr(utilities, "_cgroup_cpu_quota", lambda: available + 10.0)
+    assert cpu_count() == available
+    monkeypatch.setattr(utilities, "_cgroup_cpu_quota", lambda: None)
+    assert cpu_count() == available
@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+from linkpulse.app import app
+from linkpulse.metrics import registry
+from linkpulse.watchdog import LoopWatchdog, current_requests
+from structlog.testing import capture_logs
+
+
+def blocking_call(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+def test_watchdog_reports_blocking_call():
+    watchdog = LoopWatchdog(interval=0.01, threshold=0.05)
+
+    async def handler():
+        current_requests[asyncio.current_task()] = "request-1"
+        watchdog.start(asyncio.get_running_loop())
+        # Let the loop tick normally first
+        await asyncio.sleep(0.05)
+        blocking_call(0.3)
+        await asyncio.sleep(0.05)
+        watchdog.stop()
+
+    with capture_logs() as logs:
+        asyncio.run(handler())
+
+    stalls = [entry for entry in logs if entry["event"] == "Event loop blocked"]
+    # Reported once, while the loop was still blocked
+    assert len(stalls) == 1
+    assert stalls[0]["request_id"] == "request-1"
+    assert "blocking_call" in stalls[0]["stack"]
+    assert watchdog.stats()["stalls"] == 1
+    assert watchdog.stats()["lag_seconds_max"] >= 0.25
+
+
+def test_watchdog_quiet_loop():
+    watchdog = LoopWatchdog(interval=0.01, threshold=0.05)
+
+    async def idle():
+        watchdog.start(asyncio.get_running_loop())
+        await asyncio.sleep(0.2)
+        watchdog.stop()
+
+    with capture_logs() as logs:
+        asyncio.run(idle())
+
+    assert not any(entry["event"] == "Event loop blocked" for entry in logs)
+    assert watchdog.stats()["stalls"] == 0
+
+
+def test_watchdog_lag_histogram():
+    with TestClient(app) as client:
+        client.get("/health")
+        time.sleep(0.3)
+
+    assert "linkpulse_event_loop_lag_seconds_count" in registry.render()
@@ -0,0 +1,221 @@
+"""tokens.py
+This module provides stateless, signed session tokens and the revocation list that backs logging out of them.
+
+A signed token carries the session's (database) token, user ID & expiry along with an HMAC over them, so it can be
+validated entirely in memory. Sessions are still stored in the database, so listing sessions & logging out work the
+same for both token formats; revoked sessions are tracked in `SessionRevocation` and periodically loaded into memory.
+"""
+
+import base64
+import datetime
+import hashlib
+import hmac
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+
+import structlog
+from linkpulse.utilities import utc_now
+
+if TYPE_CHECKING:
+    from linkpulse.models import Session
+
+logger = structlog.get_logger()
+
+# Opaque tokens never contain a period, so signed tokens can be told apart by their prefix alone
+SIGNED_TOKEN_PREFIX = "v1."
+
+
+@dataclass(frozen=True)
+class TokenClaims:
+    token: str
+    user_id: int
+    expiry: datetime.datetime
+
+
+class TokenSigner:
+    """
+    Signs & verifies session tokens of the form `v1.<token>.<user id>.<expiry>.<signature>`, where the expiry is a
+    UNIX timestamp and the signature is an HMAC-SHA256 of everything before it.
+    """
+
+    def __init__(self, key: bytes):
+        self.key = key
+
+    def _signature(self, payload: str) -> str:
+        digest = hmac.new(self.key, payload.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+    def sign(self, token: str, user_id: int, expiry: datetime.datetime) -> str:
+        payload = f"{SIGNED_TOKEN_PREFIX}{token}.{user_id}.{int(expiry.timestamp())}"
+        return f"{payload}.{self._signature(payload)}"
+
+    def verify(self, value: str) -> Optional[TokenClaims]:
+        """
+        Get the claims of a signed token, or None if it was tampered with or is malformed.
+        Expiry is not checked here.
+        """
+        payload, _, signature = value.rpartition(".")
+        if not payload.startswith(SIGNED_TOKEN_PREFIX):
+            return None
+        if not hmac.compare_digest(signature, self._signature(payload)):
+            return None
+
+        try:
+            token, user_id, expiry = payload[len(SIGNED_TOKEN_PREFIX) :].split(".")
+            return TokenClaims(
+                token=token,
+                user_id=int(user_id),
+                expiry=datetime.datetime.fromtimestamp(int(expiry), tz=datetime.timezone.utc),
+            )
+        except ValueError:
+            return None
+
+
+def is_signed(value: str) -> bool:
+    return value.startswith(SIGNED_TOKEN_PREFIX)
+
+
+class RevocationList:
+    """
+    The set of sessions that were deleted before their expiry, held in memory so signed tokens can be checked without
+    a database lookup.
+
+    Revocations made by this process take effect immediately; those made by other processes (workers or replicas)
+    are picked up by `refresh`, so a revoked signed token may be accepted elsewhere for up to one refresh interval.
+    """
+
+    def __init__(self) -> None:
+        self._tokens: Set[str] = set()
+        self._lock = threading.Lock()
+        # Local revocations by generation, kept until a refresh that started after them has seen them in the database
+        self._generation = 0
+        self._recent: List[Tuple[int, Tuple[str, ...]]] = []
+
+        self.refreshes = 0
+        self.refresh_seconds_last = 0.0
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def __contains__(self, token: str) -> bool:
+        return token in self._tokens
+
+    def revoke(self, *tokens: str) -> None:
+        """Record revocations locally; the caller is responsible for persisting them (see `SessionRevocation`)."""
+        with self._lock:
+            self._tokens.update(tokens)
+            self._generation += 1
+            self._recent.append((self._generation, tokens))
+
+    def refresh(self) -> None:
+        """
+        Reload the set of unexpired revocations from the database. Local revocations made while it runs may be missing
+        from what it reads, so they're kept.
+        """
+        from linkpulse.database import connection_scope
+        from linkpulse.models import SessionRevocation
+
+        start_time = time.perf_counter()
+        with self._lock:
+            # Revocations are persisted before they're recorded here, so these are all in the database already
+            started = self._generation
+        with connection_scope():
+            query = SessionRevocation.select(SessionRevocation.token).where(
+                SessionRevocation.expiry > utc_now()
+            )
+            tokens = {token for (token,) in query.tuples()}
+
+        with self._lock:
+            self._recent = [
+                (generation, revoked) for generation, revoked in self._recent if generation > started
+            ]
+            for _, revoked in self._recent:
+                tokens.update(revoked)
+            self._tokens = tokens
+
+        self.refreshes += 1
+        self.refresh_seconds_last = time.perf_counter() - start_time
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "revoked": len(self._tokens),
+            "refreshes": self.refreshes,
+            "refresh_seconds_last": self.refresh_seconds_last,
+        }
+
+
+def revoke_session(session: "Session") -> None:
+    """
+    Delete a session, recording the revocation (if signed tokens are accepted) in the same transaction.
+    Blocking; run via `run_query` from async code.
+    """
+    from linkpulse.models import SessionRevocation
+    from linkpulse.sessions import session_listener
+
+    with session._meta.database.atomic():  # type: ignore[attr-defined]
+        if signer is not None:
+            SessionRevocation.insert(
+                token=session.token, expiry=session.expiry
+            ).on_conflict_ignore().execute()
+        session.delete_instance()
+        # Delivered to other processes once the transaction commits
+        if session_listener is not None:
+            session_listener.publish("user", str(session.user_id))
+
+    if signer is not None:
+        revocations.revoke(session.token)  # type: ignore[arg-type]
+
+
+def revoke_user_sessions(user_id: int) -> int:
+    """
+    Delete all of a user's sessions, recording the revocations (if signed tokens are accepted) in the same transaction.
+    Blocking; run via `run_query` from async code.
+
+    :return: The number of sessions deleted.
+    """
+    from linkpulse.models import Session, SessionRevocation
+    from linkpulse.sessions import session_listener
+
+    with Session._meta.database.atomic():  # type: ignore[attr-defined]
+        revoked = []
+        if signer is not None:
+            revoked = list(
+                Session.select(Session.token, Session.expiry).where(Session.user == user_id).tuples()
+            )
+            if len(revoked) > 0:
+                SessionRevocation.insert_many(
+                    revoked, fields=[SessionRevocation.token, SessionRevocation.expiry]
+                ).on_conflict_ignore().execute()
+        count = Session.delete().where(Session.user == user_id).execute()
+        if session_listener is not None:
+            session_listener.publish("user", str(user_id))
+
+    if len(revoked) > 0:
+        revocations.revoke(*(token for token, _ in revoked))
+    return count
+
+
+def _signing_key() -> Optional[bytes]:
+    key = os.getenv("SESSION_SIGNING_KEY")
+    if key is None or key.strip() == "":
+        return None
+    return key.encode()
+
+
+# Signed tokens are only accepted (and revocations only tracked) when a signing key is configured.
+_key = _signing_key()
+signer: Optional[TokenSigner] = TokenSigner(_key) if _key is not None else None
+
+# The format issued by `/api/login`: 'opaque' (database-backed) or 'signed'. Both are always accepted.
+issue_signed = os.getenv("SESSION_TOKEN_FORMAT", "opaque").lower() == "signed"
+if issue_signed and signer is None:
+    logger.warning(
+        "SESSION_TOKEN_FORMAT is 'signed' but SESSION_SIGNING_KEY is not set, issuing opaque tokens"
+    )
+    issue_signed = False
+
+revocations = RevocationList()
+revocation_refresh_interval = float(os.getenv("SESSION_REVOCATION_REFRESH_INTERVAL", "5"))
@@ -2,18 +2,62 @@
 This module provides utility functions for database connection, string manipulation, and IP address handling.
 """
 
+import math
 import os
 from datetime import datetime
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
 import pytz
-from fastapi import Request
 from peewee import PostgresqlDatabase
 
+if TYPE_CHECKING:
+    # Importing FastAPI takes a while, and the models (via this module) are also used outside the app
+    from fastapi import Request
+
 # globally referenced
 is_development = os.getenv("ENVIRONMENT") == "development"
 
 
+def _cgroup_cpu_quota() -> Optional[float]:
+    """The CPUs' worth of time this process's cgroup may use, or None if it isn't limited."""
+    try:
+        # cgroup v2: '<quota> <period>', or 'max <period>' when unlimited
+        with open("/sys/fs/cgroup/cpu.max") as file:
+            quota, period = file.read().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1: a quota of -1 is unlimited
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as quota_file:
+            quota_us = int(quota_file.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as period_file:
+            period_us = int(period_file.read())
+        return None if quota_us <= 0 else quota_us / period_us
+    except (OSError, ValueError):
+        return None
+
+
+def cpu_count() -> int:
+    """
+    The number of CPUs this process may actually use: those it's allowed to run on, limited by its cgroup's CPU quota.
+    In a container, `os.cpu_count` reports every CPU on the host instead.
+    """
+    count = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    quota = _cgroup_cpu_quota()
+    if quota is not None:
+        count = min(count, math.ceil(quota))
+    return max(1, count)
+
+
+def worker_count() -> int:
+    """
+    The number of worker processes serving the app on this host, which per-process resources (pools, caches) are sized
+    by. Set by `linkpulse.serve` for its workers (`WEB_CONCURRENCY`); otherwise assumed to be 1.
+    """
+    return max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+
 def utc_now() -> datetime:
     """
     A utility function to replace the deprecated datetime.datetime.utcnow() function.
@@ -42,7 +86,7 @@ def pluralize(count: int, word: Optional[str] = None) -> str:
     return "s" if count != 1 else ""
 
 
-def get_ip(request: Request) -> Optional[str]:
+def get_ip(request: "Request") -> Optional[str]:
     """
     This function attempts to retrieve the client's IP address from the request headers.
 
@@ -67,6 +111,17 @@ def get_ip(request: Request) -> Optional[str]:
     return None
 
 
+def get_client_key(request: "Request") -> Optional[str]:
+    """
+    Identify the client for rate limiting & fair queuing: the 'X-Real-IP' header set by the reverse proxy, else the
+    direct connection's IP address. Unlike 'X-Forwarded-For', clients can't choose it behind the proxy.
+    """
+    key = request.headers.get("X-Real-IP")
+    if key is None and request.client is not None:
+        key = request.client.host
+    return key
+
+
 def hide_ip(ip: str, hidden_octets: Optional[int] = None) -> str:
     """
     Hide the last octet(s) of an IP address.
@@ -0,0 +1,114 @@
+"""watchdog.py
+This module watches the event loop for stalls, i.e. synchronous work blocking every other request.
+
+A callback on the loop ticks every `interval` seconds, recording how late each tick ran as the loop's lag. A separate
+thread watches those ticks: once the loop has gone `threshold` seconds past a due tick, the loop is blocked right now,
+so the loop thread's stack at that moment is the blocking code. It is logged along with the ID of the request whose
+task was running.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+import weakref
+from typing import Any, Dict, Optional
+
+import structlog
+from linkpulse.metrics import registry
+
+loop_lag = registry.histogram(
+    "linkpulse_event_loop_lag_seconds",
+    "How late event loop callbacks ran.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+loop_stalls = registry.counter("linkpulse_event_loop_stalls_total", "Times the event loop was blocked.")
+
+# The request ID handled by each running task (see `LoggingMiddleware`), so a stall can be attributed to a request
+current_requests: "weakref.WeakKeyDictionary[asyncio.Task, str]" = weakref.WeakKeyDictionary()
+
+
+class LoopWatchdog:
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+        self.logger = structlog.get_logger(__name__)
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._last_tick = 0.0
+        self._expected_tick = 0.0
+        self._reported_tick = 0.0
+
+        self.stalls = 0
+        self.lag_max = 0.0
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Start watching `loop`; must be called from the loop's own thread."""
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        self._last_tick = self._expected_tick = time.perf_counter()
+        self._handle = loop.call_soon(self._tick)  # type: ignore
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="linkpulse-loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _tick(self) -> None:
+        now = time.perf_counter()
+        lag = max(0.0, now - self._expected_tick)
+        loop_lag.observe(lag)
+        self.lag_max = max(self.lag_max, lag)
+
+        self._last_tick = now
+        self._expected_tick = now + self.interval
+        self._handle = self._loop.call_later(self.interval, self._tick)  # type: ignore
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval):
+            last_tick = self._last_tick
+            blocked = time.perf_counter() - last_tick - self.interval
+            # Report each stall once, while it's still happening
+            if blocked < self.threshold or last_tick == self._reported_tick:
+                continue
+            self._reported_tick = last_tick
+            self.stalls += 1
+            loop_stalls.inc()
+            self._report(blocked)
+
+    def _report(self, blocked: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread)  # type: ignore
+        task = asyncio.current_task(self._loop)
+        self.logger.warning(
+            "Event loop blocked",
+            blocked_ms="{:.2f}".format(blocked * 1000),
+            request_id=current_requests.get(task) if task is not None else None,
+            task=task.get_name() if task is not None else None,
+            stack="".join(traceback.format_stack(frame)) if frame is not None else None,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {"stalls": self.stalls, "lag_seconds_max": self.lag_max}
+
+
+# Disabled with LOOP_WATCHDOG=false
+watchdog_enabled = os.getenv("LOOP_WATCHDOG", "true").lower() == "true"
+watchdog = LoopWatchdog(
+    interval=float(os.getenv("LOOP_WATCHDOG_INTERVAL", "0.1")),
+    threshold=float(os.getenv("LOOP_WATCHDOG_THRESHOLD", "0.25")),
+)